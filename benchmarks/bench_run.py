@@ -0,0 +1,339 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+端到端基准测试：在本地的假 DoH 服务器和假华为云 DNS API 上运行合成的负载，
+测量各阶段的耗时、请求次数和内存峰值，以 JSON 格式输出，便于在不同提交之间对比
+
+用法：python benchmarks/bench_run.py [--items N] [--sources M] [--recordsets R] ...
+"""
+
+
+import os
+import gc
+import sys
+import time
+import json
+import random
+import asyncio
+import zipfile
+import argparse
+import resource
+import ipaddress
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import dns_record_updater as updater
+from fake_servers import FakeDoh, FakeHwDns, FakeServers
+from huaweicloudsdkdns.v2 import DnsClient
+from huaweicloudsdkcore.region.region import Region
+from huaweicloudsdkcore.auth.credentials import BasicCredentials
+
+
+# 合成 IP 地址数据包中各运营商的 IPv4、IPv6 前缀数，与 china-operator-ip 的规模相近
+ip_list_sizes = {
+    "china": (8000, 3000),
+    "chinanet": (4000, 300),
+    "unicom": (2500, 100),
+    "cmcc": (2000, 150),
+    "cernet": (600, 50),
+    "cstnet": (150, 20),
+    "drpeng": (300, 0),
+    "tietong": (700, 0),
+    "googlecn": (10, 0),
+}
+
+
+def write_ip_lists(path: str, rng: random.Random):
+    """
+    生成与 china-operator-ip 的 ip-lists 分支格式相同的数据包
+    """
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as f:
+        for org, (v4_num, v6_num) in ip_list_sizes.items():
+            v4 = [
+                str(ipaddress.IPv4Network((rng.getrandbits(24) << 8, rng.randint(16, 24)), strict=False))
+                for _ in range(v4_num)
+            ]
+            v6 = [
+                str(ipaddress.IPv6Network((0x2400 << 112 | rng.getrandbits(32) << 80, 48)))
+                for _ in range(v6_num)
+            ]
+            f.writestr(f"china-operator-ip-ip-lists/{org}.txt", "\n".join(v4))
+            if v6:
+                f.writestr(f"china-operator-ip-ip-lists/{org}6.txt", "\n".join(v6))
+
+
+def build_workload(args: argparse.Namespace) -> tuple[list[dict], FakeHwDns]:
+    """
+    生成更新项目和 API 中已有的记录集，返回 (更新项目列表, 假 API)
+
+    每个更新项目同时设置 A 和 AAAA 记录，从来源池中选 sources 个来源；
+    约一半项目已有过期的 A 记录集（需要更新），其余需要新增；
+    另有 recordsets 个无关的记录集平均分布在各 Zone 中
+    """
+    rng = random.Random(args.seed)
+    zones = {f"zone{z}.bench.": f"z{z}" for z in range(args.zones)}
+    pool = [f"src{s}.cdn.bench" for s in range(args.source_pool)]
+    items = []
+    recordsets = []
+    for i in range(args.items):
+        zone = i % args.zones
+        name = f"item{i}.zone{zone}.bench."
+        items.append(
+            {
+                "domain": name,
+                "type": ["A", "AAAA"],
+                "sources": rng.sample(pool, min(args.sources, len(pool))),
+                "ttl": 300,
+            }
+        )
+        if i % 2 == 0:
+            recordsets.append(
+                {
+                    "id": f"rs-item{i}",
+                    "zone_id": f"z{zone}",
+                    "name": name,
+                    "type": "A",
+                    "ttl": 300,
+                    "records": ["192.0.2.1"],
+                    "description": "",
+                    "status": "ACTIVE",
+                }
+            )
+    for r in range(args.recordsets):
+        zone = r % args.zones
+        recordsets.append(
+            {
+                "id": f"rs-filler{r}",
+                "zone_id": f"z{zone}",
+                "name": f"filler{r}.zone{zone}.bench.",
+                "type": "TXT",
+                "ttl": 300,
+                "records": [f'"filler {r}"'],
+                "description": "",
+                "status": "ACTIVE",
+            }
+        )
+    return items, FakeHwDns(zones, recordsets, args.api_latency, args.api_throttle)
+
+
+class Bench:
+    def __init__(self, args: argparse.Namespace, servers: FakeServers):
+        self.args: argparse.Namespace = args
+        self.servers: FakeServers = servers
+        self.results: dict[str, dict] = {}
+
+    async def measure(self, name: str, func, setup=None):
+        """
+        执行 func 测量耗时和请求次数；开启内存测量时再用 tracemalloc 执行一次，记录 Python 内存峰值
+        """
+        doh = self.servers.doh
+        hw_dns = self.servers.hw_dns
+        if setup:
+            await setup()
+        gc.collect()
+        doh_queries = doh.queries
+        api_calls = dict(hw_dns.calls)
+        start = time.perf_counter()
+        await func()
+        result = {
+            "wall_s": time.perf_counter() - start,
+            "doh_queries": doh.queries - doh_queries,
+            "api_calls": {
+                method: calls - api_calls.get(method, 0)
+                for method, calls in hw_dns.calls.items()
+                if calls != api_calls.get(method, 0)
+            },
+        }
+        if self.args.memory:
+            if setup:
+                await setup()
+            gc.collect()
+            tracemalloc.start()
+            await func()
+            result["peak_memory_bytes"] = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        self.results[name] = result
+        print(f"{name}: {result['wall_s']:.3f} s", file=sys.stderr)
+
+
+async def bench(args: argparse.Namespace, tmpdir: str) -> dict:
+    cfg = updater.ServerCfg
+    items, hw_dns = build_workload(args)
+    servers = FakeServers(FakeDoh(args.records_per_name, args.doh_latency), hw_dns)
+    doh_url, api_url = servers.start()
+    config = {
+        "server_config": {
+            "dns_query_server": doh_url,
+            "hw_api_ak": "bench",
+            "hw_api_sk": "bench",
+            "max_content_num": 50,
+            "api_rate_limit": 0,
+        },
+        "update_items": items,
+    }
+    cfg.config_filepath = os.path.join(tmpdir, "config.yaml")
+    with open(cfg.config_filepath, "w", encoding="utf-8") as f:
+        json.dump(config, f)
+    if args.ip_lists:
+        cfg.ip_lists_filepath = args.ip_lists
+    else:
+        cfg.ip_lists_filepath = os.path.join(tmpdir, "ip-lists.zip")
+        write_ip_lists(cfg.ip_lists_filepath, random.Random(args.seed))
+    cfg.ip_index_filepath = os.path.join(tmpdir, "ip-lists.idx")
+    # 不下载 IP 地址数据包
+    cfg.ip_lists_refresh_interval = 1 << 40
+    b = Bench(args, servers)
+    up_items: list[updater.UpItem] = []
+
+    async def read_config():
+        up_items[:] = await updater.read_config()
+
+    async def reset_config_cache():
+        cfg.config_cache = updater.ConfigCache()
+
+    async def change_one_item():
+        # 修改一个更新配置，其余沿用上次解析的结果
+        items[0]["ttl"] += 1
+        with open(cfg.config_filepath, "w", encoding="utf-8") as f:
+            json.dump(config, f)
+
+    await b.measure("read_config", read_config, reset_config_cache)
+    await b.measure("read_config_reload", read_config, change_one_item)
+    cfg.dns_query_semaphore = asyncio.Semaphore(cfg.dns_query_limit)
+    cfg.probe_semaphore = asyncio.Semaphore(cfg.probe_limit)
+    cfg.health_cache = updater.HealthCache()
+    session = updater.create_session()
+    cfg.ip_db.session = session
+
+    async def reset_dns_cache():
+        cfg.dns_cache = updater.DnsCache()
+
+    async def lookup_records():
+        await asyncio.gather(
+            *[
+                updater.lookup_records(
+                    up_item.sources, up_item.record_type, session, up_item.name
+                )
+                for up_item in up_items
+            ]
+        )
+
+    await b.measure("lookup_records", lookup_records, reset_dns_cache)
+
+    async def reset_ip_db():
+        cfg.ip_db = updater.IpDatabase()
+        cfg.ip_db.session = session
+
+    async def remove_index():
+        await reset_ip_db()
+        if os.path.exists(cfg.ip_index_filepath):
+            os.remove(cfg.ip_index_filepath)
+
+    rng = random.Random(args.seed)
+    addresses = [
+        str(ipaddress.IPv4Address(rng.getrandbits(32))) for _ in range(args.ip_lookups)
+    ]
+
+    async def get_ip_org():
+        for address in addresses:
+            await updater.get_ip_org(address)
+
+    async def first_lookup():
+        await updater.get_ip_org("1.1.1.1")
+
+    await b.measure("get_ip_org_build_index", first_lookup, remove_index)
+    await b.measure("get_ip_org_load_index", first_lookup, reset_ip_db)
+    await b.measure("get_ip_org", get_ip_org)
+    b.results["get_ip_org"]["lookups"] = len(addresses)
+
+    async def choose_ips():
+        for org in ip_list_sizes:
+            await updater.choose_ips(50, org, seed=args.seed)
+
+    await b.measure("choose_ips", choose_ips, reset_ip_db)
+
+    region = Region("bench", api_url)
+    credentials = BasicCredentials("bench", "bench", "bench")
+    client = DnsClient.new_builder().with_credentials(credentials).with_region(region).build()
+    api = updater.HwDnsApi(client)
+    matchers = []
+
+    async def get_zones():
+        matchers[:] = [updater.ZoneMatcher(await updater.get_zones(api))]
+
+    async def get_recordset_list():
+        snapshot = updater.ZoneSnapshot(api, matchers[0], up_items)
+        await asyncio.gather(
+            *[updater.get_recordset_list(snapshot, up_item) for up_item in up_items]
+        )
+
+    await b.measure("get_zones", get_zones)
+    await b.measure("get_recordset_list", get_recordset_list)
+
+    async def reset_state():
+        servers.hw_dns.reset()
+        api.retries_by_method.clear()
+        await reset_dns_cache()
+        await reset_ip_db()
+        for up_item in up_items:
+            up_item.content = list(up_item.extra)
+
+    async def reconcile():
+        await updater.resolve_up_items(session, up_items)
+        provider = updater.HuaweiDnsProvider(api)
+        await updater.sync_up_items([provider], {provider.name: up_items})
+
+    await b.measure("reconcile", reconcile, reset_state)
+    b.results["reconcile"]["api_throttled"] = servers.hw_dns.throttled
+    b.results["reconcile"]["api_retries"] = dict(api.retries_by_method)
+    api.close()
+    await session.close()
+    servers.stop()
+    return {
+        "workload": {
+            "items": args.items,
+            "sources": args.sources,
+            "source_pool": args.source_pool,
+            "records_per_name": args.records_per_name,
+            "zones": args.zones,
+            "recordsets": args.recordsets,
+            "doh_latency_s": args.doh_latency,
+            "api_latency_s": args.api_latency,
+            "api_throttle": args.api_throttle,
+        },
+        "results": b.results,
+        "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--items", type=int, default=200, help="更新项目数")
+    parser.add_argument("--sources", type=int, default=7, help="每个项目的来源数")
+    parser.add_argument("--source-pool", type=int, default=100, help="来源池大小")
+    parser.add_argument("--records-per-name", type=int, default=4, help="每个来源的记录数")
+    parser.add_argument("--zones", type=int, default=10, help="Zone 数")
+    parser.add_argument("--recordsets", type=int, default=20000, help="无关的记录集数")
+    parser.add_argument("--doh-latency", type=float, default=0.005, help="DoH 延迟（秒）")
+    parser.add_argument("--api-latency", type=float, default=0.02, help="API 延迟（秒）")
+    parser.add_argument("--api-throttle", type=float, default=0, help="API 请求被限流的概率")
+    parser.add_argument("--ip-lists", default="", help="使用真实的 ip-lists.zip")
+    parser.add_argument("--ip-lookups", type=int, default=10000, help="get_ip_org 的查询次数")
+    parser.add_argument("--no-memory", dest="memory", action="store_false", help="不测量内存")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="-", help="结果文件，默认为标准输出")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    updater.logging.disable(updater.logging.WARNING)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        report = json.dumps(asyncio.run(bench(args, tmpdir)), indent=2)
+    if args.output == "-":
+        print(report)
+    else:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(report)
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+启动基准测试：测量冷启动（解释器启动和导入模块）以及没有变化时完整运行一次的耗时
+
+没有变化的运行使用本地的假 DoH 服务器，并预先写入状态文件和 API 服务器延迟排名，
+不访问网络，也不应导入华为云 SDK
+
+用法：python benchmarks/bench_startup.py [--repeat N] [--items N]
+"""
+
+
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import statistics
+import subprocess
+import tempfile
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+import dns_record_updater as updater
+from fake_servers import FakeDoh, FakeHwDns, FakeServers
+
+
+# 在子进程中运行一次，输出是否导入了华为云 SDK
+NOOP_RUN = """
+import sys, asyncio
+import dns_record_updater
+asyncio.run(dns_record_updater.run())
+print("huaweicloudsdkdns.v2" in sys.modules)
+"""
+
+
+def timed_subprocess(args: list[str], cwd: str) -> tuple[float, str]:
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    start = time.perf_counter()
+    result = subprocess.run(
+        args, cwd=cwd, env=env, capture_output=True, text=True, check=True
+    )
+    return time.perf_counter() - start, result.stdout
+
+
+async def prime_state(tmpdir: str):
+    """
+    按正常流程查询一次并记录状态，之后的运行都没有变化
+    """
+    cfg = updater.ServerCfg
+    up_items = await updater.read_config()
+    cfg.dns_query_semaphore = asyncio.Semaphore(cfg.dns_query_limit)
+    cfg.probe_semaphore = asyncio.Semaphore(cfg.probe_limit)
+    cfg.dns_cache = updater.DnsCache()
+    cfg.health_cache = updater.HealthCache()
+    session = updater.create_session()
+    try:
+        await updater.resolve_up_items(session, up_items)
+    finally:
+        await session.close()
+    state = updater.RunState(cfg.state_filepath)
+    state.record(state.changed(up_items))
+    with open(cfg.region_cache_filepath, "w", encoding="utf-8") as f:
+        json.dump({"updated": time.time(), "regions": ["cn-north-4"]}, f)
+
+
+def bench(args: argparse.Namespace, tmpdir: str) -> dict:
+    servers = FakeServers(FakeDoh(latency=args.doh_latency), FakeHwDns({}, []))
+    doh_url, _ = servers.start()
+    config = {
+        "server_config": {
+            "dns_query_server": doh_url,
+            "hw_api_ak": "bench",
+            "hw_api_sk": "bench",
+            "max_content_num": 50,
+            "state_filepath": os.path.join(tmpdir, "state.json"),
+            "region_cache_filepath": os.path.join(tmpdir, "region-cache.json"),
+        },
+        "update_items": [
+            {
+                "domain": f"item{i}.bench.",
+                "type": ["A", "AAAA"],
+                "sources": [f"src{i}-{j}.cdn.bench" for j in range(7)],
+            }
+            for i in range(args.items)
+        ],
+    }
+    updater.ServerCfg.config_filepath = os.path.join(tmpdir, "dns_record_updater.yaml")
+    with open(updater.ServerCfg.config_filepath, "w", encoding="utf-8") as f:
+        json.dump(config, f)
+    asyncio.run(prime_state(tmpdir))
+
+    python = sys.executable
+    cold_import = [
+        timed_subprocess([python, "-c", "import dns_record_updater"], tmpdir)[0]
+        for _ in range(args.repeat)
+    ]
+    interpreter = [
+        timed_subprocess([python, "-c", "pass"], tmpdir)[0] for _ in range(args.repeat)
+    ]
+    noop_run = []
+    sdk_imported = False
+    for _ in range(args.repeat):
+        elapsed, stdout = timed_subprocess([python, "-c", NOOP_RUN], tmpdir)
+        noop_run.append(elapsed)
+        sdk_imported |= stdout.strip().endswith("True")
+    servers.stop()
+    return {
+        "repeat": args.repeat,
+        "items": args.items,
+        "interpreter_s": statistics.median(interpreter),
+        "cold_import_s": statistics.median(cold_import),
+        "noop_run_s": statistics.median(noop_run),
+        "noop_sdk_imported": sdk_imported,
+    }
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5, help="每项的运行次数，取中位数")
+    parser.add_argument("--items", type=int, default=8, help="更新项目数")
+    parser.add_argument("--doh-latency", type=float, default=0.005, help="DoH 延迟（秒）")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    updater.logging.disable(updater.logging.WARNING)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        print(json.dumps(bench(args, tmpdir), indent=2))
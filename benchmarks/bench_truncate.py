@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+截断策略基准测试：在合成的运营商 IP 数据上，测量批量分类和各截断策略的耗时
+
+用法：python benchmarks/bench_truncate.py [记录数] [来源数]
+"""
+
+
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import ipaddress
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import dns_record_updater as updater
+
+
+def synthetic_ip_lists(rng: random.Random, orgs: int = 8, prefixes: int = 4000):
+    """
+    生成 orgs 个运营商、每个 prefixes 个 /24 的 IP 地址数据
+    """
+    ip_lists = {}
+    for org in range(orgs):
+        ip_lists[f"org{org}"] = [
+            str(ipaddress.IPv4Network((rng.getrandbits(24) << 8, 24)))
+            for _ in range(prefixes)
+        ]
+    return ip_lists
+
+
+async def bench(records_num: int, sources_num: int) -> dict:
+    rng = random.Random(0)
+    ip_lists = synthetic_ip_lists(rng)
+    start = time.perf_counter()
+    index = updater.IpIndex.build(ip_lists)
+    result = {"build_index_s": time.perf_counter() - start}
+    updater.ServerCfg.ip_db.index = index
+    updater.ServerCfg.ip_db.index_loaded_at = time.time()
+    # 一半记录落在运营商的地址段内
+    networks = [ipaddress.IPv4Network(cidr) for cidrs in ip_lists.values() for cidr in cidrs]
+    contents = [[] for _ in range(sources_num)]
+    for i in range(records_num):
+        if i % 2:
+            address = rng.choice(networks)[rng.randrange(256)]
+        else:
+            address = ipaddress.IPv4Address(rng.getrandbits(32))
+        contents[i % sources_num].append(str(address))
+    records = [record for content in contents for record in content]
+
+    start = time.perf_counter()
+    await updater.get_ips_org(records)
+    result["classify_s"] = time.perf_counter() - start
+
+    for strategy in ("round_robin", "source_weight", "stable_hash"):
+        start = time.perf_counter()
+        chosen = await updater.truncate_records(
+            [list(content) for content in contents],
+            "A",
+            "bench.example.",
+            updater.ServerCfg.max_content_num,
+            strategy,
+        )
+        result[f"{strategy}_s"] = time.perf_counter() - start
+        assert len(chosen) == updater.ServerCfg.max_content_num
+    result.update(records=records_num, sources=sources_num)
+    return result
+
+
+if __name__ == "__main__":
+    records_num = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    sources_num = int(sys.argv[2]) if len(sys.argv) > 2 else 7
+    updater.logging.disable(updater.logging.WARNING)
+    print(json.dumps(asyncio.run(bench(records_num, sources_num)), indent=2))
@@ -0,0 +1,340 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+基准测试用的本地服务：假 DoH 服务器和假华为云 DNS API，均可注入固定延迟
+
+两者运行在独立线程的事件循环中，避免与被测代码争用同一个事件循环
+"""
+
+
+import copy
+import json
+import random
+import struct
+import asyncio
+import hashlib
+import ipaddress
+import threading
+from collections import defaultdict
+
+from aiohttp import web
+
+
+def synthetic_records(name: str, record_type: str, num: int) -> list[str]:
+    """
+    按域名生成固定的记录值，多次运行结果相同
+    """
+    records = []
+    for i in range(num):
+        digest = hashlib.blake2b(f"{name}|{record_type}|{i}".encode()).digest()
+        if record_type == "A":
+            records.append(str(ipaddress.IPv4Address(digest[:4])))
+        else:
+            records.append(str(ipaddress.IPv6Address(b"\x24\x0e" + digest[:14])))
+    return records
+
+
+class FakeDoh:
+    """
+    DoH 服务器，每个域名返回 records_per_name 条 A、AAAA 记录
+
+    GET 请求按 JSON 格式（application/dns-json）响应，POST 请求按 RFC 8484 的
+    application/dns-message 格式响应；fail 为 True 时所有请求都返回 500
+    """
+
+    type_codes = {"A": 1, "AAAA": 28}
+
+    def __init__(
+        self, records_per_name: int = 4, latency: float = 0, fail: bool = False
+    ):
+        self.records_per_name: int = records_per_name
+        self.latency: float = latency
+        self.fail: bool = fail
+        self.queries: int = 0
+
+    async def delay(self):
+        self.queries += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.fail:
+            raise web.HTTPInternalServerError()
+
+    async def handle(self, request: web.Request) -> web.Response:
+        await self.delay()
+        name = request.query["name"]
+        record_type = request.query["type"]
+        type_code = self.type_codes.get(record_type)
+        if type_code is None:
+            return web.json_response(
+                {"Status": 0, "Authority": [{"name": name, "type": 6, "TTL": 300}]}
+            )
+        return web.json_response(
+            {
+                "Status": 0,
+                "Answer": [
+                    {"name": name, "type": type_code, "TTL": 300, "data": record}
+                    for record in synthetic_records(
+                        name, record_type, self.records_per_name
+                    )
+                ],
+            }
+        )
+
+    async def handle_wire(self, request: web.Request) -> web.Response:
+        await self.delay()
+        query = await request.read()
+        # 只支持一个问题、没有压缩指针的查询报文
+        query_id = struct.unpack_from("!H", query)[0]
+        labels = []
+        offset = 12
+        while query[offset]:
+            labels.append(query[offset + 1 : offset + 1 + query[offset]].decode())
+            offset += 1 + query[offset]
+        offset += 1
+        type_code = struct.unpack_from("!H", query, offset)[0]
+        question = query[12 : offset + 4]
+        # 与 JSON 格式查询参数中的域名相同，生成的记录一致
+        name = ".".join(labels)
+        record_type = {code: t for t, code in self.type_codes.items()}.get(type_code)
+        answers = b""
+        if record_type is not None:
+            for record in synthetic_records(name, record_type, self.records_per_name):
+                rdata = ipaddress.ip_address(record).packed
+                # 所有者域名用指向问题中域名的压缩指针
+                answers += struct.pack("!HHHIH", 0xC00C, type_code, 1, 300, len(rdata))
+                answers += rdata
+            authority = b""
+        else:
+            # 没有记录时在 Authority 中返回 SOA，只用到其 TTL
+            rdata = b"\x00\x00" + struct.pack("!IIIII", 1, 3600, 600, 86400, 300)
+            authority = struct.pack("!HHHIH", 0xC00C, 6, 1, 300, len(rdata)) + rdata
+        header = struct.pack(
+            "!HHHHHH",
+            query_id,
+            0x8180,
+            1,
+            self.records_per_name if answers else 0,
+            1 if authority else 0,
+            0,
+        )
+        return web.Response(
+            body=header + question + answers + authority,
+            content_type="application/dns-message",
+        )
+
+    def routes(self) -> list:
+        return [
+            web.get("/dns-query", self.handle),
+            web.post("/dns-query", self.handle_wire),
+        ]
+
+
+class FakeHwDns:
+    """
+    华为云 DNS API 中本项目用到的接口，按 SDK 的资源路径和 JSON 格式响应
+
+    zones 为 {Zone 名: Zone ID}，recordsets 为初始的记录集列表，reset() 恢复初始状态；
+    throttle 为请求被限流（返回 429 和 API 网关的流控错误码）的概率
+    """
+
+    def __init__(
+        self,
+        zones: dict[str, str],
+        recordsets: list[dict],
+        latency: float = 0,
+        throttle: float = 0,
+    ):
+        self.zones: dict[str, str] = zones
+        self.initial: list[dict] = recordsets
+        self.latency: float = latency
+        self.throttle: float = throttle
+        self.rng = random.Random(0)
+        self.reset()
+
+    def reset(self):
+        self.recordsets: dict[str, dict] = {
+            recordset["id"]: copy.deepcopy(recordset) for recordset in self.initial
+        }
+        self.by_zone: dict[str, list[str]] = defaultdict(list)
+        for recordset in self.recordsets.values():
+            self.by_zone[recordset["zone_id"]].append(recordset["id"])
+        self.calls: dict[str, int] = defaultdict(int)
+        self.throttled: int = 0
+
+    async def delay(self, method: str):
+        self.calls[method] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.throttle and self.rng.random() < self.throttle:
+            self.throttled += 1
+            raise web.HTTPTooManyRequests(
+                text=json.dumps(
+                    {
+                        "error_code": "APIGW.0308",
+                        "error_msg": "The throttling threshold has been reached",
+                    }
+                ),
+                content_type="application/json",
+            )
+
+    @staticmethod
+    def page(request: web.Request, items: list) -> tuple[list, dict]:
+        limit = int(request.query.get("limit") or 500)
+        offset = int(request.query.get("offset") or 0)
+        links = {"self": str(request.url)}
+        if offset + limit < len(items):
+            links["next"] = str(request.url.update_query(offset=offset + limit))
+        return items[offset : offset + limit], links
+
+    async def list_public_zones(self, request: web.Request) -> web.Response:
+        await self.delay("list_public_zones")
+        zones = [
+            {"id": zone_id, "name": name, "zone_type": "public", "status": "ACTIVE"}
+            for name, zone_id in self.zones.items()
+        ]
+        zones, links = self.page(request, zones)
+        return web.json_response(
+            {"zones": zones, "links": links, "metadata": {"total_count": len(self.zones)}}
+        )
+
+    async def list_record_sets_by_zone(self, request: web.Request) -> web.Response:
+        await self.delay("list_record_sets_by_zone")
+        name = request.query.get("name")
+        record_type = request.query.get("type")
+        recordsets = [
+            self.recordsets[recordset_id]
+            for recordset_id in self.by_zone[request.match_info["zone_id"]]
+            if (not name or self.recordsets[recordset_id]["name"] == name)
+            and (not record_type or self.recordsets[recordset_id]["type"] == record_type)
+        ]
+        total = len(recordsets)
+        recordsets, links = self.page(request, recordsets)
+        return web.json_response(
+            {"recordsets": recordsets, "links": links, "metadata": {"total_count": total}}
+        )
+
+    async def show_record_set(self, request: web.Request) -> web.Response:
+        await self.delay("show_record_set")
+        return web.json_response(self.recordsets[request.match_info["recordset_id"]])
+
+    def update(self, recordset_id: str, body: dict) -> dict:
+        recordset = self.recordsets[recordset_id]
+        for key in ("description", "ttl", "records"):
+            if body.get(key) is not None:
+                recordset[key] = body[key]
+        return recordset
+
+    async def update_record_set(self, request: web.Request) -> web.Response:
+        await self.delay("update_record_set")
+        recordset = self.update(request.match_info["recordset_id"], await request.json())
+        return web.json_response(recordset, status=202)
+
+    async def create_record_set_with_line(self, request: web.Request) -> web.Response:
+        await self.delay("create_record_set_with_line")
+        body = await request.json()
+        zone_id = request.match_info["zone_id"]
+        recordset = {
+            "id": f"new-{len(self.recordsets)}",
+            "zone_id": zone_id,
+            "name": body["name"],
+            "type": body["type"],
+            "ttl": body.get("ttl", 300),
+            "records": body["records"],
+            "description": body.get("description"),
+            "status": "ACTIVE",
+        }
+        self.recordsets[recordset["id"]] = recordset
+        self.by_zone[zone_id].append(recordset["id"])
+        return web.json_response(recordset, status=202)
+
+    async def batch_update_record_set_with_line(
+        self, request: web.Request
+    ) -> web.Response:
+        await self.delay("batch_update_record_set_with_line")
+        body = await request.json()
+        recordsets = [self.update(item["id"], item) for item in body["recordsets"]]
+        return web.json_response({"recordsets": recordsets}, status=202)
+
+    async def set_record_sets_status(self, request: web.Request) -> web.Response:
+        await self.delay("set_record_sets_status")
+        recordset = self.recordsets[request.match_info["recordset_id"]]
+        recordset["status"] = (await request.json())["status"]
+        return web.json_response(recordset, status=202)
+
+    async def batch_set_record_sets_status(self, request: web.Request) -> web.Response:
+        await self.delay("batch_set_record_sets_status")
+        body = await request.json()
+        recordsets = []
+        for recordset_id in body["recordset_ids"]:
+            self.recordsets[recordset_id]["status"] = body["status"]
+            recordsets.append(self.recordsets[recordset_id])
+        return web.json_response({"recordsets": recordsets}, status=202)
+
+    def routes(self) -> list:
+        return [
+            web.get("/v2/zones", self.list_public_zones),
+            web.get("/v2/zones/{zone_id}/recordsets", self.list_record_sets_by_zone),
+            web.get(
+                "/v2/zones/{zone_id}/recordsets/{recordset_id}", self.show_record_set
+            ),
+            web.put(
+                "/v2/zones/{zone_id}/recordsets/{recordset_id}", self.update_record_set
+            ),
+            web.post(
+                "/v2.1/zones/{zone_id}/recordsets", self.create_record_set_with_line
+            ),
+            web.put(
+                "/v2.1/zones/{zone_id}/recordsets",
+                self.batch_update_record_set_with_line,
+            ),
+            web.put("/v2.1/recordsets/statuses", self.batch_set_record_sets_status),
+            web.put(
+                "/v2.1/recordsets/{recordset_id}/statuses/set",
+                self.set_record_sets_status,
+            ),
+        ]
+
+
+class FakeServers:
+    """
+    在后台线程中运行 FakeDoh 和 FakeHwDns，start() 返回 (DoH 地址, API 地址)
+    """
+
+    def __init__(self, doh: FakeDoh, hw_dns: FakeHwDns):
+        self.doh: FakeDoh = doh
+        self.hw_dns: FakeHwDns = hw_dns
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.runners: list[web.AppRunner] = []
+
+    async def serve(self, routes: list) -> int:
+        app = web.Application(client_max_size=64 << 20)
+        app.add_routes(routes)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        self.runners.append(runner)
+        return site._server.sockets[0].getsockname()[1]
+
+    def start(self) -> tuple[str, str]:
+        self.thread.start()
+        doh_port = asyncio.run_coroutine_threadsafe(
+            self.serve(self.doh.routes()), self.loop
+        ).result()
+        api_port = asyncio.run_coroutine_threadsafe(
+            self.serve(self.hw_dns.routes()), self.loop
+        ).result()
+        return (
+            f"http://127.0.0.1:{doh_port}/dns-query",
+            f"http://127.0.0.1:{api_port}",
+        )
+
+    def stop(self):
+        async def cleanup():
+            for runner in self.runners:
+                await runner.cleanup()
+
+        asyncio.run_coroutine_threadsafe(cleanup(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
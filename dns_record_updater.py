@@ -2,31 +2,64 @@
 # -*- coding: utf-8 -*-
 
 
+from __future__ import annotations
+
 import os
 import re
+import abc
+import copy
 import sys
 import json
-import yaml
+import mmap
+import array
+import time
 import random
+import socket
+import struct
+import argparse
 import asyncio
-import aiohttp
+import heapq
+import hashlib
 import zipfile
+import bisect
+import itertools
 import logging
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
 from logging import debug, info, warning, error, critical
 import ipaddress
 from collections import defaultdict
-from huaweicloudsdkdns.v2 import *
-from huaweicloudsdkdns.v2.region import dns_region
-from huaweicloudsdkcore.region.region import Region
-from huaweicloudsdkcore.exceptions.exceptions import *
-from huaweicloudsdkcore.http.http_handler import HttpHandler
-from huaweicloudsdkcore.auth.credentials import BasicCredentials
-from huaweicloudsdkcore.auth.provider import EnvCredentialProvider
+from typing import TYPE_CHECKING, Callable, Iterator
+from huaweicloudsdkcore.exceptions.exceptions import (
+    ApiValueError,
+    ClientRequestException,
+    ConnectionException,
+    RequestTimeoutException,
+    SdkException,
+    ServerResponseException,
+    ServiceResponseException,
+)
+
+# aiohttp、yaml 和华为云 SDK 在用到时才导入，没有变化的运行不需要导入 SDK
+if TYPE_CHECKING:
+    import aiohttp
+    from huaweicloudsdkdns.v2 import (
+        DnsClient,
+        ListRecordSets,
+        PublicZoneResp,
+        ListPublicZonesResponse,
+        ListRecordSetsByZoneResponse,
+    )
+    from huaweicloudsdkcore.auth.credentials import BasicCredentials
 
 
 __author__ = "Glucy2"
 
 
+# 更新配置中支持的记录类型
+supported_record_types = {"A", "AAAA", "MX", "TXT", "SRV", "NS", "CAA"}
+
+
 dns_types = {
     "A": 1,
     "AAAA": 28,
@@ -73,22 +106,129 @@ dns_types = {
 class ServerCfg:
     error_occurred: bool = False
     dns_query_server: str = "https://cloudflare-dns.com/dns-query"
+    dns_query_format: str = "json"
+    # 其他 DoH 服务器，配置项可以是 URL 或 {url, format}，见 build_resolvers
+    dns_query_servers: list = []
+    dns_hedge_delay: float = 0.2
+    resolvers: list["DohResolver"] = []
     hw_api_ak: str = ""
     hw_api_sk: str = ""
-    ip_lists_urls: list[str] = (
-        [
-            "https://github.com/gaoyifan/china-operator-ip/archive/refs/heads/ip-lists.zip",
-            "https://ghproxy.com/https://github.com/gaoyifan/china-operator-ip/archive/refs/heads/ip-lists.zip",
-        ],
-    )
+    # 要写入的 DNS 服务商，见 build_providers
+    providers: list[dict] = [{"type": "huaweicloud"}]
+    ip_lists_urls: list[str] = [
+        "https://github.com/gaoyifan/china-operator-ip/archive/refs/heads/ip-lists.zip",
+        "https://ghproxy.com/https://github.com/gaoyifan/china-operator-ip/archive/refs/heads/ip-lists.zip",
+    ]
     ip_lists_filepath: str = "./ip-lists.zip"
-    ip_lists: dict = {}
+    ip_lists_refresh_interval: int = 86400
+    ip_lists_timeout: float = 60
+    ip_index_filepath: str = "./ip-lists.idx"
+    ip_db: "IpDatabase"
     headers: dict
+    http_limit: int = 64
+    http_limit_per_host: int = 16
+    http_keepalive_timeout: float = 60
+    http_dns_cache_ttl: int = 300
+    http_stats: "HttpStats"
     max_content_num: int = 50
+    truncate_strategy: str = "round_robin"
+    probe_port: int = 443
+    probe_timeout: float = 2
+    probe_limit: int = 64
+    probe_semaphore: asyncio.Semaphore
+    health_check_cache_ttl: int = 300
+    health_cache: "HealthCache"
+    dns_query_limit: int = 16
+    dns_query_timeout: float = 5
+    dns_query_semaphore: asyncio.Semaphore
+    dns_cache_filepath: str = ""
+    dns_cache: "DnsCache"
+    api_concurrency: int = 8
+    api_rate_limit: float = 10
+    # API 方法名 -> 该接口每秒允许的请求数，与 api_rate_limit 同时生效
+    api_rate_limits: dict[str, float] = {}
+    api_retries: int = 4
+    api_retry_base_delay: float = 0.5
+    api_retry_max_delay: float = 16
+    recordset_page_size: int = 500
+    batch_write_size: int = 100
+    config_filepath: str = "dns_record_updater.yaml"
+    region_cache_filepath: str = "./region-cache.json"
+    region_cache_ttl: int = 86400
+    region_probe_timeout: float = 5
+    # 保存的排名已过期，创建 API 客户端后在后台重新测试，见 refresh_region_ranking
+    region_ranking_stale: bool = False
+    region_refresh_task: asyncio.Task | None = None
+    daemon_interval: int = 0
+    zone_refresh_interval: int = 3600
+    config_poll_interval: float = 5
     credentials: BasicCredentials
+    report_filepath: str = ""
+    prometheus_textfile: str = ""
+    metrics_port: int = 0
+    metrics: "Metrics"
+    config_cache: "ConfigCache"
+    state_filepath: str = "./state.json"
+    state_max_age: int = 3600
+    run_state: "RunState"
+
+
+class HealthCheck:
+    """
+    更新项目的健康检查设置
+
+    protocol 为 tcp、http 或 https；A、AAAA 记录检查 port 端口（为 0 时使用服务器设置中的 probe_port），
+    SRV 记录检查记录中的目标和端口；filter_unhealthy 为 True 时不发布未通过检查的记录
+    """
+
+    __slots__ = ("protocol", "port", "path", "host", "filter_unhealthy")
+    protocols = {"tcp", "http", "https"}
+
+    def __init__(
+        self,
+        protocol: str = "tcp",
+        port: int = 0,
+        path: str = "/",
+        host: str = "",
+        filter_unhealthy: bool = True,
+    ):
+        self.protocol: str = protocol
+        self.port: int = port
+        self.path: str = path
+        # HTTP(S) 检查时发送的 Host 头，为空时使用地址
+        self.host: str = host
+        self.filter_unhealthy: bool = filter_unhealthy
+
+    def target(self, record_type: str, record: str) -> tuple[str, int] | None:
+        """
+        记录对应的检查目标 (主机, 端口)，无法检查时返回 None
+        """
+        if record_type in {"A", "AAAA"}:
+            return record, self.port or ServerCfg.probe_port
+        if record_type == "SRV":
+            sp = record.split()
+            if len(sp) != 4 or sp[3] == "." or not sp[2].isdigit():
+                return None
+            return sp[3].rstrip("."), int(sp[2])
+        return None
 
 
 class UpItem:
+    __slots__ = (
+        "name",
+        "record_type",
+        "sources",
+        "extra",
+        "content",
+        "match_description",
+        "match_pattern",
+        "description",
+        "ttl",
+        "truncate_strategy",
+        "source_weights",
+        "health_check",
+    )
+
     def __init__(
         self,
         name: str,
@@ -98,14 +238,566 @@ class UpItem:
         match_description: str,
         description: str,
         ttl: int,
+        truncate_strategy: str = "",
+        source_weights: list[float] | None = None,
+        health_check: HealthCheck | None = None,
+        match_pattern: re.Pattern | None = None,
     ):
         self.name: str = name
         self.record_type: str = record_type
         self.sources: list[str] = sources
+        # 配置文件中设置的额外记录值，content 为其与查询结果的合并
+        self.extra: list[str] = list(content)
         self.content: list[str] = content
         self.match_description: str = match_description
+        # 编译后的 match_description，同一个更新配置展开的更新项目共用
+        self.match_pattern: re.Pattern | None = match_pattern
+        if match_pattern is None and match_description:
+            self.match_pattern = re.compile(match_description)
+        self.description: str = description
+        self.ttl: int = ttl
+        # 记录数超过上限时使用的截断策略，为空时使用服务器设置中的默认策略
+        self.truncate_strategy: str = truncate_strategy
+        # 与 sources 一一对应的权重，用于 source_weight 截断策略
+        self.source_weights: list[float] | None = source_weights
+        # 为 None 时不进行健康检查
+        self.health_check: HealthCheck | None = health_check
+
+
+class ItemConfig:
+    """
+    校验后的单个更新配置，path 为其在配置文件中的位置（如 update_items[0]），
+    expand() 按域名和记录类型展开为更新项目
+    """
+
+    __slots__ = (
+        "path",
+        "domains",
+        "record_types",
+        "sources",
+        "extra",
+        "match_description",
+        "match_pattern",
+        "description",
+        "ttl",
+        "truncate_strategy",
+        "source_weights",
+        "health_check",
+    )
+
+    def __init__(
+        self,
+        path: str,
+        domains: list[str],
+        record_types: list[str],
+        sources: list[str],
+        extra: dict[str, list[str]],
+        match_description: str,
+        match_pattern: re.Pattern | None,
+        description: str,
+        ttl: int,
+        truncate_strategy: str,
+        source_weights: list[float] | None,
+        health_check: HealthCheck | None,
+    ):
+        self.path: str = path
+        # 以 . 结尾的完整域名
+        self.domains: list[str] = domains
+        self.record_types: list[str] = record_types
+        self.sources: list[str] = sources
+        # 记录类型 -> 格式化后的额外记录值
+        self.extra: dict[str, list[str]] = extra
+        self.match_description: str = match_description
+        self.match_pattern: re.Pattern | None = match_pattern
         self.description: str = description
         self.ttl: int = ttl
+        self.truncate_strategy: str = truncate_strategy
+        self.source_weights: list[float] | None = source_weights
+        self.health_check: HealthCheck | None = health_check
+
+    def expand(self) -> list[UpItem]:
+        up_items = []
+        for name in self.domains:
+            for record_type in self.record_types:
+                up_items.append(
+                    UpItem(
+                        name,
+                        record_type,
+                        self.sources,
+                        list(self.extra[record_type]),
+                        self.match_description,
+                        self.description,
+                        self.ttl,
+                        self.truncate_strategy,
+                        self.source_weights,
+                        self.health_check,
+                        self.match_pattern,
+                    )
+                )
+                debug(f"读取到更新项目：{name} {record_type}")
+        return up_items
+
+
+class ConfigCache:
+    """
+    上次成功读取的配置，按配置文件的修改时间和内容哈希判断是否需要重新解析
+
+    重新解析时，内容没有变化的更新配置沿用上次展开的更新项目（同一批对象），
+    守护模式据此只重新同步变化的更新项目；服务器设置变化时全部重新展开
+    """
+
+    __slots__ = ("mtime", "digest", "server_digest", "items", "up_items")
+
+    def __init__(self):
+        self.mtime: float = 0
+        self.digest: bytes = b""
+        self.server_digest: str = ""
+        # 更新配置的规范化 JSON -> 展开的更新项目
+        self.items: dict[str, list[UpItem]] = {}
+        self.up_items: list[UpItem] = []
+
+
+def atomic_write(path: str, data: str | bytes):
+    """
+    先写入临时文件再替换，避免其他进程读到不完整的文件；失败时删除临时文件并抛出异常
+    """
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        if isinstance(data, str):
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(data)
+        else:
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(tmp_path)
+        raise
+
+
+class Metrics:
+    """
+    运行指标：phases 为最近一次运行（守护模式下为一次同步）各阶段的耗时，
+    counters 为进程启动以来的累计计数
+    """
+
+    def __init__(self):
+        self.started: float = time.time()
+        self.run_started: float = self.started
+        self.run_finished: float = 0
+        self.phases: dict[str, float] = defaultdict(float)
+        self.counters: dict[str, int] = defaultdict(int)
+
+    def start_run(self):
+        self.run_started = time.time()
+        self.phases.clear()
+        self.counters["runs"] += 1
+
+    def finish_run(self):
+        self.run_finished = time.time()
+
+    @contextlib.contextmanager
+    def phase(self, name: str):
+        """
+        累加代码块的耗时，并发执行的同名阶段耗时相加
+        """
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] += time.perf_counter() - start_time
+
+    async def timed(self, name: str, awaitable):
+        with self.phase(name):
+            return await awaitable
+
+    def collect(self, api: "HwDnsApi | None" = None) -> dict[str, int]:
+        """
+        汇总自身和各组件的累计计数
+        """
+        counters = dict(self.counters)
+        counters["doh_queries"] = sum(r.queries for r in ServerCfg.resolvers)
+        counters["doh_errors"] = sum(r.errors for r in ServerCfg.resolvers)
+        for name in ("dns_cache", "health_cache"):
+            cache = getattr(ServerCfg, name, None)
+            if cache is not None:
+                counters[f"{name}_hits"] = cache.hits
+                counters[f"{name}_misses"] = cache.misses
+        http_stats = getattr(ServerCfg, "http_stats", None)
+        if http_stats is not None:
+            counters["http_requests"] = http_stats.requests
+            counters["http_connections_created"] = http_stats.created
+            counters["http_connections_reused"] = http_stats.reused
+        if api is not None:
+            for method, calls in api.calls_by_method.items():
+                counters[f'api_calls{{method="{method}"}}'] = calls
+            for method, retries in api.retries_by_method.items():
+                counters[f'api_retries{{method="{method}"}}'] = retries
+            counters["api_throttled"] = api.throttled
+        return counters
+
+    def to_dict(self, api: "HwDnsApi | None" = None) -> dict:
+        return {
+            "started": self.run_started,
+            "finished": self.run_finished,
+            "duration": self.run_finished - self.run_started,
+            "error_occurred": ServerCfg.error_occurred,
+            "phases": dict(self.phases),
+            "counters": self.collect(api),
+        }
+
+    def to_prometheus(self, api: "HwDnsApi | None" = None) -> str:
+        """
+        Prometheus 文本格式，计数名称中可以带标签，如 changes{action="update"}
+        """
+        prefix = "dns_record_updater"
+        lines = [
+            f"# TYPE {prefix}_phase_seconds gauge",
+            *(
+                f'{prefix}_phase_seconds{{phase="{phase}"}} {seconds:.6f}'
+                for phase, seconds in sorted(self.phases.items())
+            ),
+            f"# TYPE {prefix}_last_run_duration_seconds gauge",
+            f"{prefix}_last_run_duration_seconds {self.run_finished - self.run_started:.6f}",
+            f"# TYPE {prefix}_last_run_timestamp_seconds gauge",
+            f"{prefix}_last_run_timestamp_seconds {self.run_finished:.3f}",
+            f"# TYPE {prefix}_last_run_success gauge",
+            f"{prefix}_last_run_success {int(not ServerCfg.error_occurred)}",
+        ]
+        typed = set()
+        for key, value in sorted(self.collect(api).items()):
+            name, brace, labels = key.partition("{")
+            metric = f"{prefix}_{name}_total"
+            if metric not in typed:
+                typed.add(metric)
+                lines.append(f"# TYPE {metric} counter")
+            lines.append(f"{metric}{brace}{labels} {value}")
+        return "\n".join(lines) + "\n"
+
+    def export(self, api: "HwDnsApi | None" = None):
+        """
+        按设置保存 JSON 运行报告和 Prometheus 文本文件（供 node_exporter 的 textfile 收集器读取）
+        """
+        outputs = []
+        if ServerCfg.report_filepath:
+            outputs.append(
+                (
+                    ServerCfg.report_filepath,
+                    json.dumps(self.to_dict(api), ensure_ascii=False, indent=2),
+                )
+            )
+        if ServerCfg.prometheus_textfile:
+            outputs.append((ServerCfg.prometheus_textfile, self.to_prometheus(api)))
+        for path, text in outputs:
+            try:
+                atomic_write(path, text)
+            except OSError as e:
+                warning(f"保存运行指标到 {path} 时出错：{e}")
+
+
+class MetricsHandler(logging.Handler):
+    """
+    统计警告和错误日志的数量
+    """
+
+    def __init__(self, metrics: Metrics):
+        super().__init__(logging.WARNING)
+        self.metrics: Metrics = metrics
+
+    def emit(self, record: logging.LogRecord):
+        if record.levelno >= logging.ERROR:
+            self.metrics.counters["errors"] += 1
+        else:
+            self.metrics.counters["warnings"] += 1
+
+
+ServerCfg.metrics = Metrics()
+ServerCfg.config_cache = ConfigCache()
+
+
+def parse_health_check(value, path: str) -> HealthCheck | None:
+    """
+    解析更新配置中的 health_check，为 true 时使用默认设置（TCP 连接）
+    """
+    if not value:
+        return None
+    if value is True:
+        return HealthCheck()
+    if not isinstance(value, dict):
+        error(f"错误：{path}.health_check 格式错误，将不进行健康检查")
+        return None
+    health_check = HealthCheck(
+        value.get("protocol", "tcp"),
+        value.get("port") or 0,
+        value.get("path") or "/",
+        value.get("host") or "",
+        value.get("filter_unhealthy", True),
+    )
+    if health_check.protocol not in HealthCheck.protocols or not isinstance(
+        health_check.port, int
+    ):
+        error(f"错误：{path}.health_check 设置错误，将不进行健康检查")
+        return None
+    return health_check
+
+
+def parse_item_config(item: dict, path: str) -> ItemConfig | None:
+    """
+    校验单个更新配置，有错误时输出错误位置并返回 None
+    """
+    if not all(item.get(key) for key in ["domain", "type"]):
+        error(f"错误：{path} 缺少必要的配置项 domain 或 type")
+        return None
+    domains = item["domain"] if isinstance(item["domain"], list) else [item["domain"]]
+    record_types = item["type"] if isinstance(item["type"], list) else [item["type"]]
+    for i, domain in enumerate(domains):
+        if not isinstance(domain, str) or not domain:
+            error(f"错误：{path}.domain[{i}] 不是有效的域名")
+            return None
+    supported_types = []
+    for i, record_type in enumerate(record_types):
+        if record_type not in supported_record_types:
+            error(f"错误：{path}.type[{i}] 不支持 {record_type} 记录类型，将跳过此类型")
+        elif record_type not in supported_types:
+            supported_types.append(record_type)
+    if not supported_types:
+        return None
+    sources = item.get("sources") or []
+    if not isinstance(sources, list) or not all(isinstance(x, str) for x in sources):
+        error(f"错误：{path}.sources 必须是域名列表")
+        return None
+    source_weights = item.get("source_weights")
+    if source_weights is not None:
+        if (
+            not isinstance(source_weights, list)
+            or len(source_weights) != len(sources)
+            or not all(
+                isinstance(weight, (int, float))
+                and not isinstance(weight, bool)
+                and weight >= 0
+                for weight in source_weights
+            )
+            or not any(weight > 0 for weight in source_weights)
+        ):
+            error(
+                f"错误：{path}.source_weights 必须是与 sources 等长的非负数列表，且至少有一个正数"
+            )
+            return None
+    ttl = item.get("ttl", 300)
+    if not isinstance(ttl, int) or isinstance(ttl, bool) or ttl <= 0:
+        error(f"错误：{path}.ttl 必须是正整数")
+        return None
+    match_description = item.get("match_description") or ""
+    match_pattern = None
+    if match_description:
+        try:
+            match_pattern = re.compile(match_description)
+        except re.error as e:
+            ServerCfg.error_occurred = True
+            error(f"错误：{path}.match_description 不是有效的正则表达式：{e}")
+            return None
+    extra_records = item.get("extra") or []
+    extra = {}
+    for record_type in supported_types:
+        if record_type == "CAA":
+            content = []
+            for i, record in enumerate(extra_records):
+                sp = str(record).split(" ")
+                if len(sp) != 3:
+                    error(f"错误：{path}.extra[{i}] 不是有效的 CAA 记录")
+                    return None
+                if sp[2].startswith('"') and sp[2].endswith('"'):
+                    content.append(f"{sp[0]} {sp[1]} {sp[2]}")
+                else:
+                    content.append(f'{sp[0]} {sp[1]} "{sp[2]}"')
+        else:
+            content = [str(record) for record in extra_records]
+        if len(content) > ServerCfg.max_content_num:
+            ServerCfg.error_occurred = True
+            error(
+                f"错误：{path}.extra 设置的 {record_type} 记录数量超过上限 {ServerCfg.max_content_num}"
+            )
+            return None
+        extra[record_type] = content
+    truncate_strategy = item.get("truncate_strategy") or ""
+    if truncate_strategy and truncate_strategy not in truncate_strategies:
+        error(f"错误：{path}.truncate_strategy 不支持 {truncate_strategy}，将使用默认策略")
+        truncate_strategy = ""
+    if item.get("description"):
+        description = str(item["description"])
+    else:
+        description = "，".join(sources)
+    return ItemConfig(
+        path,
+        [domain if domain.endswith(".") else domain + "." for domain in domains],
+        supported_types,
+        sources,
+        extra,
+        match_description,
+        match_pattern,
+        description[:255],
+        ttl,
+        truncate_strategy,
+        source_weights,
+        parse_health_check(item.get("health_check"), path),
+    )
+
+
+def provider_name(provider: dict) -> str:
+    return provider.get("name") or provider["type"]
+
+
+def parse_providers(value) -> list[dict] | None:
+    """
+    校验服务器设置中的 providers，有错误时输出错误位置并返回 None
+    """
+    if not isinstance(value, list):
+        error("错误：server_config.providers 必须是列表")
+        return None
+    names = set()
+    for index, provider in enumerate(value):
+        path = f"server_config.providers[{index}]"
+        if not isinstance(provider, dict) or provider.get("type") not in provider_types:
+            error(f"错误：{path}.type 必须是 {'、'.join(sorted(provider_types))} 之一")
+            return None
+        if provider["type"] == "zone_file" and not provider.get("path"):
+            error(f"错误：{path} 缺少 zone 文件路径 path")
+            return None
+        name = provider_name(provider)
+        if name in names:
+            error(f"错误：{path} 的名称 {name} 重复")
+            return None
+        names.add(name)
+    if sum(provider["type"] == "huaweicloud" for provider in value) > 1:
+        error("错误：server_config.providers 中只能有一个 huaweicloud")
+        return None
+    return value
+
+
+def is_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def is_int(value) -> bool:
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+# 服务器设置的类型 -> (校验函数, 说明)
+setting_types: dict[str, tuple[Callable[[object], bool], str]] = {
+    "str": (lambda v: isinstance(v, str), "字符串"),
+    "path": (lambda v: isinstance(v, str) and bool(v), "非空字符串"),
+    "positive_int": (lambda v: is_int(v) and v > 0, "正整数"),
+    "non_negative_int": (lambda v: is_int(v) and v >= 0, "非负整数"),
+    "positive_number": (lambda v: is_number(v) and v > 0, "正数"),
+    "non_negative_number": (lambda v: is_number(v) and v >= 0, "非负数"),
+    "port": (lambda v: is_int(v) and 0 < v < 65536, "1 到 65535 之间的端口号"),
+    "url_list": (
+        lambda v: isinstance(v, list)
+        and bool(v)
+        and all(isinstance(url, str) and url for url in v),
+        "非空的 URL 列表",
+    ),
+    "resolver_list": (
+        lambda v: isinstance(v, list)
+        and all(
+            isinstance(entry, str)
+            or isinstance(entry, dict) and isinstance(entry.get("url"), str)
+            for entry in v
+        ),
+        "URL 或 {url, format} 的列表",
+    ),
+    "rate_dict": (
+        lambda v: isinstance(v, dict)
+        and all(isinstance(k, str) and is_number(r) and r >= 0 for k, r in v.items()),
+        "API 方法名到非负数（0 为不限速）的映射",
+    ),
+    "dns_query_format": (lambda v: v in {"json", "wire"}, "json 或 wire"),
+    "truncate_strategy": (
+        lambda v: v in truncate_strategies,
+        "支持的截断策略（round_robin、source_weight、latency、stable_hash）",
+    ),
+}
+
+# server_config 中的设置项 -> 类型，省略或为空时使用 ServerCfg 中的默认值；providers 另见 parse_providers
+server_settings: dict[str, str] = {
+    "dns_query_server": "path",
+    "dns_query_servers": "resolver_list",
+    "dns_query_format": "dns_query_format",
+    "dns_hedge_delay": "non_negative_number",
+    "hw_api_ak": "str",
+    "hw_api_sk": "str",
+    "max_content_num": "positive_int",
+    "truncate_strategy": "truncate_strategy",
+    "probe_port": "port",
+    "probe_timeout": "positive_number",
+    "probe_limit": "positive_int",
+    "health_check_cache_ttl": "non_negative_int",
+    "http_limit": "non_negative_int",
+    "http_limit_per_host": "non_negative_int",
+    "http_keepalive_timeout": "non_negative_number",
+    "dns_query_limit": "positive_int",
+    "dns_query_timeout": "positive_number",
+    "api_concurrency": "positive_int",
+    "api_rate_limit": "non_negative_number",
+    "api_rate_limits": "rate_dict",
+    "api_retries": "non_negative_int",
+    "api_retry_base_delay": "non_negative_number",
+    "api_retry_max_delay": "non_negative_number",
+    "batch_write_size": "positive_int",
+    "report_filepath": "str",
+    "prometheus_textfile": "str",
+    "metrics_port": "non_negative_int",
+    "state_filepath": "str",
+    "state_max_age": "non_negative_number",
+    "daemon_interval": "non_negative_int",
+    "zone_refresh_interval": "non_negative_number",
+    "region_cache_filepath": "str",
+    "region_cache_ttl": "non_negative_number",
+    "ip_lists_urls": "url_list",
+    "ip_lists_filepath": "path",
+    "ip_lists_refresh_interval": "non_negative_number",
+    "dns_cache_filepath": "str",
+}
+# 没有默认值、必须设置的项
+required_settings = {"dns_query_server", "max_content_num"}
+# 重新加载配置时，删除的设置项恢复为默认值而不是沿用上次的值
+server_defaults: dict[str, object] = {
+    key: getattr(ServerCfg, key) for key in [*server_settings, "providers"]
+}
+
+
+def parse_server_config(value: dict) -> dict | None:
+    """
+    按 server_settings 校验服务器设置，返回 {ServerCfg 属性名: 值}，
+    有错误时输出所有错误位置并返回 None
+    """
+    settings = {}
+    valid = True
+    for key in value:
+        if key not in server_settings and key != "providers":
+            warning(f"server_config.{key} 不是已知的设置项，将忽略")
+    for key, setting_type in server_settings.items():
+        setting = value.get(key)
+        if setting is None:
+            if key in required_settings:
+                error(f"错误：服务器设置中缺少 server_config.{key} 配置项")
+                valid = False
+            else:
+                settings[key] = copy.deepcopy(server_defaults[key])
+            continue
+        check, description = setting_types[setting_type]
+        if not check(setting):
+            error(f"错误：server_config.{key} 必须是{description}，当前为 {setting!r}")
+            valid = False
+            continue
+        settings[key] = setting
+    settings["providers"] = parse_providers(
+        value.get("providers") or copy.deepcopy(server_defaults["providers"])
+    )
+    if settings["providers"] is None:
+        valid = False
+    return settings if valid else None
 
 
 def response_handler(**kwargs):
@@ -128,120 +820,174 @@ def response_handler(**kwargs):
 
 
 async def read_config() -> list:
-    f = None
-    info("正在读取配置文件……")
+    """
+    读取配置文件，返回更新项目列表
+
+    配置文件的修改时间或内容没有变化时直接返回上次的结果，
+    只重新展开内容有变化的更新配置，见 ConfigCache
+    """
+    cache = ServerCfg.config_cache
+    path = ServerCfg.config_filepath
     try:
-        f = open("dns_record_updater.yaml", "r", encoding="utf-8")
-        config = yaml.load(f, Loader=yaml.FullLoader)
+        mtime = os.stat(path).st_mtime
+        if cache.up_items and mtime == cache.mtime:
+            debug("配置文件没有变化")
+            return cache.up_items
+        with open(path, "rb") as f:
+            data = f.read()
     except FileNotFoundError:
-        critical("错误：找不到配置文件 config.json")
+        critical(f"错误：找不到配置文件 {path}")
         sys.exit(1)
     except PermissionError:
-        critical("错误：无法读取配置文件 config.json")
+        critical(f"错误：无法读取配置文件 {path}")
         sys.exit(1)
-    except json.JSONDecodeError as e:
+    except OSError as e:
+        critical(f"错误：读取配置文件 {path} 失败：{e}")
+        sys.exit(1)
+    digest = hashlib.sha256(data).digest()
+    if cache.up_items and digest == cache.digest:
+        debug("配置文件内容没有变化")
+        cache.mtime = mtime
+        return cache.up_items
+    info("正在读取配置文件……")
+    import yaml
+
+    try:
+        # 优先使用 libyaml 实现的加载器
+        config = yaml.load(data, Loader=getattr(yaml, "CSafeLoader", yaml.SafeLoader))
+    except yaml.YAMLError as e:
         critical(f"错误：配置文件格式错误，读取失败：{e}")
         sys.exit(1)
-    except Exception as e:
-        critical(f"错误：读取配置文件失败：{e}")
+    if not isinstance(config, dict) or not isinstance(
+        config.get("server_config"), dict
+    ):
+        critical("错误：配置文件中缺少 server_config")
         sys.exit(1)
-    finally:
-        if f:
-            f.close()
     info("正在读取服务器设置……")
-    try:
-        ServerCfg.dns_query_server = config["server_config"]["dns_query_server"]
-        ServerCfg.hw_api_ak = config["server_config"]["hw_api_ak"]
-        ServerCfg.hw_api_sk = config["server_config"]["hw_api_sk"]
-        ServerCfg.max_content_num = config["server_config"]["max_content_num"]
-    except KeyError as e:
-        critical("错误：服务器设置中缺少 " + str(e) + " 配置项")
+    settings = parse_server_config(config["server_config"])
+    if settings is None:
+        critical("错误：服务器设置有误，读取失败")
         sys.exit(1)
+    # 更新配置的校验会用到服务器设置（如 max_content_num），先应用，失败时恢复
+    previous = {key: getattr(ServerCfg, key) for key in settings}
+    previous["resolvers"] = ServerCfg.resolvers
+    for key, value in settings.items():
+        setattr(ServerCfg, key, value)
+    ServerCfg.resolvers = build_resolvers(
+        [ServerCfg.dns_query_server] + ServerCfg.dns_query_servers
+    )
     info("正在读取更新配置……")
-    up_items = config["update_items"]
+    server_digest = hashlib.sha256(
+        json.dumps(config["server_config"], sort_keys=True, default=str).encode()
+    ).hexdigest()
+    # 服务器设置（如 max_content_num）会影响校验结果
+    cached = cache.items if server_digest == cache.server_digest else {}
+    items: dict[str, list[UpItem]] = {}
     up_item_list = []
-    for index, item in enumerate(up_items):
+    reused = 0
+    for index, item in enumerate(config.get("update_items") or []):
+        item_path = f"update_items[{index}]"
+        if not isinstance(item, dict):
+            error(f"错误：{item_path} 格式错误")
+            continue
         if not item.get("enabled", True):
             continue
-        if not all(item.get(key) for key in ["domain", "type"]):
-            error(f"错误：第 {index + 1} 个更新配置缺少必要的配置项")
+        key = json.dumps(item, sort_keys=True, ensure_ascii=False, default=str)
+        if key in items:
+            warning(f"{item_path} 与前面的更新配置相同，将跳过")
             continue
-        domains = (
-            item["domain"] if isinstance(item["domain"], list) else [item["domain"]]
-        )
-        record_types = (
-            item["type"] if isinstance(item["type"], list) else [item["type"]]
-        )
-        for record_type in record_types:
-            if record_type not in {"A", "AAAA", "MX", "TXT", "SRV", "NS", "CAA"}:
-                error(f'错误：不支持第 {index + 1} 个更新配置的 {item["type"]} 记录类型')
+        up_items = cached.get(key)
+        if up_items is None:
+            item_config = parse_item_config(item, item_path)
+            if item_config is None:
                 continue
-        skip = False
-        for domain in domains:
-            for record_type in record_types:
-                name = domain if domain.endswith(".") else domain + "."
-                if record_type == "CAA":
-                    content = []
-                    for record in item.get("extra", []):
-                        sp = record.split(" ")
-                        if len(sp) != 3:
-                            error(f"错误：第 {index + 1} 个更新配置的 {name} 的 extra 内容格式错误")
-                            skip = True
-                            break
-                        if sp[2].startswith('"') and sp[2].endswith('"'):
-                            content.append(f"{sp[0]} {sp[1]} {sp[2]}")
-                        else:
-                            content.append(f'{sp[0]} {sp[1]} "{sp[2]}"')
-                    content.extend(content)
-                else:
-                    if item.get("extra", []):
-                        content = item.get("extra", []).copy()
-                    else:
-                        content = []
-                if len(content) > ServerCfg.max_content_num:
-                    ServerCfg.error_occurred = True
-                    error(
-                        f"错误：第 {index + 1} 个更新配置的 {name} 的 {record_type} 设置的额外记录内容数量超过上限 {ServerCfg.max_content_num}"
-                    )
-                    skip = True
-                    break
-                if item.get("description"):
-                    description = item.get("description", "，".join(item["sources"]))[
-                        :255
-                    ]
-                elif item["sources"]:
-                    description = "，".join(item["sources"])
-                else:
-                    description = ""
-                up_item = UpItem(
-                    name,
-                    record_type,
-                    item["sources"],
-                    content,
-                    item.get("match_description", ""),
-                    description,
-                    item.get("ttl", 300),
-                )
-                up_item_list.append(up_item)
-                debug(f"读取到更新项目：{name} {record_type}")
-                debug(id(content))
-            if skip:
-                break
-    if up_item_list:
-        info(f"总共读取了 {len(up_item_list)} 个更新项目")
-        return up_item_list
-    else:
+            up_items = item_config.expand()
+        else:
+            reused += len(up_items)
+        items[key] = up_items
+        up_item_list.extend(up_items)
+    if not up_item_list:
+        for key, value in previous.items():
+            setattr(ServerCfg, key, value)
         critical("错误：没有可用的更新项目")
         sys.exit(1)
+    cache.mtime = mtime
+    cache.digest = digest
+    cache.server_digest = server_digest
+    cache.items = items
+    cache.up_items = up_item_list
+    if reused:
+        info(f"总共读取了 {len(up_item_list)} 个更新项目，其中 {reused} 个没有变化")
+    else:
+        info(f"总共读取了 {len(up_item_list)} 个更新项目")
+    return up_item_list
+
+
+class HttpStats:
+    """
+    通过 TraceConfig 统计 HTTP 请求数和连接的新建、复用次数
+    """
+
+    def __init__(self):
+        self.requests: int = 0
+        self.created: int = 0
+        self.reused: int = 0
+
+    def trace_config(self) -> aiohttp.TraceConfig:
+        import aiohttp
+
+        trace_config = aiohttp.TraceConfig()
+
+        async def on_request_start(session, context, params):
+            self.requests += 1
+
+        async def on_connection_create_end(session, context, params):
+            self.created += 1
+
+        async def on_connection_reuseconn(session, context, params):
+            self.reused += 1
+
+        trace_config.on_request_start.append(on_request_start)
+        trace_config.on_connection_create_end.append(on_connection_create_end)
+        trace_config.on_connection_reuseconn.append(on_connection_reuseconn)
+        return trace_config
+
+
+def create_session() -> aiohttp.ClientSession:
+    """
+    创建所有 HTTP 请求共用的会话：保持连接、限制每个主机的连接数并缓存 DNS 解析结果，
+    使 DoH 查询复用少量已建立的 TLS 连接
+    """
+    import aiohttp
+
+    ServerCfg.http_stats = HttpStats()
+    connector = aiohttp.TCPConnector(
+        limit=ServerCfg.http_limit,
+        limit_per_host=ServerCfg.http_limit_per_host,
+        keepalive_timeout=ServerCfg.http_keepalive_timeout,
+        ttl_dns_cache=ServerCfg.http_dns_cache_ttl,
+    )
+    return aiohttp.ClientSession(
+        connector=connector, trace_configs=[ServerCfg.http_stats.trace_config()]
+    )
 
 
 async def fetch_url2time(
     session: aiohttp.ClientSession, name: str, url: str, regions: dict
 ):
+    """
+    测量建立连接到收到响应头（首字节）的时间，不读取响应体
+    """
+    import aiohttp
+
     try:
         start_time = asyncio.get_event_loop().time()
-        await session.get(url, timeout=5)
-        end_time = asyncio.get_event_loop().time()
+        async with session.head(
+            url,
+            allow_redirects=False,
+            timeout=aiohttp.ClientTimeout(total=ServerCfg.region_probe_timeout),
+        ):
+            end_time = asyncio.get_event_loop().time()
         regions[name] = end_time - start_time
         debug(f"{name} 的延迟：{regions[name]} 秒")
     except Exception as e:
@@ -249,162 +995,1609 @@ async def fetch_url2time(
         return
 
 
-async def select_region(session: aiohttp.ClientSession) -> list:
+async def probe_regions(session: aiohttp.ClientSession) -> list:
     """
-    选择延迟最低的 API 服务器
+    测试所有 API 服务器的延迟，按延迟从低到高排序并保存
     """
+    from huaweicloudsdkdns.v2.region import dns_region
+
     regions = {}
-    info("正在选择响应时间最短的 API 服务器……")
     await asyncio.gather(
         *[
             fetch_url2time(session, name, region.endpoints[0], regions)
             for name, region in dns_region.DnsRegion.static_fields.items()
         ]
     )
-    return sorted(regions, key=regions.get)
+    ranking = sorted(regions, key=regions.get)
+    if ranking and ServerCfg.region_cache_filepath:
+        try:
+            with open(ServerCfg.region_cache_filepath, "w", encoding="utf-8") as f:
+                json.dump({"updated": time.time(), "regions": ranking}, f)
+        except OSError as e:
+            warning(f"保存 API 服务器延迟排名时出错：{e}")
+    return ranking
 
 
-async def download_ip_lists(session: aiohttp.ClientSession):
+def load_region_ranking() -> tuple[list, float]:
     """
-    下载 IP 地址数据包
+    读取保存的 API 服务器延迟排名，返回 (排名, 保存时间)
     """
-    info("正在下载 IP 地址数据包……")
-    f = open(ServerCfg.ip_lists_filepath, "wb")
-    for addr in ServerCfg.ip_lists_urls:
-        try:
-            f.write(await session.get(addr).content.read())
-            break
-        except Exception as e:
-            warning(f"下载 {addr} 时出错：{e}")
-            continue
+    if not ServerCfg.region_cache_filepath:
+        return [], 0
+    try:
+        with open(ServerCfg.region_cache_filepath, "r", encoding="utf-8") as f:
+            cache = json.load(f)
+        return list(cache["regions"]), float(cache["updated"])
+    except FileNotFoundError:
+        return [], 0
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        warning(f"读取 API 服务器延迟排名时出错：{e}")
+        return [], 0
 
 
-async def load_ip_org(session: aiohttp.ClientSession):
+def forget_region_ranking():
     """
-    解压、加载 IP 地址数据
+    当前选择的 API 服务器不可用时，删除保存的排名，下一次运行重新测试
     """
-    if not os.path.isfile(ServerCfg.ip_lists_filepath):
-        # IP 地址数据包不存在，下载
-        await download_ip_lists(session)
+    if not ServerCfg.region_cache_filepath:
+        return
     try:
-        f = zipfile.ZipFile(ServerCfg.ip_lists_filepath)
-        for filename in f.namelist():
-            if filename.endswith(".txt"):
-                ServerCfg.ip_lists[filename[:-4]] = (
-                    f.read(filename).decode().splitlines()
-                )
-    except zipfile.BadZipFile as e:
-        error(f"解压 IP 地址数据包时出错：{e}，尝试重新下载")
-    if f:
-        f.close()
+        os.remove(ServerCfg.region_cache_filepath)
+    except OSError:
+        pass
 
 
-async def get_ip_org(ip: str, orgs: dict) -> str:
+async def select_region(session: aiohttp.ClientSession) -> list:
     """
-    获取 IP 所在运营商
+    选择延迟最低的 API 服务器
+
+    优先使用保存的延迟排名；排名过期时先使用旧的排名，创建 API 客户端后在后台重新测试
     """
-    ip = ipaddress.ip_address(ip)
-    for org in ServerCfg.ip_lists.keys():
-        for cidr in ServerCfg.ip_lists[org]:
-            if ip in ipaddress.ip_network(cidr):
-                debug(f"{ip} 的运营商：{org}")
-                return org
-    else:
-        return "other"
+    ranking, updated = load_region_ranking()
+    if ranking and time.time() - updated < ServerCfg.region_cache_ttl:
+        debug(f"使用保存的 API 服务器延迟排名：{ranking}")
+        return ranking
+    if ranking:
+        debug("保存的 API 服务器延迟排名已过期，将在后台重新测试")
+        ServerCfg.region_ranking_stale = True
+        return ranking
+    info("正在选择响应时间最短的 API 服务器……")
+    ranking = await probe_regions(session)
+    if not ranking:
+        from huaweicloudsdkdns.v2.region import dns_region
 
+        warning("所有 API 服务器均测试失败，将按默认顺序尝试")
+        ranking = list(dns_region.DnsRegion.static_fields)
+    return ranking
 
-async def choose_ips(num: int, org: str) -> list[str]:
+
+def refresh_region_ranking(session: aiohttp.ClientSession):
     """
-    从指定的已加载的 IP 地址数据中随机选择指定数量的 IP 地址
+    排名已过期时在后台重新测试；只在确实要调用 API 时启动，没有变化的运行不导入华为云 SDK
+    """
+    if ServerCfg.region_ranking_stale and ServerCfg.region_refresh_task is None:
+        ServerCfg.region_refresh_task = asyncio.create_task(probe_regions(session))
+
+
+def ip_lists_meta_filepath() -> str:
+    return ServerCfg.ip_lists_filepath + ".meta.json"
+
+
+def load_ip_lists_meta() -> dict:
+    """
+    读取上次使用的镜像 last_url 和各镜像的 ETag、Last-Modified（validators）
     """
-    all_ip: list = []
     try:
-        for cidr in ServerCfg.ip_lists[org]:
-            ip_network = ipaddress.ip_network(cidr)
-            for ip in ip_network:
-                all_ip.append(str(ip))
-        return random.sample(all_ip, num)
-    except KeyError:
-        error(f"错误：未知的 IP 地址数据库：{org}")
-        return []
+        with open(ip_lists_meta_filepath(), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if not isinstance(meta, dict):
+        return {}
+    if "validators" not in meta:
+        # 旧格式只有 {镜像地址: 验证信息}
+        return {"last_url": next(iter(meta), ""), "validators": meta}
+    return meta
 
 
-async def lookup_record(
-    session: aiohttp.ClientSession,
-    name: str,
-    record_type: str,
-) -> list:
-    content = []
+def save_ip_lists_meta(meta: dict):
     try:
-        response: aiohttp.ClientResponse = await session.get(
-            ServerCfg.dns_query_server,
-            params={"name": name, "type": record_type},
-            headers={"Accept": "application/dns-json"},
-        )
-        if response.status == 200:
-            response_json = await response.json(content_type=None)
-            try:
-                for answer in response_json["Answer"]:
-                    if answer["type"] == dns_types[record_type]:
-                        content.append(answer["data"])
-            except KeyError:
-                warning(f"{name} 没有 {record_type} 记录")
-        else:
-            warning(
-                f"查询 {name} {record_type} 记录时出错：{response.status}: {response.content}"
-            )
-    except Exception as e:
-        warning(f"查询 {name} {record_type} 记录时出错：{e}")
-    return content
+        atomic_write(ip_lists_meta_filepath(), json.dumps(meta))
+    except OSError as e:
+        warning(f"保存 IP 地址数据包信息时出错：{e}")
 
 
-async def lookup_records(
-    names: list,
-    record_type: str,
-    session: aiohttp.ClientSession,
-    domain: str = "",
-    extra_num: int = 0,
-) -> list[str]:
-    contents = []
-    for name in names:
-        contents.append(await lookup_record(session, name, record_type))
-    debug(f"{domain} 查询到的 {record_type} 记录：{contents}")
-    total_num = sum(len(content) for content in contents)
-    if total_num + extra_num > ServerCfg.max_content_num:
-        warning(
-            f"{domain} 的记录数 {total_num + extra_num} 超过了设置的最大记录数 {ServerCfg.max_content_num}"
+async def open_ip_lists(
+    session: aiohttp.ClientSession, url: str, validators: dict
+) -> aiohttp.ClientResponse:
+    """
+    发出（条件）请求，返回状态为 200 或 304 的响应
+    """
+    import aiohttp
+
+    headers = {}
+    if validators.get("etag"):
+        headers["If-None-Match"] = validators["etag"]
+    if validators.get("last_modified"):
+        headers["If-Modified-Since"] = validators["last_modified"]
+    response = await session.get(
+        url,
+        headers=headers,
+        timeout=aiohttp.ClientTimeout(
+            total=ServerCfg.ip_lists_timeout, sock_connect=10
+        ),
+    )
+    if response.status not in {200, 304}:
+        response.release()
+        raise aiohttp.ClientResponseError(
+            response.request_info, (), status=response.status, message=response.reason
         )
-        if record_type in {"A", "AAAA"}:
-            record_by_org = defaultdict(list)
-            for content in contents:
-                for record in content:
-                    record_by_org[get_ip_org(record, session)].append(record)
-            contents = sorted(record_by_org.values(), key=len, reverse=True)
-        while total_num + extra_num > ServerCfg.max_content_num:
-            contents.sort(key=len, reverse=True)
-            if not contents:
-                break
-            contents[0].pop()
-            total_num -= 1
-        debug(f"{domain} 查询到的记录（截断后）：{contents}")
-    records = []
-    for content in contents:
-        records.extend(content)
-    return records
+    return response
 
 
-def setup_credentials():
+async def race_ip_lists(
+    session: aiohttp.ClientSession, urls: list[str], meta: dict
+) -> tuple[str, aiohttp.ClientResponse] | None:
     """
-    配置认证信息（ak和sk）
+    同时请求所有镜像，返回最先成功响应的 (镜像地址, 响应)，其余请求取消
     """
-    ServerCfg.headers = {"Content-Type": "application/json"}
+    import aiohttp
+
+    tasks = {
+        asyncio.ensure_future(open_ip_lists(session, url, meta.get(url, {}))): url
+        for url in urls
+    }
+    pending = set(tasks)
+    winner = None
     try:
-        ServerCfg.credentials = (
-            EnvCredentialProvider.get_basic_credential_env_provider().get_credentials()
-        )
-        info("检测到环境变量 HUAWEICLOUD_SDK_AK 和 HUAWEICLOUD_SDK_SK，将使用环境变量中的凭证")
-    except ApiValueError:
-        if ServerCfg.hw_api_ak and ServerCfg.hw_api_sk:
+        while pending and winner is None:
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                if task.exception() is not None:
+                    warning(f"下载 {tasks[task]} 时出错：{task.exception()}")
+                elif winner is None:
+                    winner = (tasks[task], task.result())
+                else:
+                    task.result().release()
+    finally:
+        for task in pending:
+            task.cancel()
+        # 取消前已经完成的请求也要释放连接
+        for result in await asyncio.gather(*pending, return_exceptions=True):
+            if isinstance(result, aiohttp.ClientResponse):
+                result.release()
+    return winner
+
+
+async def download_ip_lists(session: aiohttp.ClientSession, force: bool = False) -> bool:
+    """
+    下载 IP 地址数据包，返回数据包是否发生变化
+
+    先向上次使用的镜像发出条件请求（带上次的 ETag、Last-Modified），未变化时（304）
+    只需要这一次请求且不写入文件；该镜像失败或没有记录时同时请求其余镜像，使用最先响应的镜像。
+    各镜像的验证信息分别保存。数据流式写入临时文件，校验通过后再替换原文件
+    """
+    info("正在检查 IP 地址数据包更新……")
+    if force or not os.path.isfile(ServerCfg.ip_lists_filepath):
+        meta = {}
+    else:
+        meta = load_ip_lists_meta()
+    validators: dict[str, dict] = meta.get("validators") or {}
+    urls = list(ServerCfg.ip_lists_urls)
+    last_url = meta.get("last_url")
+    first = [last_url] if last_url in urls and validators.get(last_url) else []
+    tmp_path = f"{ServerCfg.ip_lists_filepath}.{os.getpid()}.part"
+    while urls:
+        result = await race_ip_lists(session, first or urls, validators)
+        if result is None:
+            if first:
+                urls.remove(first.pop())
+                continue
+            break
+        first = []
+        url, response = result
+        urls.remove(url)
+        try:
+            if response.status == 304:
+                info(f"IP 地址数据包没有变化（{url}）")
+                # 更新修改时间，用于计算下次检查的时间
+                os.utime(ServerCfg.ip_lists_filepath)
+                if url != last_url:
+                    save_ip_lists_meta({"last_url": url, "validators": validators})
+                return False
+            info(f"正在从 {url} 下载 IP 地址数据包……")
+            size = 0
+            with open(tmp_path, "wb") as f:
+                async for chunk in response.content.iter_chunked(1 << 16):
+                    f.write(chunk)
+                    size += len(chunk)
+            if response.content_length is not None and size != response.content_length:
+                raise ValueError(f"大小不一致：{size} != {response.content_length}")
+            with zipfile.ZipFile(tmp_path) as f:
+                bad_file = f.testzip()
+                if bad_file is not None:
+                    raise zipfile.BadZipFile(f"{bad_file} 校验失败")
+            os.replace(tmp_path, ServerCfg.ip_lists_filepath)
+        except Exception as e:
+            warning(f"下载 {url} 时出错：{e}")
+            continue
+        finally:
+            response.release()
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        validators[url] = {
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+        }
+        save_ip_lists_meta({"last_url": url, "validators": validators})
+        info(f"已下载 IP 地址数据包（{size} 字节）")
+        return True
+    error("错误：所有镜像均下载失败")
+    return False
+
+
+class PackedU128:
+    """
+    按大端序紧密排列的 128 位无符号整数数组（只读），支持 bisect
+    """
+
+    def __init__(self, buffer: memoryview):
+        self.buffer = buffer
+
+    def __len__(self) -> int:
+        return len(self.buffer) // 16
+
+    def __getitem__(self, index: int) -> int:
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("PackedU128 index out of range")
+        return int.from_bytes(self.buffer[index * 16 : index * 16 + 16], "big")
+
+    def slice(self, start: int, stop: int) -> "PackedU128":
+        return PackedU128(self.buffer[start * 16 : stop * 16])
+
+    @staticmethod
+    def pack(values: list[int]) -> bytes:
+        return b"".join(value.to_bytes(16, "big") for value in values)
+
+
+class IpIndex:
+    """
+    运营商 IP 地址索引
+
+    将各运营商的 CIDR 展开为互不重叠的有序区间（IPv4、IPv6 分开存放），
+    每个区间记录最长前缀匹配到的运营商，查询时二分查找区间起点。
+    同时保存每个运营商合并后的地址范围，用于按运营商随机选取 IP。
+    索引可以编译为二进制文件，之后的运行直接 mmap 使用，无需解析
+    """
+
+    NO_ORG = 0xFFFF
+    MAGIC = b"DRMIPX01"
+    ENDIAN_CHECK = 0x01020304
+    # 魔数、字节序校验、数据包 SHA-256、机构表长度、IPv4 区间数、IPv6 区间数、IPv4 范围数、IPv6 范围数
+    HEADER = struct.Struct("=8sI32sQQQQQ")
+
+    def __init__(
+        self,
+        orgs: list[str],
+        v4_starts,
+        v4_org_ids,
+        v6_starts,
+        v6_org_ids,
+        org_ranges: dict[str, dict[int, tuple]],
+        buffer: mmap.mmap | None = None,
+    ):
+        self.orgs: list[str] = orgs
+        self.v4_starts = v4_starts
+        self.v4_org_ids = v4_org_ids
+        self.v6_starts = v6_starts
+        self.v6_org_ids = v6_org_ids
+        # 运营商 -> {IP 版本: (范围起点序列, 范围终点序列)}
+        self.org_ranges: dict[str, dict[int, tuple]] = org_ranges
+        # 从文件加载时持有 mmap，保证各个 memoryview 有效
+        self.buffer = buffer
+
+    @classmethod
+    def build(cls, ip_lists: dict[str, list[str]]) -> "IpIndex":
+        """
+        从 运营商 -> CIDR 列表 构建索引，同一前缀出现在多个运营商时以先出现的为准
+        """
+        orgs = list(ip_lists)
+        v4_prefixes, v6_prefixes = [], []
+        org_ranges: dict[str, dict[int, tuple]] = {}
+        for org_id, org in enumerate(orgs):
+            ranges = cls.parse_cidrs(org, ip_lists[org])
+            v4_prefixes.extend((start, end, org_id) for start, end in ranges[4])
+            v6_prefixes.extend((start, end, org_id) for start, end in ranges[6])
+            org_ranges[org] = {
+                version: cls._merge_ranges(items) for version, items in ranges.items()
+            }
+        v4_starts, v4_org_ids = cls._flatten(v4_prefixes, 2**32)
+        v6_starts, v6_org_ids = cls._flatten(v6_prefixes, 2**128)
+        debug(f"IP 地址索引：IPv4 {len(v4_starts)} 个区间，IPv6 {len(v6_starts)} 个区间")
+        return cls(orgs, v4_starts, v4_org_ids, v6_starts, v6_org_ids, org_ranges)
+
+    @staticmethod
+    def parse_cidrs(org: str, cidrs: list[str]) -> dict[int, list[tuple[int, int]]]:
+        """
+        解析运营商的 CIDR 列表，返回 {IP 版本: [(起点, 终点)]}
+        """
+        ranges = {4: [], 6: []}
+        for cidr in cidrs:
+            cidr = cidr.strip()
+            if not cidr:
+                continue
+            try:
+                network = ipaddress.ip_network(cidr, strict=False)
+            except ValueError:
+                warning(f"{org} 中的 {cidr} 不是有效的 CIDR，将跳过")
+                continue
+            ranges[network.version].append(
+                (int(network.network_address), int(network.broadcast_address))
+            )
+        return ranges
+
+    @staticmethod
+    def _merge_ranges(ranges: list[tuple[int, int]]) -> tuple[list, list]:
+        """
+        合并重叠、相邻的地址范围，返回 (起点列表, 终点列表)
+        """
+        starts: list[int] = []
+        ends: list[int] = []
+        for start, end in sorted(ranges):
+            if ends and start <= ends[-1] + 1:
+                ends[-1] = max(ends[-1], end)
+            else:
+                starts.append(start)
+                ends.append(end)
+        return starts, ends
+
+    @classmethod
+    def _flatten(
+        cls, prefixes: list[tuple[int, int, int]], space: int
+    ) -> tuple[list, list]:
+        """
+        将可能互相嵌套的前缀展开为互不重叠的区间，返回 (区间起点列表, 运营商编号列表)
+        """
+        # CIDR 之间只有嵌套或不相交两种关系，外层排在内层前面
+        prefixes.sort(key=lambda prefix: (prefix[0], -prefix[1]))
+        starts: list[int] = []
+        org_ids: list[int] = []
+
+        def emit(start: int, org_id: int):
+            if start >= space:
+                return
+            if starts and starts[-1] == start:
+                # 上一个区间长度为 0，直接覆盖
+                starts.pop()
+                org_ids.pop()
+            if org_ids and org_ids[-1] == org_id:
+                return
+            starts.append(start)
+            org_ids.append(org_id)
+
+        stack: list[tuple[int, int, int]] = []
+        for start, end, org_id in prefixes:
+            while stack and stack[-1][1] < start:
+                top = stack.pop()
+                emit(top[1] + 1, stack[-1][2] if stack else cls.NO_ORG)
+            if stack and stack[-1][0] == start and stack[-1][1] == end:
+                continue
+            emit(start, org_id)
+            stack.append((start, end, org_id))
+        while stack:
+            top = stack.pop()
+            emit(top[1] + 1, stack[-1][2] if stack else cls.NO_ORG)
+        return starts, org_ids
+
+    @staticmethod
+    def _layout(org_table_len: int, v4_num: int, v6_num: int, r4_num: int, r6_num: int):
+        """
+        计算编译文件中各段的 (偏移, 长度)，每段按 16 字节对齐
+        """
+        sizes = [
+            ("org_table", org_table_len),
+            ("v4_starts", 4 * v4_num),
+            ("v4_org_ids", 2 * v4_num),
+            ("v6_starts", 16 * v6_num),
+            ("v6_org_ids", 2 * v6_num),
+            ("r4_starts", 4 * r4_num),
+            ("r4_ends", 4 * r4_num),
+            ("r6_starts", 16 * r6_num),
+            ("r6_ends", 16 * r6_num),
+        ]
+        layout = {}
+        offset = IpIndex.HEADER.size
+        for name, size in sizes:
+            offset = (offset + 15) // 16 * 16
+            layout[name] = (offset, size)
+            offset += size
+        return layout, offset
+
+    def save(self, path: str, digest: bytes):
+        """
+        将索引编译为二进制文件，先写入临时文件再替换，避免其他进程读到不完整的文件
+        """
+        r4_starts, r4_ends, r6_starts, r6_ends = [], [], [], []
+        org_table = []
+        for org in self.orgs:
+            entry = {"name": org}
+            for version, starts, ends in (
+                (4, r4_starts, r4_ends),
+                (6, r6_starts, r6_ends),
+            ):
+                org_starts, org_ends = self.org_ranges[org][version]
+                entry[f"v{version}"] = [len(starts), len(org_starts)]
+                starts.extend(org_starts)
+                ends.extend(org_ends)
+            org_table.append(entry)
+        org_table_bytes = json.dumps(org_table, ensure_ascii=False).encode()
+        counts = (
+            len(org_table_bytes),
+            len(self.v4_starts),
+            len(self.v6_starts),
+            len(r4_starts),
+            len(r6_starts),
+        )
+        layout, total = self._layout(*counts)
+        sections = {
+            "org_table": org_table_bytes,
+            "v4_starts": array.array("I", self.v4_starts).tobytes(),
+            "v4_org_ids": array.array("H", self.v4_org_ids).tobytes(),
+            "v6_starts": PackedU128.pack(self.v6_starts),
+            "v6_org_ids": array.array("H", self.v6_org_ids).tobytes(),
+            "r4_starts": array.array("I", r4_starts).tobytes(),
+            "r4_ends": array.array("I", r4_ends).tobytes(),
+            "r6_starts": PackedU128.pack(r6_starts),
+            "r6_ends": PackedU128.pack(r6_ends),
+        }
+        data = bytearray(total)
+        data[: self.HEADER.size] = self.HEADER.pack(
+            self.MAGIC, self.ENDIAN_CHECK, digest, *counts
+        )
+        for name, (offset, size) in layout.items():
+            data[offset : offset + size] = sections[name]
+        atomic_write(path, data)
+
+    @classmethod
+    def load(cls, path: str, digest: bytes) -> "IpIndex | None":
+        """
+        mmap 加载编译好的索引，文件不存在、损坏或与数据包不匹配时返回 None
+        """
+        try:
+            with open(path, "rb") as f:
+                buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return None
+        try:
+            magic, endian_check, file_digest, *counts = cls.HEADER.unpack_from(buffer)
+            if (
+                magic != cls.MAGIC
+                or endian_check != cls.ENDIAN_CHECK
+                or file_digest != digest
+            ):
+                buffer.close()
+                return None
+            layout, total = cls._layout(*counts)
+            if len(buffer) != total:
+                buffer.close()
+                return None
+            view = memoryview(buffer)
+
+            def section(name: str) -> memoryview:
+                offset, size = layout[name]
+                return view[offset : offset + size]
+
+            org_table = json.loads(bytes(section("org_table")))
+            r4_starts = section("r4_starts").cast("I")
+            r4_ends = section("r4_ends").cast("I")
+            r6_starts = PackedU128(section("r6_starts"))
+            r6_ends = PackedU128(section("r6_ends"))
+            org_ranges = {}
+            for entry in org_table:
+                v4_offset, v4_num = entry["v4"]
+                v6_offset, v6_num = entry["v6"]
+                org_ranges[entry["name"]] = {
+                    4: (
+                        r4_starts[v4_offset : v4_offset + v4_num],
+                        r4_ends[v4_offset : v4_offset + v4_num],
+                    ),
+                    6: (
+                        r6_starts.slice(v6_offset, v6_offset + v6_num),
+                        r6_ends.slice(v6_offset, v6_offset + v6_num),
+                    ),
+                }
+            return cls(
+                [entry["name"] for entry in org_table],
+                section("v4_starts").cast("I"),
+                section("v4_org_ids").cast("H"),
+                PackedU128(section("v6_starts")),
+                section("v6_org_ids").cast("H"),
+                org_ranges,
+                buffer,
+            )
+        except (struct.error, ValueError, KeyError, TypeError) as e:
+            warning(f"IP 地址索引文件 {path} 已损坏：{e}")
+            return None
+
+    def lookup(self, ip: str) -> str:
+        """
+        查询单个 IP 所在运营商，未找到时返回 other
+        """
+        # inet_pton 比 ipaddress 解析快一个数量级，批量分类时差别明显
+        try:
+            address = socket.inet_pton(socket.AF_INET, ip)
+            starts, org_ids = self.v4_starts, self.v4_org_ids
+        except OSError:
+            try:
+                address = socket.inet_pton(socket.AF_INET6, ip)
+            except OSError:
+                raise ValueError(f"{ip} 不是有效的 IP 地址") from None
+            starts, org_ids = self.v6_starts, self.v6_org_ids
+        index = bisect.bisect_right(starts, int.from_bytes(address, "big")) - 1
+        if index < 0 or org_ids[index] == self.NO_ORG:
+            return "other"
+        return self.orgs[org_ids[index]]
+
+    def lookup_many(self, ips: list[str]) -> list[str]:
+        """
+        批量查询 IP 所在运营商，返回结果与输入顺序一致
+        """
+        return [self.lookup(ip) for ip in ips]
+
+
+def file_sha256(path: str) -> bytes:
+    """
+    计算文件的 SHA-256
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(1 << 20):
+            digest.update(chunk)
+    return digest.digest()
+
+
+def read_ip_lists(path: str) -> dict[str, list[str]]:
+    """
+    读取 IP 地址数据包中各运营商的 CIDR 列表
+    """
+    ip_lists = {}
+    with zipfile.ZipFile(path) as f:
+        for filename in f.namelist():
+            if filename.endswith(".txt"):
+                ip_lists[os.path.basename(filename)[:-4]] = (
+                    f.read(filename).decode().splitlines()
+                )
+    return ip_lists
+
+
+def read_ip_list(path: str, org: str) -> list[str] | None:
+    """
+    只解压 IP 地址数据包中指定运营商的 CIDR 列表，不存在时返回 None
+    """
+    with zipfile.ZipFile(path) as f:
+        for filename in f.namelist():
+            if os.path.basename(filename) == f"{org}.txt":
+                return f.read(filename).decode().splitlines()
+    return None
+
+
+async def ensure_ip_lists(session: aiohttp.ClientSession):
+    """
+    IP 地址数据包不存在或超过检查间隔时下载（条件请求）
+    """
+    try:
+        age = time.time() - os.stat(ServerCfg.ip_lists_filepath).st_mtime
+    except OSError:
+        # IP 地址数据包不存在，下载
+        age = None
+    if age is None or age >= ServerCfg.ip_lists_refresh_interval:
+        await download_ip_lists(session)
+
+
+async def load_ip_org(session: aiohttp.ClientSession) -> IpIndex | None:
+    """
+    加载 IP 地址数据索引，数据包变化时重新解压、编译
+    """
+    await ensure_ip_lists(session)
+    for retry in (False, True):
+        try:
+            digest = file_sha256(ServerCfg.ip_lists_filepath)
+        except OSError as e:
+            error(f"读取 IP 地址数据包时出错：{e}")
+            return None
+        index = IpIndex.load(ServerCfg.ip_index_filepath, digest)
+        if index is not None:
+            debug(f"已加载 IP 地址索引 {ServerCfg.ip_index_filepath}")
+            return index
+        info("正在编译 IP 地址索引……")
+        try:
+            index = IpIndex.build(read_ip_lists(ServerCfg.ip_lists_filepath))
+            break
+        except zipfile.BadZipFile as e:
+            if retry:
+                error(f"解压 IP 地址数据包时出错：{e}")
+                return None
+            error(f"解压 IP 地址数据包时出错：{e}，尝试重新下载")
+            if not await download_ip_lists(session, force=True):
+                return None
+    try:
+        index.save(ServerCfg.ip_index_filepath, digest)
+    except OSError as e:
+        warning(f"保存 IP 地址索引时出错：{e}")
+    return index
+
+
+class IpDatabase:
+    """
+    延迟加载的运营商 IP 地址数据
+
+    第一次查询 IP 所在运营商时才下载（如有需要）并 mmap 加载编译好的索引，
+    只用到的地址族对应的页才会被读入内存；只需要某个运营商的地址范围时，
+    只解压数据包中该运营商的文件。超过检查间隔后重新加载
+    """
+
+    def __init__(self):
+        self.session: aiohttp.ClientSession | None = None
+        self.index: IpIndex | None = None
+        self.index_loaded_at: float | None = None
+        # 未加载索引时单独读取的 运营商 -> {IP 版本: (范围起点列表, 范围终点列表)}
+        self.org_ranges: dict[str, dict[int, tuple] | None] = {}
+        self.org_ranges_loaded_at: float | None = None
+        self.lock = asyncio.Lock()
+
+    @staticmethod
+    def expired(loaded_at: float | None) -> bool:
+        return (
+            loaded_at is None
+            or time.time() - loaded_at >= ServerCfg.ip_lists_refresh_interval
+        )
+
+    async def get_index(self) -> IpIndex | None:
+        if self.expired(self.index_loaded_at):
+            async with self.lock:
+                if self.expired(self.index_loaded_at):
+                    self.index = await load_ip_org(self.session)
+                    self.index_loaded_at = time.time()
+        return self.index
+
+    def cached_org_ranges(self, org: str) -> tuple[bool, dict[int, tuple] | None]:
+        if self.index is not None and not self.expired(self.index_loaded_at):
+            return True, self.index.org_ranges.get(org)
+        if org in self.org_ranges and not self.expired(self.org_ranges_loaded_at):
+            return True, self.org_ranges[org]
+        return False, None
+
+    async def get_org_ranges(self, org: str) -> dict[int, tuple] | None:
+        found, ranges = self.cached_org_ranges(org)
+        if found:
+            return ranges
+        async with self.lock:
+            found, ranges = self.cached_org_ranges(org)
+            if found:
+                return ranges
+            if self.expired(self.org_ranges_loaded_at):
+                self.org_ranges.clear()
+                await ensure_ip_lists(self.session)
+                self.org_ranges_loaded_at = time.time()
+            try:
+                cidrs = read_ip_list(ServerCfg.ip_lists_filepath, org)
+            except (OSError, zipfile.BadZipFile) as e:
+                error(f"读取 IP 地址数据包时出错：{e}")
+                return None
+            if cidrs is not None:
+                ranges = {
+                    version: IpIndex._merge_ranges(items)
+                    for version, items in IpIndex.parse_cidrs(org, cidrs).items()
+                }
+            self.org_ranges[org] = ranges
+            return ranges
+
+
+async def get_ip_org(ip: str) -> str:
+    """
+    获取 IP 所在运营商
+    """
+    index = await ServerCfg.ip_db.get_index()
+    if index is None:
+        return "other"
+    org = index.lookup(ip)
+    debug(f"{ip} 的运营商：{org}")
+    return org
+
+
+async def get_ips_org(ips: list[str]) -> list[str]:
+    """
+    批量获取 IP 所在运营商，返回结果与输入顺序一致
+    """
+    index = await ServerCfg.ip_db.get_index()
+    if index is None:
+        return ["other"] * len(ips)
+    return index.lookup_many(ips)
+
+
+ServerCfg.ip_db = IpDatabase()
+
+
+def sample_offsets(total: int, num: int, rng: random.Random) -> list[int]:
+    """
+    从 [0, total) 中不放回地随机选取 num 个整数，内存占用只与 num 有关
+    """
+    num = min(num, total)
+    if total <= sys.maxsize:
+        return rng.sample(range(total), num)
+    # 超出 range 长度上限时（IPv6），num 远小于 total，重复概率可以忽略
+    chosen: dict[int, None] = {}
+    while len(chosen) < num:
+        chosen[rng.randrange(total)] = None
+    return list(chosen)
+
+
+async def choose_ips(num: int, org: str, seed: int | None = None) -> list[str]:
+    """
+    从指定的已加载的 IP 地址数据中随机选择指定数量的 IP 地址
+
+    按各地址范围的大小加权、不放回地抽取整数偏移量，再映射回地址，
+    不展开具体地址；指定 seed 时结果可复现
+    """
+    org_ranges = await ServerCfg.ip_db.get_org_ranges(org)
+    if org_ranges is None:
+        error(f"错误：未知的 IP 地址数据库：{org}")
+        return []
+    # 各地址范围的 (IP 版本, 起点) 以及到该范围结束为止的累计地址数
+    range_starts: list[tuple[int, int]] = []
+    cumulative: list[int] = []
+    total = 0
+    for version, (starts, ends) in org_ranges.items():
+        for start, end in zip(starts, ends):
+            total += end - start + 1
+            range_starts.append((version, start))
+            cumulative.append(total)
+    rng = random.Random(seed) if seed is not None else random
+    ips = []
+    for offset in sample_offsets(total, num, rng):
+        index = bisect.bisect_right(cumulative, offset)
+        version, start = range_starts[index]
+        ip = start + offset - (cumulative[index - 1] if index else 0)
+        if version == 4:
+            ips.append(str(ipaddress.IPv4Address(ip)))
+        else:
+            ips.append(str(ipaddress.IPv6Address(ip)))
+    return ips
+
+
+class DnsCache:
+    """
+    DNS 查询结果缓存
+
+    以 (域名, 记录类型) 为键，按应答中的 TTL 过期；相同的并发查询合并为一次，
+    可以保存到文件中供下一次运行使用
+    """
+
+    def __init__(self):
+        # (域名, 记录类型) -> (过期时间戳, 记录值列表)
+        self.entries: dict[tuple[str, str], tuple[float, list[str]]] = {}
+        # 正在进行的查询
+        self.pending: dict[tuple[str, str], asyncio.Task] = {}
+        self.hits: int = 0
+        self.misses: int = 0
+
+    def get(self, name: str, record_type: str) -> list[str] | None:
+        entry = self.entries.get((name, record_type))
+        if entry is None:
+            return None
+        expires, records = entry
+        if expires <= time.time():
+            del self.entries[(name, record_type)]
+            return None
+        return records
+
+    def put(self, name: str, record_type: str, records: list[str], ttl: int):
+        if ttl > 0:
+            self.entries[(name, record_type)] = (time.time() + ttl, records)
+
+    def store(self, name: str, record_type: str, answer: "DnsAnswer"):
+        """
+        缓存应答中的所有记录集（包括 CNAME 链上的中间域名），链的终点没有记录时按 negative_ttl 缓存
+        """
+        for (owner, rtype), (records, ttl) in answer.rrsets.items():
+            self.put(owner, rtype, records, ttl)
+        end, records = answer.follow(name, record_type)
+        if records is None:
+            self.put(end, record_type, [], answer.negative_ttl)
+
+    def load(self, path: str):
+        """
+        从文件中读取未过期的缓存
+        """
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entries = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            warning(f"读取 DNS 缓存文件 {path} 时出错：{e}")
+            return
+        now = time.time()
+        for name, record_type, expires, records in entries:
+            if expires > now:
+                self.entries[(name, record_type)] = (expires, records)
+        debug(f"从 {path} 读取了 {len(self.entries)} 条 DNS 缓存")
+
+    def save(self, path: str):
+        """
+        将未过期的缓存保存到文件
+        """
+        now = time.time()
+        entries = [
+            [name, record_type, expires, records]
+            for (name, record_type), (expires, records) in self.entries.items()
+            if expires > now
+        ]
+        try:
+            atomic_write(path, json.dumps(entries, ensure_ascii=False))
+        except OSError as e:
+            warning(f"保存 DNS 缓存文件 {path} 时出错：{e}")
+
+
+class HealthCache:
+    """
+    健康检查结果缓存
+
+    以 (协议, 主机, 端口, 路径, Host 头) 为键，保存 health_check_cache_ttl 秒；
+    守护模式下在多次同步之间复用，相同的并发检查合并为一次
+    """
+
+    def __init__(self):
+        # 键 -> (过期时间戳, 延迟，未通过检查时为 None)
+        self.entries: dict[tuple, tuple[float, float | None]] = {}
+        # 正在进行的检查
+        self.pending: dict[tuple, asyncio.Task] = {}
+        self.hits: int = 0
+        self.misses: int = 0
+
+    def get(self, key: tuple) -> tuple[float, float | None] | None:
+        entry = self.entries.get(key)
+        if entry is not None and entry[0] <= time.time():
+            del self.entries[key]
+            return None
+        return entry
+
+    def put(self, key: tuple, rtt: float | None):
+        if ServerCfg.health_check_cache_ttl > 0:
+            self.entries[key] = (time.time() + ServerCfg.health_check_cache_ttl, rtt)
+
+
+class DohResolver:
+    """
+    DoH 服务器及其统计
+
+    wire 为 True 时使用 RFC 8484 的 application/dns-message 格式，否则使用 JSON 格式；
+    latency 为成功查询延迟的指数移动平均，用于决定查询时的优先顺序
+    """
+
+    def __init__(self, url: str, wire: bool = False):
+        self.url: str = url
+        self.wire: bool = wire
+        self.queries: int = 0
+        self.errors: int = 0
+        self.latency: float | None = None
+
+    def score(self) -> float:
+        """
+        预计的查询耗时，失败时最多多等待 dns_hedge_delay 秒后改用下一个服务器；
+        从未查询过时为 0，使其优先被尝试；从未成功过时按失败次数计算，排在可用的服务器之后
+        """
+        if self.queries == 0:
+            return 0
+        if self.latency is None:
+            return ServerCfg.dns_hedge_delay * (1 + self.errors)
+        return self.latency + ServerCfg.dns_hedge_delay * self.errors / self.queries
+
+    def record(self, latency: float | None):
+        """
+        记录一次查询结果，latency 为 None 表示查询失败
+        """
+        self.queries += 1
+        if latency is None:
+            self.errors += 1
+        elif self.latency is None:
+            self.latency = latency
+        else:
+            self.latency = self.latency * 0.7 + latency * 0.3
+
+
+def build_resolvers(entries: list) -> list[DohResolver]:
+    """
+    根据配置创建 DoH 服务器列表，配置项可以是 URL 或 {url, format}；
+    重新加载配置时保留已有服务器的统计
+    """
+    existing = {(r.url, r.wire): r for r in ServerCfg.resolvers}
+    resolvers = []
+    for entry in entries:
+        if isinstance(entry, dict):
+            url = entry.get("url", "")
+            wire = entry.get("format", ServerCfg.dns_query_format) == "wire"
+        else:
+            url = entry
+            wire = ServerCfg.dns_query_format == "wire"
+        if not url or any(r.url == url and r.wire == wire for r in resolvers):
+            continue
+        resolvers.append(existing.get((url, wire)) or DohResolver(url, wire))
+    return resolvers
+
+
+def build_dns_query(name: str, record_type: str) -> bytes:
+    """
+    构造 DNS 查询报文，按 RFC 8484 的建议 ID 为 0
+    """
+    qname = b"".join(
+        bytes([len(label)]) + label
+        for label in name.rstrip(".").encode().split(b".")
+        if label
+    )
+    return (
+        struct.pack("!HHHHHH", 0, 0x0100, 1, 0, 0, 0)
+        + qname
+        + b"\x00"
+        + struct.pack("!HH", dns_types[record_type], 1)
+    )
+
+
+def read_dns_name(message: bytes, offset: int) -> tuple[str, int]:
+    """
+    读取报文中 offset 处的域名（支持压缩指针），返回 (域名, 域名之后的位置)
+    """
+    labels = []
+    end = None
+    jumps = 0
+    while True:
+        length = message[offset]
+        if length & 0xC0 == 0xC0:
+            if end is None:
+                end = offset + 2
+            jumps += 1
+            if jumps > 127:
+                raise ValueError("域名压缩指针循环")
+            offset = (length & 0x3F) << 8 | message[offset + 1]
+            continue
+        offset += 1
+        if length == 0:
+            break
+        labels.append(message[offset : offset + length].decode("ascii", "replace"))
+        offset += length
+    return ".".join(labels) + ".", offset if end is None else end
+
+
+def quote_character_string(data: bytes) -> str:
+    text = data.decode("utf-8", "replace").replace("\\", "\\\\").replace('"', '\\"')
+    return f'"{text}"'
+
+
+def format_rdata(message: bytes, rtype: int, offset: int, length: int) -> str:
+    """
+    将记录数据转换为与 JSON 格式查询结果相同的文本格式
+    """
+    rdata = message[offset : offset + length]
+    if rtype == dns_types["A"]:
+        return socket.inet_ntop(socket.AF_INET, rdata)
+    if rtype == dns_types["AAAA"]:
+        return socket.inet_ntop(socket.AF_INET6, rdata)
+    if rtype in {dns_types["NS"], dns_types["CNAME"], dns_types["PTR"]}:
+        return read_dns_name(message, offset)[0]
+    if rtype == dns_types["MX"]:
+        (preference,) = struct.unpack_from("!H", rdata)
+        return f"{preference} {read_dns_name(message, offset + 2)[0]}"
+    if rtype == dns_types["SRV"]:
+        priority, weight, port = struct.unpack_from("!HHH", rdata)
+        return f"{priority} {weight} {port} {read_dns_name(message, offset + 6)[0]}"
+    if rtype in {dns_types["TXT"], dns_types["SPF"]}:
+        strings = []
+        index = 0
+        while index < len(rdata):
+            strings.append(quote_character_string(rdata[index + 1 : index + 1 + rdata[index]]))
+            index += 1 + rdata[index]
+        return " ".join(strings)
+    if rtype == dns_types["CAA"]:
+        flags, tag_length = rdata[0], rdata[1]
+        tag = rdata[2 : 2 + tag_length].decode("ascii", "replace")
+        return f"{flags} {tag} {quote_character_string(rdata[2 + tag_length :])}"
+    # RFC 3597 的通用格式
+    return f"\\# {length} {rdata.hex()}"
+
+
+class DnsAnswer:
+    """
+    DoH 应答中与查询相关的记录集
+
+    rrsets 以 (所有者域名, 记录类型) 为键，值为 (记录值列表, TTL)，包含 CNAME 链上的记录集；
+    negative_ttl 为 Authority 中的最小 TTL，用于缓存没有记录的应答
+    """
+
+    # CNAME 链的最大长度
+    max_chain: int = 16
+
+    def __init__(self):
+        self.rrsets: dict[tuple[str, str], tuple[list[str], int]] = {}
+        self.negative_ttl: int = 0
+
+    @staticmethod
+    def normalize(name: str) -> str:
+        return name.lower().rstrip(".") + "."
+
+    def add(self, name: str, record_type: str, data: str, ttl: int):
+        key = (self.normalize(name), record_type)
+        records, min_ttl = self.rrsets.get(key, ([], ttl))
+        records.append(data)
+        self.rrsets[key] = (records, min(min_ttl, ttl))
+
+    def follow(self, name: str, record_type: str) -> tuple[str, list[str] | None]:
+        """
+        沿 CNAME 链查找记录，返回 (链的终点, 记录值列表)，应答中没有终点的记录时为 None
+        """
+        name = self.normalize(name)
+        for _ in range(self.max_chain):
+            target = self.rrsets.get((name, "CNAME"))
+            if not target:
+                break
+            name = self.normalize(target[0][0])
+        entry = self.rrsets.get((name, record_type))
+        return name, entry[0] if entry else None
+
+
+# 类型代码 -> 类型名
+dns_type_names = {code: name for name, code in dns_types.items()}
+
+
+def parse_dns_response(message: bytes, record_type: str) -> tuple[DnsAnswer, int]:
+    """
+    解析 DNS 应答报文中 record_type 和 CNAME 类型的记录，返回 (应答, 响应码)
+    """
+    _, flags, qdcount, ancount, nscount, _ = struct.unpack_from("!HHHHHH", message)
+    offset = 12
+    for _ in range(qdcount):
+        offset = read_dns_name(message, offset)[1] + 4
+    answer = DnsAnswer()
+    authority_ttls = []
+    for section, count in (("answer", ancount), ("authority", nscount)):
+        for _ in range(count):
+            owner, offset = read_dns_name(message, offset)
+            rtype, _, ttl, length = struct.unpack_from("!HHIH", message, offset)
+            offset += 10
+            if section == "authority":
+                authority_ttls.append(ttl)
+            elif rtype in {dns_types[record_type], dns_types["CNAME"]}:
+                answer.add(
+                    owner,
+                    dns_type_names[rtype],
+                    format_rdata(message, rtype, offset, length),
+                    ttl,
+                )
+            offset += length
+    answer.negative_ttl = min(authority_ttls, default=0)
+    return answer, flags & 0x000F
+
+
+async def query_resolver(
+    session: aiohttp.ClientSession,
+    resolver: DohResolver,
+    name: str,
+    record_type: str,
+) -> DnsAnswer | None:
+    """
+    向单个 DoH 服务器查询记录，查询失败时返回 None
+    """
+    import aiohttp
+
+    loop = asyncio.get_running_loop()
+    start_time = loop.time()
+    timeout = aiohttp.ClientTimeout(total=ServerCfg.dns_query_timeout)
+    try:
+        if resolver.wire:
+            async with session.post(
+                resolver.url,
+                data=build_dns_query(name, record_type),
+                headers={
+                    "Accept": "application/dns-message",
+                    "Content-Type": "application/dns-message",
+                },
+                timeout=timeout,
+            ) as response:
+                response.raise_for_status()
+                answer, rcode = parse_dns_response(await response.read(), record_type)
+        else:
+            async with session.get(
+                resolver.url,
+                params={"name": name, "type": record_type},
+                headers={"Accept": "application/dns-json"},
+                timeout=timeout,
+            ) as response:
+                response.raise_for_status()
+                response_json = await response.json(content_type=None)
+            answer = DnsAnswer()
+            for rr in response_json.get("Answer", []):
+                if rr["type"] in {dns_types[record_type], dns_types["CNAME"]}:
+                    answer.add(
+                        rr["name"], dns_type_names[rr["type"]], rr["data"], rr.get("TTL", 0)
+                    )
+            answer.negative_ttl = min(
+                (rr.get("TTL", 0) for rr in response_json.get("Authority", [])),
+                default=0,
+            )
+            rcode = response_json.get("Status", 0)
+        # 只接受 NOERROR 和 NXDOMAIN，SERVFAIL 等视为查询失败
+        if rcode not in {0, 3}:
+            raise ValueError(f"响应码为 {rcode}")
+    except asyncio.CancelledError:
+        # 其他服务器先返回了结果，已等待的时间是延迟的下限
+        resolver.record(loop.time() - start_time)
+        raise
+    except asyncio.TimeoutError:
+        debug(f"通过 {resolver.url} 查询 {name} {record_type} 记录超时")
+        resolver.record(None)
+        return None
+    except Exception as e:
+        debug(f"通过 {resolver.url} 查询 {name} {record_type} 记录时出错：{e}")
+        resolver.record(None)
+        return None
+    resolver.record(loop.time() - start_time)
+    return answer
+
+
+async def query_record(
+    session: aiohttp.ClientSession,
+    name: str,
+    record_type: str,
+) -> DnsAnswer | None:
+    """
+    通过 DoH 查询记录，所有服务器都查询失败时返回 None
+
+    按统计的预计耗时依次向各服务器查询：当前的查询都失败，或 dns_hedge_delay 秒内没有结果时，
+    向下一个服务器发出查询，使用最先成功的结果
+    """
+    loop = asyncio.get_running_loop()
+    resolvers = sorted(ServerCfg.resolvers, key=DohResolver.score)
+    tasks: set[asyncio.Future] = set()
+    async with ServerCfg.dns_query_semaphore:
+        try:
+            for index, resolver in enumerate(resolvers):
+                tasks.add(
+                    asyncio.ensure_future(
+                        query_resolver(session, resolver, name, record_type)
+                    )
+                )
+                last = index == len(resolvers) - 1
+                deadline = loop.time() + ServerCfg.dns_hedge_delay
+                while tasks:
+                    timeout = None if last else deadline - loop.time()
+                    if timeout is not None and timeout <= 0:
+                        break
+                    done, tasks = await asyncio.wait(
+                        tasks, timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+                    )
+                    for task in done:
+                        answer = task.result()
+                        if answer is not None:
+                            if not answer.follow(name, record_type)[1]:
+                                warning(f"{name} 没有 {record_type} 记录")
+                            return answer
+        finally:
+            for task in tasks:
+                task.cancel()
+    warning(f"查询 {name} {record_type} 记录失败")
+    return None
+
+
+async def lookup_record(
+    session: aiohttp.ClientSession,
+    name: str,
+    record_type: str,
+) -> list:
+    """
+    查询记录，优先使用缓存，相同的并发查询只发出一次请求
+
+    CNAME 链上的每个域名都单独缓存，指向同一 CDN 域名的多个来源只需查询一次链的终点
+    """
+    cache = ServerCfg.dns_cache
+    name = DnsAnswer.normalize(name)
+    for _ in range(DnsAnswer.max_chain):
+        content = cache.get(name, record_type)
+        if content is not None:
+            cache.hits += 1
+            debug(f"{name} 的 {record_type} 记录命中缓存")
+            return content.copy()
+        target = cache.get(name, "CNAME")
+        if not target:
+            break
+        name = DnsAnswer.normalize(target[0])
+    key = (name, record_type)
+    task = cache.pending.get(key)
+    if task is None:
+        cache.misses += 1
+        task = asyncio.ensure_future(query_record(session, name, record_type))
+        cache.pending[key] = task
+        try:
+            answer = await task
+        finally:
+            del cache.pending[key]
+        if answer is not None:
+            cache.store(name, record_type, answer)
+    else:
+        cache.hits += 1
+        answer = await task
+    if answer is None:
+        return []
+    return list(answer.follow(name, record_type)[1] or [])
+
+
+class RecordCandidates:
+    """
+    待截断的记录，以及每条记录的来源序号和分组（A、AAAA 记录为所在运营商，其他为来源）
+    """
+
+    def __init__(
+        self,
+        domain: str,
+        record_type: str,
+        records: list[str],
+        sources: list[int],
+        groups: list[str],
+        weights: list[float],
+        rtts: dict[str, float | None] | None = None,
+    ):
+        self.domain: str = domain
+        self.record_type: str = record_type
+        self.records: list[str] = records
+        self.sources: list[int] = sources
+        self.groups: list[str] = groups
+        self.weights: list[float] = weights
+        # 健康检查测得的延迟，未进行健康检查时为 None
+        self.rtts: dict[str, float | None] | None = rtts
+
+    def stable_key(self, record: str) -> bytes:
+        """
+        与运行次数无关的稳定排序键，使选出的记录不会在每次运行时变化
+        """
+        return hashlib.blake2b(
+            f"{self.domain}|{record}".encode(), digest_size=8
+        ).digest()
+
+    def stable_sorted(self, records: list[str]) -> list[str]:
+        return sorted(records, key=self.stable_key)
+
+
+async def truncate_stable_hash(candidates: RecordCandidates, limit: int) -> list[str]:
+    """
+    按记录的稳定哈希选择，记录集合不变时结果不变
+    """
+    return candidates.stable_sorted(candidates.records)[:limit]
+
+
+async def truncate_round_robin(candidates: RecordCandidates, limit: int) -> list[str]:
+    """
+    按运营商（非 A、AAAA 记录按来源）轮流选择，组内按稳定哈希排序
+    """
+    groups: dict[str, list[str]] = defaultdict(list)
+    for record, group in zip(candidates.records, candidates.groups):
+        groups[group].append(record)
+    ordered = [
+        candidates.stable_sorted(records)
+        for _, records in sorted(groups.items(), key=lambda kv: (-len(kv[1]), kv[0]))
+    ]
+    records = [
+        record
+        for row in itertools.zip_longest(*ordered)
+        for record in row
+        if record is not None
+    ]
+    return records[:limit]
+
+
+async def truncate_source_weight(candidates: RecordCandidates, limit: int) -> list[str]:
+    """
+    按来源的权重分配记录数（加权轮询），来源内按稳定哈希排序，来源的记录不足时余量分给其他来源
+
+    有记录的来源都没有正数权重时改用 round_robin，避免截断为空后禁用现有记录集
+    """
+    by_source: dict[int, list[str]] = defaultdict(list)
+    for record, source in zip(candidates.records, candidates.sources):
+        by_source[source].append(record)
+    # (下一次被选中的虚拟时间, 来源序号, 已选数量)
+    heap = []
+    for source, records in by_source.items():
+        by_source[source] = candidates.stable_sorted(records)
+        weight = candidates.weights[source]
+        if isinstance(weight, (int, float)) and not isinstance(weight, bool) and weight > 0:
+            heap.append((1 / weight, source, 0))
+    if not heap:
+        warning(
+            f"{candidates.domain} 的 {candidates.record_type} 记录的来源都没有有效的权重，将使用 round_robin 截断"
+        )
+        return await truncate_round_robin(candidates, limit)
+    heapq.heapify(heap)
+    result = []
+    while heap and len(result) < limit:
+        _, source, taken = heapq.heappop(heap)
+        result.append(by_source[source][taken])
+        taken += 1
+        if taken < len(by_source[source]):
+            heapq.heappush(
+                heap, ((taken + 1) / candidates.weights[source], source, taken)
+            )
+    return result
+
+
+async def tcp_rtt(host: str, port: int, semaphore: asyncio.Semaphore) -> float | None:
+    """
+    测量 TCP 建立连接的时间，失败时返回 None
+    """
+    async with semaphore:
+        loop = asyncio.get_running_loop()
+        start_time = loop.time()
+        try:
+            _, writer = await asyncio.wait_for(
+                asyncio.open_connection(host, port), ServerCfg.probe_timeout
+            )
+        except (OSError, asyncio.TimeoutError):
+            return None
+        rtt = loop.time() - start_time
+        writer.close()
+        return rtt
+
+
+async def http_rtt(
+    session: aiohttp.ClientSession,
+    url: str,
+    host: str,
+    semaphore: asyncio.Semaphore,
+) -> float | None:
+    """
+    测量 HTTP(S) 请求收到响应头的时间，失败或状态码为 5xx 时返回 None
+
+    只检查服务是否可用，不验证证书
+    """
+    import aiohttp
+
+    async with semaphore:
+        loop = asyncio.get_running_loop()
+        start_time = loop.time()
+        try:
+            async with session.get(
+                url,
+                headers={"Host": host} if host else None,
+                ssl=False,
+                allow_redirects=False,
+                timeout=aiohttp.ClientTimeout(total=ServerCfg.probe_timeout),
+            ) as response:
+                if response.status >= 500:
+                    return None
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            return None
+        return loop.time() - start_time
+
+
+async def truncate_latency(candidates: RecordCandidates, limit: int) -> list[str]:
+    """
+    优先选择延迟最低的记录，无法连接的排在最后；进行了健康检查时使用检查测得的延迟，
+    否则测量 A、AAAA 记录的 TCP 连接延迟，其他记录按稳定哈希选择
+    """
+    if candidates.rtts is not None:
+        rtts = [candidates.rtts.get(record) for record in candidates.records]
+    elif candidates.record_type in {"A", "AAAA"}:
+        rtts = await asyncio.gather(
+            *[
+                tcp_rtt(record, ServerCfg.probe_port, ServerCfg.probe_semaphore)
+                for record in candidates.records
+            ]
+        )
+    else:
+        return await truncate_stable_hash(candidates, limit)
+    ranked = sorted(
+        zip(candidates.records, rtts),
+        key=lambda item: (
+            item[1] is None,
+            item[1] or 0,
+            candidates.stable_key(item[0]),
+        ),
+    )
+    return [record for record, _ in ranked[:limit]]
+
+
+# 记录数超过上限时的截断策略
+truncate_strategies: dict[str, Callable] = {
+    "round_robin": truncate_round_robin,
+    "source_weight": truncate_source_weight,
+    "latency": truncate_latency,
+    "stable_hash": truncate_stable_hash,
+}
+
+
+async def truncate_records(
+    contents: list[list[str]],
+    record_type: str,
+    domain: str,
+    limit: int,
+    strategy: str = "",
+    weights: list[float] | None = None,
+    rtts: dict[str, float | None] | None = None,
+) -> list[str]:
+    """
+    合并各来源的记录（去重），超过 limit 时按截断策略选择；
+    rtts 为健康检查测得的延迟，未指定策略时按延迟选择
+    """
+    records: list[str] = []
+    sources: list[int] = []
+    seen: set[str] = set()
+    for source, content in enumerate(contents):
+        for record in content:
+            if record not in seen:
+                seen.add(record)
+                records.append(record)
+                sources.append(source)
+    if len(records) <= limit:
+        return records
+    strategy = strategy or ("latency" if rtts is not None else ServerCfg.truncate_strategy)
+    warning(
+        f"{domain} 的记录数 {len(records)} 超过了上限 {limit}，将使用 {strategy} 策略截断"
+    )
+    if record_type in {"A", "AAAA"}:
+        # 一次批量查询所有记录的运营商
+        with ServerCfg.metrics.phase("classify"):
+            groups = await get_ips_org(records)
+    else:
+        groups = [str(source) for source in sources]
+    if not weights or len(weights) != len(contents):
+        weights = [1.0] * len(contents)
+    candidates = RecordCandidates(
+        domain, record_type, records, sources, groups, weights, rtts
+    )
+    result = await truncate_strategies[strategy](candidates, max(0, limit))
+    debug(f"{domain} 查询到的记录（截断后）：{result}")
+    return result
+
+
+async def lookup_sources(
+    names: list,
+    record_type: str,
+    session: aiohttp.ClientSession,
+    domain: str = "",
+) -> list[list[str]]:
+    """
+    并发查询各来源的记录，结果顺序与 names 一致
+    """
+    contents = list(
+        await asyncio.gather(
+            *[lookup_record(session, name, record_type) for name in names]
+        )
+    )
+    debug(f"{domain} 查询到的 {record_type} 记录：{contents}")
+    return contents
+
+
+async def lookup_records(
+    names: list,
+    record_type: str,
+    session: aiohttp.ClientSession,
+    domain: str = "",
+    extra_num: int = 0,
+    strategy: str = "",
+    weights: list[float] | None = None,
+) -> list[str]:
+    contents = await lookup_sources(names, record_type, session, domain)
+    return await truncate_records(
+        contents,
+        record_type,
+        domain,
+        ServerCfg.max_content_num - extra_num,
+        strategy,
+        weights,
+    )
+
+
+async def probe_target(
+    session: aiohttp.ClientSession, health_check: HealthCheck, host: str, port: int
+) -> float | None:
+    """
+    检查单个目标，优先使用缓存，相同的并发检查只进行一次
+    """
+    cache = ServerCfg.health_cache
+    key = (health_check.protocol, host, port, health_check.path, health_check.host)
+    entry = cache.get(key)
+    if entry is not None:
+        cache.hits += 1
+        return entry[1]
+    task = cache.pending.get(key)
+    if task is not None:
+        cache.hits += 1
+        return await task
+    cache.misses += 1
+    if health_check.protocol == "tcp":
+        coro = tcp_rtt(host, port, ServerCfg.probe_semaphore)
+    else:
+        literal = f"[{host}]" if ":" in host else host
+        url = f"{health_check.protocol}://{literal}:{port}{health_check.path}"
+        coro = http_rtt(session, url, health_check.host, ServerCfg.probe_semaphore)
+    task = asyncio.ensure_future(coro)
+    cache.pending[key] = task
+    try:
+        rtt = await task
+    finally:
+        del cache.pending[key]
+    cache.put(key, rtt)
+    return rtt
+
+
+async def check_records_health(
+    session: aiohttp.ClientSession, up_item: UpItem, records: list[str]
+) -> dict[str, float | None]:
+    """
+    并发检查记录，返回 记录 -> 延迟（未通过检查时为 None），无法检查的记录不包含在内
+    """
+    targets = {}
+    for record in records:
+        target = up_item.health_check.target(up_item.record_type, record)
+        if target is not None:
+            targets[record] = target
+    rtts = await asyncio.gather(
+        *[
+            probe_target(session, up_item.health_check, host, port)
+            for host, port in targets.values()
+        ]
+    )
+    return dict(zip(targets, rtts))
+
+
+async def health_check_up_item(
+    session: aiohttp.ClientSession,
+    up_item: UpItem,
+    extra: list[str],
+    contents: list[list[str]],
+) -> tuple[list[str], list[list[str]], dict[str, float | None]]:
+    """
+    检查额外记录和查询到的记录，按设置过滤未通过检查的记录
+
+    所有记录都未通过检查时（可能是本机网络故障）保留全部记录
+    """
+    records = list(dict.fromkeys(extra + [r for content in contents for r in content]))
+    with ServerCfg.metrics.phase("health_check"):
+        rtts = await check_records_health(session, up_item, records)
+    unhealthy = {record for record, rtt in rtts.items() if rtt is None}
+    if unhealthy:
+        warning(
+            f"{up_item.name} 的 {len(records)} 条 {up_item.record_type} 记录中有 "
+            f"{len(unhealthy)} 条未通过健康检查：{sorted(unhealthy)}"
+        )
+    if not unhealthy or not up_item.health_check.filter_unhealthy:
+        return extra, contents, rtts
+    if len(unhealthy) == len(records):
+        warning(f"{up_item.name} 的所有记录都未通过健康检查，将保留全部记录")
+        return extra, contents, rtts
+    extra = [record for record in extra if record not in unhealthy]
+    contents = [
+        [record for record in content if record not in unhealthy]
+        for content in contents
+    ]
+    return extra, contents, rtts
+
+
+def setup_credentials():
+    """
+    配置认证信息（ak和sk）
+    """
+    from huaweicloudsdkcore.auth.credentials import BasicCredentials
+    from huaweicloudsdkcore.auth.provider import EnvCredentialProvider
+
+    ServerCfg.headers = {"Content-Type": "application/json"}
+    try:
+        ServerCfg.credentials = (
+            EnvCredentialProvider.get_basic_credential_env_provider().get_credentials()
+        )
+        info("检测到环境变量 HUAWEICLOUD_SDK_AK 和 HUAWEICLOUD_SDK_SK，将使用环境变量中的凭证")
+    except ApiValueError:
+        if ServerCfg.hw_api_ak and ServerCfg.hw_api_sk:
             ServerCfg.credentials = BasicCredentials(
                 ServerCfg.hw_api_ak, ServerCfg.hw_api_sk
             )
@@ -414,169 +2607,1159 @@ def setup_credentials():
             sys.exit(1)
 
 
-def get_zones(hwdns_client: DnsClient) -> list:
+class RateLimiter:
+    """
+    令牌桶限速器，rate 为每秒允许的请求数，不大于 0 时不限速
+    """
+
+    def __init__(self, rate: float, burst: float | None = None):
+        self.rate: float = rate
+        self.capacity: float = burst or max(1.0, rate)
+        self.tokens: float = self.capacity
+        self.updated: float = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        if self.rate <= 0:
+            return
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.capacity, self.tokens + (now - self.updated) * self.rate
+                )
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def drain(self):
+        """
+        被服务端限流时清空令牌，让并发的请求一起等待
+        """
+        self.tokens = min(self.tokens, 0.0)
+        self.updated = time.monotonic()
+
+
+# API 网关流控的错误码
+throttling_error_codes = {"APIGW.0308"}
+
+
+class HwDnsApi:
+    """
+    华为云 DNS API 的异步封装
+
+    SDK 的请求是同步的，放到有上限的线程池中执行，避免阻塞事件循环，
+    互不依赖的请求可以并发进行；并发数、每秒请求数和各接口的每秒请求数可以配置。
+    请求因连接失败、超时或服务端错误失败时，切换到 next_client 提供的下一个区域的客户端重试；
+    被限流或没有可切换的区域时，按带抖动的指数退避在本次运行中重试
+    """
+
+    # 重复执行可能产生重复记录集的方法，只在被限流（请求未执行）时重试
+    non_idempotent = {"create_record_set_with_line"}
+
+    def __init__(
+        self,
+        client: DnsClient,
+        next_client: Callable[[], DnsClient | None] | None = None,
+    ):
+        self.client: DnsClient = client
+        self.next_client = next_client
+        self.executor = ThreadPoolExecutor(
+            max_workers=max(1, ServerCfg.api_concurrency), thread_name_prefix="hwdns"
+        )
+        self.rate_limiter = RateLimiter(ServerCfg.api_rate_limit)
+        self.rate_limiters: dict[str, RateLimiter] = {
+            method: RateLimiter(rate)
+            for method, rate in ServerCfg.api_rate_limits.items()
+        }
+        self.calls: int = 0
+        self.calls_by_method: dict[str, int] = defaultdict(int)
+        self.retries: int = 0
+        self.retries_by_method: dict[str, int] = defaultdict(int)
+        self.throttled: int = 0
+
+    @staticmethod
+    def is_throttled(e: ClientRequestException) -> bool:
+        return e.status_code == 429 or e.error_code in throttling_error_codes
+
+    def count_retry(self, method: str):
+        self.retries += 1
+        self.retries_by_method[method] += 1
+
+    async def call(self, method: str, request):
+        """
+        调用 DnsClient 的 method 方法，重试 api_retries 次后仍失败时抛出最后的异常
+        """
+        limiter = self.rate_limiters.get(method)
+        attempt = 0
+        while True:
+            await self.rate_limiter.acquire()
+            if limiter:
+                await limiter.acquire()
+            self.calls += 1
+            self.calls_by_method[method] += 1
+            client = self.client
+            try:
+                return await asyncio.get_running_loop().run_in_executor(
+                    self.executor, getattr(client, method), request
+                )
+            except ClientRequestException as e:
+                if not self.is_throttled(e) or attempt >= ServerCfg.api_retries:
+                    raise
+                self.throttled += 1
+                self.rate_limiter.drain()
+                if limiter:
+                    limiter.drain()
+                reason = f"被限流（{e.status_code} {e.error_code}）"
+            except (
+                ConnectionException,
+                RequestTimeoutException,
+                ServerResponseException,
+            ) as e:
+                # 其他并发请求可能已经切换过客户端
+                if self.next_client is not None and client is self.client:
+                    next_client = self.next_client()
+                    if next_client is not None:
+                        warning(f"调用 {method} 时出错：{e}，将切换到下一个区域")
+                        self.client = next_client
+                # 请求可能已经执行，不能重复发送，由调用方确认结果
+                if method in self.non_idempotent:
+                    raise
+                if client is not self.client:
+                    # 切换区域后立即重试，不计入 api_retries
+                    self.count_retry(method)
+                    continue
+                if attempt >= ServerCfg.api_retries:
+                    raise
+                reason = f"出错：{e}"
+            attempt += 1
+            self.count_retry(method)
+            delay = random.uniform(
+                0,
+                min(
+                    ServerCfg.api_retry_max_delay,
+                    ServerCfg.api_retry_base_delay * 2**attempt,
+                ),
+            )
+            warning(f"调用 {method} 时{reason}，将在 {delay:.2f} 秒后第 {attempt} 次重试")
+            await asyncio.sleep(delay)
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+
+
+def log_api_error(message: str, e: SdkException):
+    error(message)
+    if isinstance(e, ServiceResponseException):
+        error(f"状态码：{e.status_code}")
+        error(f"请求ID：{e.request_id}")
+        error(f"错误码：{e.error_code}")
+    error(f"错误信息：{e.error_msg}")
+
+
+async def get_zones(api: HwDnsApi) -> list | None:
+    """
+    查询DNS Zone列表（包含域名），重试后仍失败时返回 None
+    """
+    from huaweicloudsdkdns.v2 import ListPublicZonesRequest
+
+    info("正在查询 Zone 列表……")
+    try:
+        response: ListPublicZonesResponse = await api.call(
+            "list_public_zones", ListPublicZonesRequest()
+        )
+        zones: list[PublicZoneResp] = response.zones
+        while response.links.next:
+            response: ListPublicZonesResponse = await api.call(
+                "list_public_zones", ListPublicZonesRequest(offset=len(zones))
+            )
+            zones.extend(response.zones)
+    except SdkException as e:
+        ServerCfg.error_occurred = True
+        log_api_error("错误：查询 Zone 列表失败：", e)
+        return None
+    zone_msg = "，".join(f"{zone.name}：{zone.id}" for zone in zones)
+    debug(f"查询到 {len(zones)} 个 Zone：{zone_msg}")
+    return zones
+
+
+class ZoneMatcher:
+    """
+    按标签匹配域名所属的 Zone，嵌套的 Zone 取最长的后缀
+
+    Zone 名称存放在字典中，匹配时从完整域名开始逐个去掉最左侧的标签查找，
+    复杂度只与域名的标签数有关
+    """
+
+    def __init__(self, zones: list[PublicZoneResp]):
+        self.zones: dict[str, PublicZoneResp] = {}
+        for zone in zones:
+            self.zones.setdefault(self.normalize(zone.name), zone)
+
+    @staticmethod
+    def normalize(name: str) -> str:
+        return name.lower().rstrip(".") + "."
+
+    def match(self, name: str) -> PublicZoneResp | None:
+        labels = self.normalize(name)[:-1].split(".")
+        for i in range(len(labels)):
+            zone = self.zones.get(".".join(labels[i:]) + ".")
+            if zone is not None:
+                return zone
+        return None
+
+
+async def list_zone_recordsets(
+    api: HwDnsApi, zone_id: str, name: str | None = None, record_type: str | None = None
+) -> list[ListRecordSets]:
+    """
+    分页获取 Zone 下的 Record Set 列表，可以按域名、记录类型在服务端过滤
+    """
+    from huaweicloudsdkdns.v2 import ListRecordSetsByZoneRequest
+
+    recordsets: list[ListRecordSets] = []
+    while True:
+        response: ListRecordSetsByZoneResponse = await api.call(
+            "list_record_sets_by_zone",
+            ListRecordSetsByZoneRequest(
+                zone_id,
+                limit=ServerCfg.recordset_page_size,
+                offset=len(recordsets),
+                name=name,
+                type=record_type,
+            ),
+        )
+        recordsets.extend(response.recordsets or [])
+        if not (response.recordsets and response.links and response.links.next):
+            return recordsets
+
+
+class ZoneSnapshot:
+    """
+    每次运行中每个 Zone 的记录集只获取一次，并按 (域名, 记录类型) 建立索引
+
+    只有一个更新项目的 Zone 使用服务端过滤，只获取该项目的记录集
+    """
+
+    def __init__(self, api: HwDnsApi, matcher: ZoneMatcher, up_items: list):
+        self.api: HwDnsApi = api
+        self.matcher: ZoneMatcher = matcher
+        # Zone ID -> 需要的 (域名, 记录类型)
+        self.wanted: dict[str, set[tuple[str, str]]] = defaultdict(set)
+        for up_item in up_items:
+            zone = self.matcher.match(up_item.name)
+            if zone is not None:
+                self.wanted[zone.id].add((up_item.name, up_item.record_type))
+        # Zone ID -> 获取并建立索引的任务
+        self.tasks: dict[str, asyncio.Task] = {}
+
+    async def fetch(self, zone: PublicZoneResp) -> dict[tuple[str, str], list] | None:
+        """
+        重试后仍失败时返回 None，该 Zone 的更新项目本次跳过
+        """
+        info(f"正在查询 {zone.name} 下的记录列表……")
+        wanted = self.wanted.get(zone.id, set())
+        try:
+            if len(wanted) == 1:
+                name, record_type = next(iter(wanted))
+                recordsets = await list_zone_recordsets(
+                    self.api, zone.id, name, record_type
+                )
+            else:
+                recordsets = await list_zone_recordsets(self.api, zone.id)
+        except SdkException as e:
+            ServerCfg.error_occurred = True
+            log_api_error(f"错误：查询 {zone.name} 下的 Record Set 列表失败：", e)
+            return None
+        index: dict[tuple[str, str], list[ListRecordSets]] = defaultdict(list)
+        for recordset in recordsets:
+            index[(recordset.name, recordset.type)].append(recordset)
+        debug(f"{zone.name} 下共有 {len(recordsets)} 个记录集")
+        return index
+
+    async def get(self, zone: PublicZoneResp) -> dict[tuple[str, str], list] | None:
+        task = self.tasks.get(zone.id)
+        if task is None:
+            task = asyncio.ensure_future(self.fetch(zone))
+            self.tasks[zone.id] = task
+        return await task
+
+
+async def get_recordset_list(
+    snapshot: ZoneSnapshot, up_item: UpItem
+) -> tuple[str, list] | None:
+    zone = snapshot.matcher.match(up_item.name)
+    if zone is None:
+        ServerCfg.error_occurred = True
+        error(f"错误：未找到 {up_item.name} 对应的主域名，请检查配置文件中的 domain 的主域名是否已添加到华为云 DNS 的公网域名")
+        return None
+    info(f"{up_item.name} 对应的主域名：{zone.name}，对应的 Zone ID：{zone.id}")
+
+    # 获取 Zone 下的 Record Set 列表
+    index = await snapshot.get(zone)
+    if index is None:
+        return None
+    return zone.id, index.get((up_item.name, up_item.record_type), [])
+
+
+async def update_recordset(
+    api: HwDnsApi, zone_id: str, recordset: ListRecordSets, up_item: UpItem
+) -> bool:
+    from huaweicloudsdkdns.v2 import UpdateRecordSetRequest, UpdateRecordSetReq
+
+    info(f"正在更新 {up_item.name} 的 {up_item.record_type} 记录……")
+    try:
+        await api.call(
+            "update_record_set",
+            UpdateRecordSetRequest(
+                zone_id,
+                recordset.id,
+                UpdateRecordSetReq(
+                    name=up_item.name,
+                    description=up_item.description,
+                    type=up_item.record_type,
+                    records=up_item.content,
+                    ttl=up_item.ttl,
+                ),
+            ),
+        )
+        return True
+    except SdkException as e:
+        ServerCfg.error_occurred = True
+        log_api_error("错误：更新 Record Set 失败：", e)
+        return False
+
+
+async def add_recordset(api: HwDnsApi, zone_id: str, up_item: UpItem) -> bool:
+    from huaweicloudsdkdns.v2 import CreateRecordSetRequest, CreateRecordSetRequestBody
+
+    try:
+        await api.call(
+            "create_record_set_with_line",
+            CreateRecordSetRequest(
+                zone_id,
+                CreateRecordSetRequestBody(
+                    name=up_item.name,
+                    description=up_item.description,
+                    type=up_item.record_type,
+                    ttl=up_item.ttl,
+                    records=up_item.content,
+                ),
+            ),
+        )
+        return True
+    except (
+        ConnectionException,
+        RequestTimeoutException,
+        ServerResponseException,
+    ) as e:
+        # 新增请求可能已经执行，重新查询确认，而不是再发送一次
+        warning(f"新增 {up_item.name} 的 {up_item.record_type} 记录集时出错：{e}，正在确认是否已添加……")
+        if await confirm_recordset_created(api, zone_id, up_item):
+            info(f"{up_item.name} 的 {up_item.record_type} 记录集已添加")
+            return True
+        ServerCfg.error_occurred = True
+        log_api_error("错误：新增 Record Set 失败：", e)
+        return False
+    except SdkException as e:
+        ServerCfg.error_occurred = True
+        log_api_error("错误：新增 Record Set 失败：", e)
+        return False
+
+
+async def confirm_recordset_created(api: HwDnsApi, zone_id: str, up_item: UpItem) -> bool:
+    """
+    查询 Zone 中是否已有与更新项目要设置的记录相同的记录集；查询失败时视为没有添加，下次运行再处理
+    """
+    try:
+        recordsets = await list_zone_recordsets(
+            api, zone_id, up_item.name, up_item.record_type
+        )
+    except SdkException as e:
+        warning(f"查询 {up_item.name} 的 {up_item.record_type} 记录集时出错：{e}")
+        return False
+    return any(
+        recordset.name == up_item.name
+        and recordset.type == up_item.record_type
+        and set(recordset.records or []) == set(up_item.content)
+        for recordset in recordsets
+    )
+
+
+async def set_recordset_status(
+    api: HwDnsApi, recordset_id: str, status: str = "DISABLE"
+) -> bool:
+    from huaweicloudsdkdns.v2 import (
+        SetRecordSetsStatusRequest,
+        SetRecordSetsStatusRequestBody,
+    )
+
+    try:
+        if status not in {"DISABLE", "ENABLE"}:
+            ServerCfg.error_occurred = True
+            error(f"错误：无效记录集的状态：{status}")
+            return False
+        await api.call(
+            "set_record_sets_status",
+            SetRecordSetsStatusRequest(
+                recordset_id, SetRecordSetsStatusRequestBody(status)
+            ),
+        )
+        return True
+    except SdkException as e:
+        ServerCfg.error_occurred = True
+        log_api_error("错误：设置 Record Set 状态失败：", e)
+        return False
+
+
+async def batch_update_recordsets(
+    api: HwDnsApi, zone_id: str, changes: list["Change"]
+) -> bool:
+    """
+    批量更新同一 Zone 下的多个记录集
+    """
+    from huaweicloudsdkdns.v2 import (
+        BatchUpdateRecordSet,
+        BatchUpdateRecordSetWithLineRequest,
+        BatchUpdateRecordSetWithLineRequestBody,
+    )
+
+    info(f"正在批量更新 Zone {zone_id} 下的 {len(changes)} 个记录集……")
+    try:
+        await api.call(
+            "batch_update_record_set_with_line",
+            BatchUpdateRecordSetWithLineRequest(
+                zone_id,
+                BatchUpdateRecordSetWithLineRequestBody(
+                    [
+                        BatchUpdateRecordSet(
+                            id=change.recordset.id,
+                            description=change.up_item.description,
+                            ttl=change.up_item.ttl,
+                            records=change.up_item.content,
+                        )
+                        for change in changes
+                    ]
+                ),
+            ),
+        )
+        return True
+    except SdkException as e:
+        log_api_error("错误：批量更新 Record Set 失败：", e)
+        return False
+
+
+async def batch_set_recordsets_status(
+    api: HwDnsApi, recordset_ids: list[str], status: str = "DISABLE"
+) -> bool:
+    """
+    批量设置多个记录集的状态
+    """
+    from huaweicloudsdkdns.v2 import (
+        BatchSetRecordSetsStatusRequest,
+        BatchSetRecordSetsStatusRequestBody,
+    )
+
+    info(f"正在批量设置 {len(recordset_ids)} 个记录集的状态为 {status}……")
+    try:
+        await api.call(
+            "batch_set_record_sets_status",
+            BatchSetRecordSetsStatusRequest(
+                BatchSetRecordSetsStatusRequestBody(status, recordset_ids)
+            ),
+        )
+        return True
+    except SdkException as e:
+        log_api_error("错误：批量设置 Record Set 状态失败：", e)
+        return False
+
+
+async def resolve_up_item(session: aiohttp.ClientSession, up_item: UpItem):
+    """
+    查询更新项目 源记录 中的 值，追加到要设置的记录中
+    """
+    extra = list(up_item.extra)
+    contents = []
+    if up_item.sources:
+        info(f"正在查询 {up_item.name} 设置的 {up_item.record_type} 记录……")
+        contents = await lookup_sources(
+            up_item.sources, up_item.record_type, session, up_item.name
+        )
+    rtts = None
+    if up_item.health_check and up_item.record_type in {"A", "AAAA", "SRV"}:
+        extra, contents, rtts = await health_check_up_item(
+            session, up_item, extra, contents
+        )
+    up_item.content = extra + await truncate_records(
+        contents,
+        up_item.record_type,
+        up_item.name,
+        ServerCfg.max_content_num - len(extra),
+        up_item.truncate_strategy,
+        up_item.source_weights,
+        rtts,
+    )
+
+
+class Change:
+    """
+    计划中的单个记录集变更
+
+    action 为 create（新增）、update（更新）、disable（禁用）、
+    unchanged（没有变化）或 skip（不处理）
+    """
+
+    def __init__(
+        self,
+        action: str,
+        up_item: UpItem,
+        zone_id: str = "",
+        recordset: ListRecordSets | FileRecordSet | None = None,
+        reason: str = "",
+    ):
+        self.action: str = action
+        self.up_item: UpItem = up_item
+        self.zone_id: str = zone_id
+        self.recordset: ListRecordSets | FileRecordSet | None = recordset
+        self.reason: str = reason
+        # 变更所属的 DNS 服务商名称，由 sync_provider 设置
+        self.provider: str = ""
+
+    def to_dict(self) -> dict:
+        return {
+            "provider": self.provider,
+            "action": self.action,
+            "name": self.up_item.name,
+            "type": self.up_item.record_type,
+            "zone_id": self.zone_id,
+            "recordset_id": self.recordset.id if self.recordset else None,
+            "current_records": self.recordset.records if self.recordset else None,
+            "records": self.up_item.content,
+            "description": self.up_item.description,
+            "ttl": self.up_item.ttl,
+            "reason": self.reason,
+        }
+
+
+async def plan_recordset(
+    api: HwDnsApi, zone_id: str, recordset: ListRecordSets, up_item: UpItem
+) -> Change:
+    """
+    对比单个记录集，计算需要进行的变更
+
+    直接使用列表接口返回的记录值、描述和状态进行对比，
+    只有列表中的数据不完整时才单独查询记录集
+    """
+    from huaweicloudsdkdns.v2 import ShowRecordSetRequest
+
+    debug(f"正在处理 {up_item.name} 的 {recordset.id} 记录集……")
+    if recordset.records is None or recordset.status is None:
+        try:
+            recordset = await api.call(
+                "show_record_set", ShowRecordSetRequest(zone_id, recordset.id)
+            )
+        except SdkException as e:
+            ServerCfg.error_occurred = True
+            log_api_error(f"错误：查询 {up_item.name} 的 {recordset.id} 记录集失败：", e)
+            return Change("skip", up_item, zone_id, recordset, "查询记录集失败")
+    description = recordset.description or ""
+    if description == up_item.description and set(recordset.records) == set(
+        up_item.content
+    ):
+        info(f"{up_item.name} 的 {recordset.id} 记录集没有变化，将跳过")
+        return Change("unchanged", up_item, zone_id, recordset)
+    if recordset.status != "ACTIVE":
+        info(f"{up_item.name} 的 {recordset.id} 记录集状态为 {recordset.status}，将跳过")
+        return Change("skip", up_item, zone_id, recordset, f"状态为 {recordset.status}")
+    if up_item.match_pattern and not up_item.match_pattern.search(description):
+        info(f"{up_item.name} 的 {recordset.id} 记录集描述不匹配，将跳过")
+        return Change("skip", up_item, zone_id, recordset, "描述不匹配")
+    if up_item.content:
+        return Change("update", up_item, zone_id, recordset)
+    info(f"{up_item.name} 要设置的 {up_item.record_type} 记录集为空，将禁用现有记录集")
+    return Change("disable", up_item, zone_id, recordset, "要设置的记录为空")
+
+
+async def plan_up_item(snapshot: ZoneSnapshot, up_item: UpItem) -> list[Change]:
+    """
+    计算更新项目需要进行的变更
+    """
+    recordset_list = await get_recordset_list(snapshot, up_item)
+    if recordset_list is None:
+        return [Change("skip", up_item, reason="未找到对应的 Zone 或查询记录集失败")]
+    zone_id, recordsets = recordset_list
+    if not recordsets:
+        if up_item.content:
+            return [Change("create", up_item, zone_id)]
+        warning(f"{up_item.name} 没有 {up_item.record_type} 记录需要更新、禁用或添加")
+        return [Change("skip", up_item, zone_id, reason="没有记录")]
+    return list(
+        await asyncio.gather(
+            *[
+                plan_recordset(snapshot.api, zone_id, recordset, up_item)
+                for recordset in recordsets
+            ]
+        )
+    )
+
+
+async def plan_changes(snapshot: ZoneSnapshot, up_items: list[UpItem]) -> list[Change]:
+    """
+    并发计算所有更新项目的变更，结果顺序与更新项目顺序一致
+    """
+    changes = []
+    for item_changes in await asyncio.gather(
+        *[plan_up_item(snapshot, up_item) for up_item in up_items]
+    ):
+        changes.extend(item_changes)
+    summary = defaultdict(int)
+    for change in changes:
+        summary[change.action] += 1
+    info(
+        f"变更计划：新增 {summary['create']} 个，更新 {summary['update']} 个，"
+        f"禁用 {summary['disable']} 个，没有变化 {summary['unchanged']} 个，"
+        f"跳过 {summary['skip']} 个"
+    )
+    return changes
+
+
+def chunked(items: list, size: int) -> list[list]:
+    size = max(1, size)
+    return [items[i : i + size] for i in range(0, len(items), size)]
+
+
+async def apply_zone_changes(api: HwDnsApi, zone_id: str, changes: list[Change]):
+    """
+    应用同一 Zone 下的变更，更新和禁用尽量使用批量接口
+    """
+    by_action: dict[str, list[Change]] = defaultdict(list)
+    for change in changes:
+        by_action[change.action].append(change)
+    tasks = []
+    for change in by_action["create"]:
+        info(f"正在添加 {change.up_item.name} 设置的 {change.up_item.record_type} 记录……")
+        tasks.append(add_recordset(api, zone_id, change.up_item))
+    updates = by_action["update"]
+    if len(updates) == 1:
+        tasks.append(
+            update_recordset(api, zone_id, updates[0].recordset, updates[0].up_item)
+        )
+    elif updates:
+        tasks.extend(
+            apply_batch_update(api, zone_id, chunk)
+            for chunk in chunked(updates, ServerCfg.batch_write_size)
+        )
+    disables = [change.recordset.id for change in by_action["disable"]]
+    if len(disables) == 1:
+        tasks.append(set_recordset_status(api, disables[0], "DISABLE"))
+    elif disables:
+        tasks.extend(
+            apply_batch_disable(api, chunk)
+            for chunk in chunked(disables, ServerCfg.batch_write_size)
+        )
+    await asyncio.gather(*tasks)
+
+
+async def apply_batch_update(api: HwDnsApi, zone_id: str, changes: list[Change]):
+    """
+    批量更新，失败时逐个更新
+    """
+    if await batch_update_recordsets(api, zone_id, changes):
+        return
+    warning("批量更新失败，将逐个更新记录集")
+    await asyncio.gather(
+        *[
+            update_recordset(api, zone_id, change.recordset, change.up_item)
+            for change in changes
+        ]
+    )
+
+
+async def apply_batch_disable(api: HwDnsApi, recordset_ids: list[str]):
+    """
+    批量禁用，失败时逐个禁用
+    """
+    if await batch_set_recordsets_status(api, recordset_ids, "DISABLE"):
+        return
+    warning("批量禁用失败，将逐个禁用记录集")
+    await asyncio.gather(
+        *[
+            set_recordset_status(api, recordset_id, "DISABLE")
+            for recordset_id in recordset_ids
+        ]
+    )
+
+
+async def apply_changes(api: HwDnsApi, changes: list[Change]):
     """
-    查询DNS Zone列表（包含域名）
+    按 Zone 分组并发应用变更
     """
-    info("正在查询 Zone 列表……")
-    try:
-        response: ListPublicZonesResponse = hwdns_client.list_public_zones(
-            ListPublicZonesRequest()
-        )
-        zones: list[PublicZoneResp] = response.zones
-        while response.links.next:
-            response: ListPublicZonesResponse = hwdns_client.list_public_zones(
-                ListPublicZonesRequest(offset=len(zones))
-            )
-            zones.extend(response.zones)
-    except ClientRequestException as e:
-        critical("错误：查询 Zone 列表失败：")
-        critical(f"状态码：{e.status_code}")
-        critical(f"请求ID：{e.request_id}")
-        critical(f"错误码：{e.error_code}")
-        critical(f"错误信息：{e.error_msg}")
-        sys.exit(1)
-    zone_msg = "，".join(f"{zone.name}：{zone.id}" for zone in zones)
-    debug(f"查询到 {len(zones)} 个 Zone：{zone_msg}")
-    return zones
+    by_zone: dict[str, list[Change]] = defaultdict(list)
+    for change in changes:
+        if change.action in {"create", "update", "disable"}:
+            by_zone[change.zone_id].append(change)
+    await asyncio.gather(
+        *[
+            apply_zone_changes(api, zone_id, zone_changes)
+            for zone_id, zone_changes in by_zone.items()
+        ]
+    )
 
 
-def get_recordset_list(
-    hwdns_client: DnsClient, zones: list[PublicZoneResp], up_item: UpItem
-) -> tuple[str, dict] | None:
-    # 切割域名，获取主域名和对应 Zone ID
-    for zone in zones:
-        if up_item.name.endswith(zone.name):
-            zone_name = zone.name
-            zone_id = zone.id
-            info(f"{up_item.name} 对应的主域名：{zone_name}，对应的 Zone ID：{zone_id}")
-            break
+def output_plan(changes: list[Change], path: str):
+    """
+    以 JSON 格式输出变更计划，path 为 - 时输出到标准输出
+    """
+    plan = json.dumps(
+        [change.to_dict() for change in changes], ensure_ascii=False, indent=2
+    )
+    if path == "-":
+        print(plan)
     else:
-        ServerCfg.error_occurred = True
-        error(f"错误：未找到 {up_item.name} 对应的主域名，请检查配置文件中的 domain 的主域名是否已添加到华为云 DNS 的公网域名")
-        return None
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(plan)
+        info(f"变更计划已保存到 {path}")
 
-    # 获取 Zone 下的 Record Set 列表
-    info(f"正在查询 {zone_name} 下的记录列表……")
-    try:
-        response: ListRecordSetsByZoneResponse = hwdns_client.list_record_sets_by_zone(
-            ListRecordSetsByZoneRequest(zone_id)
+
+class DnsProvider(abc.ABC):
+    """
+    DNS 服务商后端
+
+    list 获取更新项目对应的现有记录，diff 对比要设置的记录计算变更，apply 应用变更；
+    同一批更新项目的要设置的记录只计算一次，由 sync_up_items 并发同步到所有服务商
+    """
+
+    def __init__(self, name: str):
+        self.name: str = name
+
+    @abc.abstractmethod
+    async def list(self, up_items: list[UpItem]):
+        """
+        获取更新项目对应的现有记录
+        """
+
+    @abc.abstractmethod
+    async def diff(self, up_items: list[UpItem]) -> list[Change]:
+        """
+        对比要设置的记录与 list 获取的现有记录，返回变更
+        """
+
+    @abc.abstractmethod
+    async def apply(self, changes: list[Change]):
+        """
+        应用 diff 返回的变更
+        """
+
+    def report(self):
+        """
+        同步结束后输出统计信息
+        """
+
+    def close(self):
+        pass
+
+
+class HuaweiDnsProvider(DnsProvider):
+    """
+    华为云 DNS
+
+    Zone 列表按 zone_refresh_interval 缓存，查询失败时继续使用原有的列表；
+    每次同步重新获取一次各 Zone 的记录集
+    """
+
+    def __init__(self, api: HwDnsApi, name: str = "huaweicloud"):
+        super().__init__(name)
+        self.api: HwDnsApi = api
+        self.matcher: ZoneMatcher | None = None
+        self.zones_updated: float = 0
+        # diff 开始时的 (调用次数, 重试次数, 被限流次数)
+        self.counts: tuple[int, int, int] = (0, 0, 0)
+
+    async def list(self, up_items: list[UpItem]) -> ZoneSnapshot | None:
+        now = time.monotonic()
+        if (
+            self.matcher is None
+            or now - self.zones_updated >= ServerCfg.zone_refresh_interval
+        ):
+            zones = await ServerCfg.metrics.timed("zones", get_zones(self.api))
+            if zones is not None:
+                self.matcher = ZoneMatcher(zones)
+                self.zones_updated = now
+        if self.matcher is None:
+            return None
+        return ZoneSnapshot(self.api, self.matcher, up_items)
+
+    async def diff(self, up_items: list[UpItem]) -> list[Change]:
+        self.counts = (self.api.calls, self.api.retries, self.api.throttled)
+        snapshot = await self.list(up_items)
+        if snapshot is None:
+            return [
+                Change("skip", up_item, reason="没有可用的 Zone 列表")
+                for up_item in up_items
+            ]
+        return await plan_changes(snapshot, up_items)
+
+    async def apply(self, changes: list[Change]):
+        await apply_changes(self.api, changes)
+
+    def report(self):
+        api = self.api
+        calls, retries, throttled = self.counts
+        calls_msg = "，".join(
+            f"{method} {calls} 次" for method, calls in api.calls_by_method.items()
         )
-        recordsets: list[ListRecordSets] = response.recordsets
-        while response.links.next:
-            response = hwdns_client.list_record_sets_by_zone(
-                ListRecordSetsByZoneRequest(zone_id, offset=len(recordsets))
+        info(
+            f"本次调用了 {api.calls - calls} 次华为云 API，其中重试 {api.retries - retries} 次，"
+            f"被限流 {api.throttled - throttled} 次，累计：{calls_msg}"
+        )
+        if api.retries_by_method:
+            retries_msg = "，".join(
+                f"{method} {retries} 次"
+                for method, retries in api.retries_by_method.items()
             )
-            recordsets.append(response.recordsets)
-
-    except ClientRequestException as e:
-        critical("错误：查询 Zone 下的 Record Set 列表失败：")
-        critical(f"状态码：{e.status_code}")
-        critical(f"请求ID：{e.request_id}")
-        critical(f"错误码：{e.error_code}")
-        critical(f"错误信息：{e.error_msg}")
-        sys.exit(1)
+            info(f"累计重试：{retries_msg}")
 
-    recordset_list = []
-    for recordset in recordsets:
-        if recordset.name == up_item.name and recordset.type == up_item.record_type:
-            recordset_list.append(recordset)
-    return zone_id, recordset_list
 
+class FileRecordSet:
+    """
+    zone 文件中的记录集，属性与华为云 SDK 的 ListRecordSets 对应
+    """
 
-def update_recordset(
-    hwdns_client: DnsClient, zone_id: str, recordset: ListRecordSets, up_item: UpItem
-) -> bool:
-    info(f"正在更新 {up_item.name} 的 {up_item.record_type} 记录……")
-    try:
-        hwdns_client.update_record_set(
-            UpdateRecordSetRequest(
-                zone_id,
-                recordset.id,
-                UpdateRecordSetReq(
-                    name=up_item.name,
-                    description=up_item.description,
-                    type=up_item.record_type,
-                    records=up_item.content,
-                    ttl=up_item.ttl,
-                ),
+    def __init__(
+        self, name: str, record_type: str, ttl: int, records: list[str], description: str
+    ):
+        self.id: str = f"{name} {record_type}"
+        self.name: str = name
+        self.type: str = record_type
+        self.ttl: int = ttl
+        self.records: list[str] = records
+        self.description: str = description
+        self.status: str = "ACTIVE"
+
+
+def split_zone_comment(line: str) -> tuple[str, str]:
+    """
+    分开 zone 文件中一行的数据和注释，忽略引号中的分号
+    """
+    quoted = False
+    escaped = False
+    for i, char in enumerate(line):
+        if escaped:
+            escaped = False
+        elif char == "\\":
+            escaped = True
+        elif char == '"':
+            quoted = not quoted
+        elif char == ";" and not quoted:
+            return line[:i].rstrip(), line[i + 1 :].strip()
+    return line.rstrip(), ""
+
+
+class ZoneFileProvider(DnsProvider):
+    """
+    本地的 zone 文件（BIND 格式），可用于测试，或作为其他权威 DNS 服务器的数据
+
+    每条记录一行，使用完整域名，记录集的描述写在行尾的注释中；
+    只支持本程序写出的格式，其他行（如 $ORIGIN、省略了 TTL 的记录）会被忽略。
+    zone 文件中没有禁用状态，禁用记录集即删除其记录
+    """
+
+    def __init__(self, path: str, name: str = "zone_file"):
+        super().__init__(name)
+        self.path: str = path
+        # (域名, 记录类型) -> 记录集
+        self.recordsets: dict[tuple[str, str], FileRecordSet] = {}
+
+    async def list(self, up_items: list[UpItem]) -> dict[tuple[str, str], FileRecordSet]:
+        recordsets: dict[tuple[str, str], FileRecordSet] = {}
+        try:
+            f = open(self.path, "r", encoding="utf-8")
+        except FileNotFoundError:
+            self.recordsets = recordsets
+            return recordsets
+        with f:
+            for lineno, line in enumerate(f, 1):
+                data, comment = split_zone_comment(line)
+                if not data or data.startswith("$"):
+                    continue
+                sp = data.split(None, 4)
+                if len(sp) != 5 or not sp[1].isdigit() or sp[2].upper() != "IN":
+                    warning(f"{self.path} 第 {lineno} 行的格式不支持，将忽略")
+                    continue
+                name, ttl, _, record_type, record = sp
+                key = (name, record_type.upper())
+                recordset = recordsets.get(key)
+                if recordset is None:
+                    recordset = FileRecordSet(name, key[1], int(ttl), [], comment)
+                    recordsets[key] = recordset
+                recordset.records.append(record)
+        self.recordsets = recordsets
+        return recordsets
+
+    async def diff(self, up_items: list[UpItem]) -> list[Change]:
+        try:
+            recordsets = await self.list(up_items)
+        except OSError as e:
+            ServerCfg.error_occurred = True
+            error(f"错误：读取 zone 文件 {self.path} 失败：{e}")
+            return [
+                Change("skip", up_item, reason="读取 zone 文件失败")
+                for up_item in up_items
+            ]
+        changes = []
+        for up_item in up_items:
+            recordset = recordsets.get((up_item.name, up_item.record_type))
+            if recordset is None:
+                if up_item.content:
+                    changes.append(Change("create", up_item))
+                else:
+                    changes.append(Change("skip", up_item, reason="没有记录"))
+            elif (
+                recordset.description == up_item.description
+                and recordset.ttl == up_item.ttl
+                and set(recordset.records) == set(up_item.content)
+            ):
+                changes.append(Change("unchanged", up_item, recordset=recordset))
+            elif up_item.match_pattern and not up_item.match_pattern.search(
+                recordset.description
+            ):
+                changes.append(
+                    Change("skip", up_item, recordset=recordset, reason="描述不匹配")
+                )
+            elif up_item.content:
+                changes.append(Change("update", up_item, recordset=recordset))
+            else:
+                changes.append(
+                    Change(
+                        "disable", up_item, recordset=recordset, reason="要设置的记录为空"
+                    )
+                )
+        return changes
+
+    async def apply(self, changes: list[Change]):
+        writes = 0
+        for change in changes:
+            up_item = change.up_item
+            key = (up_item.name, up_item.record_type)
+            if change.action in {"create", "update"}:
+                self.recordsets[key] = FileRecordSet(
+                    up_item.name,
+                    up_item.record_type,
+                    up_item.ttl,
+                    list(up_item.content),
+                    up_item.description,
+                )
+            elif change.action == "disable":
+                self.recordsets.pop(key, None)
+            else:
+                continue
+            writes += 1
+        if not writes:
+            return
+        info(f"正在写入 zone 文件 {self.path}，共 {writes} 个变更……")
+        lines = ["; 由 dns-record-manager 生成"]
+        for key in sorted(self.recordsets):
+            recordset = self.recordsets[key]
+            description = " ".join(recordset.description.split())
+            comment = f"\t; {description}" if description else ""
+            for record in recordset.records:
+                lines.append(
+                    f"{recordset.name}\t{recordset.ttl}\tIN\t{recordset.type}\t{record}{comment}"
+                )
+        try:
+            atomic_write(self.path, "\n".join(lines) + "\n")
+        except OSError as e:
+            ServerCfg.error_occurred = True
+            error(f"错误：写入 zone 文件 {self.path} 失败：{e}")
+
+
+provider_types = {"huaweicloud", "zone_file"}
+
+
+def build_providers(api: HwDnsApi | None) -> list[DnsProvider]:
+    """
+    按服务器设置中的 providers 创建服务商后端，api 为华为云 DNS API（没有使用时为 None）
+    """
+    providers: list[DnsProvider] = []
+    for config in ServerCfg.providers:
+        name = provider_name(config)
+        if config["type"] == "huaweicloud":
+            providers.append(HuaweiDnsProvider(api, name))
+        else:
+            providers.append(ZoneFileProvider(config["path"], name))
+    return providers
+
+
+class RunState:
+    """
+    上次成功应用时各更新项目要设置的记录的摘要，保存在 state_filepath 中
+
+    按服务商分别记录：要设置的记录和服务商设置都没有变化、且距上次应用不超过
+    state_max_age 秒的更新项目不需要同步到该服务商；超过后仍会完整同步一次，
+    以修正在控制台中手动做的修改
+    """
+
+    def __init__(self, path: str):
+        self.path: str = path
+        # 服务商|更新项目 -> {"digest": 摘要, "applied": 应用时间戳}
+        self.items: dict[str, dict] = {}
+        if not path:
+            return
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                self.items = json.load(f)["items"]
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            warning(f"读取状态文件 {path} 时出错：{e}")
+
+    @staticmethod
+    def key(provider: dict, up_item: UpItem) -> str:
+        return f"{provider_name(provider)}|{up_item.name}|{up_item.record_type}"
+
+    @staticmethod
+    def digest(provider: dict, up_item: UpItem) -> str:
+        desired = [
+            provider,
+            sorted(up_item.content),
+            up_item.description,
+            up_item.ttl,
+            up_item.match_description,
+        ]
+        return hashlib.sha256(
+            json.dumps(desired, ensure_ascii=False, sort_keys=True).encode()
+        ).hexdigest()
+
+    def changed(self, up_items: list[UpItem]) -> dict[str, list[UpItem]]:
+        """
+        返回 {服务商名称: 要设置的记录有变化（或需要重新同步）的更新项目}，
+        没有需要同步的更新项目的服务商不包含在内
+        """
+        result: dict[str, list[UpItem]] = {}
+        now = time.time()
+        for provider in ServerCfg.providers:
+            pending = []
+            for up_item in up_items:
+                entry = self.items.get(self.key(provider, up_item))
+                if (
+                    not self.path
+                    or entry is None
+                    or entry.get("digest") != self.digest(provider, up_item)
+                    or now - entry.get("applied", 0) >= ServerCfg.state_max_age
+                ):
+                    pending.append(up_item)
+            if pending:
+                result[provider_name(provider)] = pending
+        return result
+
+    def record(self, applied: dict[str, list[UpItem]]):
+        """
+        记录成功应用到各服务商的更新项目并保存
+        """
+        if not self.path:
+            return
+        now = time.time()
+        for provider in ServerCfg.providers:
+            for up_item in applied.get(provider_name(provider), []):
+                self.items[self.key(provider, up_item)] = {
+                    "digest": self.digest(provider, up_item),
+                    "applied": now,
+                }
+        try:
+            atomic_write(
+                self.path, json.dumps({"items": self.items}, ensure_ascii=False)
             )
-        )
-        return True
-    except ClientRequestException as e:
-        error("错误：更新 Record Set 失败：")
-        error(f"状态码：{e.status_code}")
-        error(f"请求ID：{e.request_id}")
-        error(f"错误码：{e.error_code}")
-        error(f"错误信息：{e.error_msg}")
-        return False
+        except OSError as e:
+            warning(f"保存状态文件 {self.path} 时出错：{e}")
 
 
-def add_recordset(hwdns_client: DnsClient, zone_id: str, up_item: UpItem) -> bool:
-    try:
-        hwdns_client.create_record_set_with_line(
-            CreateRecordSetRequest(
-                zone_id,
-                CreateRecordSetRequestBody(
-                    name=up_item.name,
-                    description=up_item.description,
-                    type=up_item.record_type,
-                    ttl=up_item.ttl,
-                    records=up_item.content,
-                ),
+async def resolve_up_items(session: aiohttp.ClientSession, up_items: list[UpItem]):
+    """
+    并发查询所有更新项目的源记录
+
+    A 和 AAAA 记录同时查询；缓存中已有的 CNAME 链直接查询终点，
+    相同的并发查询由 lookup_record 合并
+    """
+    await asyncio.gather(*[resolve_up_item(session, up_item) for up_item in up_items])
+    info(
+        f"DNS 缓存：命中 {ServerCfg.dns_cache.hits} 次，未命中 {ServerCfg.dns_cache.misses} 次"
+    )
+    if ServerCfg.dns_cache_filepath:
+        ServerCfg.dns_cache.save(ServerCfg.dns_cache_filepath)
+    for resolver in ServerCfg.resolvers:
+        if resolver.queries:
+            info(
+                f"DoH 服务器 {resolver.url}：查询 {resolver.queries} 次，失败 {resolver.errors} 次，"
+                f"平均延迟 {(resolver.latency or 0) * 1000:.0f} ms"
             )
-        )
-        return True
-    except ClientRequestException as e:
-        error("错误：新增 Record Set 失败：")
-        error(f"状态码：{e.status_code}")
-        error(f"请求ID：{e.request_id}")
-        error(f"错误码：{e.error_code}")
-        error(f"错误信息：{e.error_msg}")
-        return False
+    http_stats = ServerCfg.http_stats
+    info(
+        f"HTTP 连接：共 {http_stats.requests} 个请求，新建 {http_stats.created} 个连接，"
+        f"复用 {http_stats.reused} 次"
+    )
+    health_cache = ServerCfg.health_cache
+    if health_cache.hits or health_cache.misses:
+        info(f"健康检查缓存：命中 {health_cache.hits} 次，未命中 {health_cache.misses} 次")
 
 
-def set_recordset_status(
-    hwdns_client: DnsClient, recordset_id: str, status: str = "DISABLE"
-) -> bool:
-    try:
-        if status not in {"DISABLE", "ENABLE"}:
-            ServerCfg.error_occurred = True
-            error(f"错误：无效记录集的状态：{status}")
-            return False
-        hwdns_client.set_record_sets_status(
-            SetRecordSetsStatusRequest(recordset_id, SetRecordSetsStatusReq(status))
-        )
-        return True
-    except ClientRequestException as e:
-        error("错误：设置 Record Set 状态失败：")
-        error(f"状态码：{e.status_code}")
-        error(f"请求ID：{e.request_id}")
-        error(f"错误码：{e.error_code}")
-        error(f"错误信息：{e.error_msg}")
-        return False
+async def sync_provider(
+    provider: DnsProvider, up_items: list[UpItem], plan: str | None = None
+) -> list[Change]:
+    """
+    计算并应用（plan 不为空时只计算）单个服务商的变更
+    """
+    metrics = ServerCfg.metrics
+    changes = await metrics.timed("diff", provider.diff(up_items))
+    for change in changes:
+        change.provider = provider.name
+    if not plan:
+        await metrics.timed("write", provider.apply(changes))
+        for change in changes:
+            metrics.counters[
+                f'changes{{provider="{provider.name}",action="{change.action}"}}'
+            ] += 1
+    provider.report()
+    return changes
 
 
-async def run():
-    if sys.gettrace():
-        log_level = logging.DEBUG
-    else:
-        log_level = logging.INFO
-    logging.basicConfig(
-        format="[%(asctime)s][%(process)d][%(funcName)s (%(filename)s:%(lineno)d)]: [%(levelname)s]: %(message)s",
-        level=log_level,
+async def sync_up_items(
+    providers: list[DnsProvider],
+    up_items: dict[str, list[UpItem]],
+    plan: str | None = None,
+):
+    """
+    并发计算并应用（或输出）各服务商的变更，up_items 为 {服务商名称: 要同步的更新项目}
+    """
+    results = await asyncio.gather(
+        *[
+            sync_provider(provider, up_items[provider.name], plan)
+            for provider in providers
+            if up_items.get(provider.name)
+        ]
     )
-    info("欢迎使用 dns-record-manager，基于 GPL-3.0 协议开源")
-    up_item_list: list[UpItem] = await read_config()
-    setup_credentials()
-    session: aiohttp.ClientSession = aiohttp.ClientSession()
-    regions: list = await select_region(session)
-    for region in regions:
-        region = dns_region.DnsRegion.static_fields[region]
-        # 创建服务客户端
+    if plan:
+        output_plan([change for changes in results for change in changes], plan)
+
+
+def iter_clients(regions: list, log_level: int) -> Iterator[DnsClient]:
+    """
+    按延迟从低到高依次创建各区域的服务客户端，跳过 SDK 中不存在的区域
+    """
+    from huaweicloudsdkdns.v2 import DnsClient
+    from huaweicloudsdkdns.v2.region import dns_region
+    from huaweicloudsdkcore.http.http_handler import HttpHandler
+
+    for index, name in enumerate(regions):
+        region = dns_region.DnsRegion.static_fields.get(name)
+        if region is None:
+            continue
+        if index:
+            forget_region_ranking()
         try:
             if log_level is logging.DEBUG:
-                hwdns_client = (
+                client = (
                     DnsClient.new_builder()
                     .with_credentials(ServerCfg.credentials)
                     .with_region(region)
@@ -585,77 +3768,292 @@ async def run():
                     .build()
                 )
             else:
-                hwdns_client = (
+                client = (
                     DnsClient.new_builder()
                     .with_credentials(ServerCfg.credentials)
                     .with_region(region)
                     # .with_stream_log(log_level)
                     .build()
                 )
-            break
         except ApiValueError:
             continue
-    zones = get_zones(hwdns_client)
-    for up_item in up_item_list:
-        # 查询 源记录 中的 值
-        if up_item.sources:
-            info(f"正在查询 {up_item.name} 设置的 {up_item.record_type} 记录……")
-            up_item.content.extend(
-                await lookup_records(
-                    up_item.sources,
-                    up_item.record_type,
-                    session,
-                    up_item.name,
-                    len(up_item.content),
-                )
-            )
-        recordset_list = get_recordset_list(hwdns_client, zones, up_item)
-        if recordset_list is None:
-            continue
+        info(f"使用 {name} 区域的 API 服务器")
+        yield client
+
+
+def build_api(regions: list, log_level: int) -> HwDnsApi:
+    """
+    创建服务客户端，API 调用失败时依次切换到下一个区域
+    """
+    clients = iter_clients(regions, log_level)
+    client = next(clients, None)
+    if client is None:
+        critical("错误：无法创建华为云 DNS 客户端")
+        sys.exit(1)
+    return HwDnsApi(client, lambda: next(clients, None))
+
+
+def get_config_mtime() -> float:
+    try:
+        return os.stat(ServerCfg.config_filepath).st_mtime
+    except OSError:
+        return 0
+
+
+async def run_daemon(
+    session: aiohttp.ClientSession,
+    api: HwDnsApi | None,
+    providers: list[DnsProvider],
+    up_item_list: list[UpItem],
+):
+    """
+    守护模式：保持会话、客户端、Zone 索引和 IP 数据常驻，按每个更新项目的间隔定时同步，
+    配置文件变化时自动重新加载
+    """
+    info("已进入守护模式")
+    runner = None
+    if ServerCfg.metrics_port:
+        runner = await start_metrics_server(api)
+    try:
+        await daemon_loop(session, api, providers, up_item_list)
+    finally:
+        if runner:
+            await runner.cleanup()
+
+
+async def start_metrics_server(api: HwDnsApi | None):
+    """
+    在 metrics_port 端口提供 Prometheus 格式的 /metrics 和 JSON 格式的 /report
+    """
+    from aiohttp import web
+
+    async def handle_metrics(request: web.Request) -> web.Response:
+        return web.Response(
+            text=ServerCfg.metrics.to_prometheus(api),
+            content_type="text/plain",
+            charset="utf-8",
+        )
+
+    async def handle_report(request: web.Request) -> web.Response:
+        return web.json_response(ServerCfg.metrics.to_dict(api))
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    app.router.add_get("/report", handle_report)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, port=ServerCfg.metrics_port).start()
+    info(f"运行指标地址：http://localhost:{ServerCfg.metrics_port}/metrics")
+    return runner
+
+
+async def daemon_sync(
+    session: aiohttp.ClientSession,
+    providers: list[DnsProvider],
+    due_items: list[UpItem],
+):
+    """
+    守护模式的一次同步，没有出现错误时记录状态
+    """
+    info(f"正在同步 {len(due_items)} 个更新项目……")
+    await ServerCfg.metrics.timed("lookup", resolve_up_items(session, due_items))
+    changed_items = ServerCfg.run_state.changed(due_items)
+    if not changed_items:
+        info("要设置的记录都没有变化，将跳过")
+        return
+    await sync_up_items(providers, changed_items)
+    if not ServerCfg.error_occurred:
+        ServerCfg.run_state.record(changed_items)
+
+
+async def daemon_loop(
+    session: aiohttp.ClientSession,
+    api: HwDnsApi | None,
+    providers: list[DnsProvider],
+    up_item_list: list[UpItem],
+):
+    """
+    守护模式的主循环，每次同步后导出运行指标
+    """
+    loop = asyncio.get_running_loop()
+    metrics = ServerCfg.metrics
+    config_mtime = get_config_mtime()
+    provider_configs = ServerCfg.providers
+    # 与 up_item_list 一一对应的下次同步时间
+    next_runs: list[float] = [0.0] * len(up_item_list)
+    while True:
+        mtime = get_config_mtime()
+        if mtime != config_mtime:
+            config_mtime = mtime
+            info("配置文件已变化，正在重新加载……")
+            reloaded = False
+            try:
+                previous = dict(zip(map(id, up_item_list), next_runs))
+                up_item_list = await read_config()
+                # 没有变化的更新项目沿用原来的同步时间，变化的立即同步
+                next_runs = [previous.get(id(up_item), 0.0) for up_item in up_item_list]
+                reloaded = True
+            except SystemExit:
+                # read_config 失败时不会修改服务器设置
+                error("错误：重新加载配置文件失败，将继续使用原有配置")
+            if reloaded and ServerCfg.providers != provider_configs:
+                if api is None and any(
+                    provider["type"] == "huaweicloud"
+                    for provider in ServerCfg.providers
+                ):
+                    error("错误：新增 huaweicloud 服务商需要重新启动，将继续使用原有的服务商")
+                    ServerCfg.providers = provider_configs
+                else:
+                    info("服务商设置已变化，正在重新创建服务商……")
+                    # 原地替换，退出时由 run() 关闭
+                    providers[:] = build_providers(api)
+                    provider_configs = ServerCfg.providers
+        now = loop.time()
+        due = [i for i, next_run in enumerate(next_runs) if next_run <= now]
+        if due:
+            # 第一次同步的指标包含启动时的各阶段
+            if metrics.run_finished:
+                metrics.start_run()
+            ServerCfg.error_occurred = False
+            due_items = [up_item_list[i] for i in due]
+            try:
+                await daemon_sync(session, providers, due_items)
+            except Exception:
+                # 本次同步失败，守护进程继续运行，到期后重新同步
+                ServerCfg.error_occurred = True
+                logging.exception("错误：同步时出现未处理的异常")
+            if ServerCfg.error_occurred:
+                warning("本次同步中出现错误")
+            metrics.finish_run()
+            metrics.export(api)
+            now = loop.time()
+            for i in due:
+                next_runs[i] = now + (ServerCfg.daemon_interval or up_item_list[i].ttl)
+        delay = min(next_runs, default=now + ServerCfg.config_poll_interval) - now
+        await asyncio.sleep(max(0.0, min(delay, ServerCfg.config_poll_interval)))
+
+
+async def run(plan: str | None = None, daemon: bool = False):
+    """
+    plan 不为空时只计算变更计划并以 JSON 格式输出到 plan 指定的文件（- 为标准输出），不写入；
+    daemon 为 True 时进入守护模式
+    """
+    if sys.gettrace():
+        log_level = logging.DEBUG
+    else:
+        log_level = logging.INFO
+    logging.basicConfig(
+        format="[%(asctime)s][%(process)d][%(funcName)s (%(filename)s:%(lineno)d)]: [%(levelname)s]: %(message)s",
+        level=log_level,
+    )
+    metrics = ServerCfg.metrics
+    logging.getLogger().addHandler(MetricsHandler(metrics))
+    metrics.start_run()
+    info("欢迎使用 dns-record-manager，基于 GPL-3.0 协议开源")
+    with metrics.phase("config"):
+        up_item_list: list[UpItem] = await read_config()
+    ServerCfg.run_state = RunState(ServerCfg.state_filepath)
+    ServerCfg.dns_query_semaphore = asyncio.Semaphore(ServerCfg.dns_query_limit)
+    ServerCfg.dns_cache = DnsCache()
+    ServerCfg.probe_semaphore = asyncio.Semaphore(ServerCfg.probe_limit)
+    ServerCfg.health_cache = HealthCache()
+    if ServerCfg.dns_cache_filepath:
+        ServerCfg.dns_cache.load(ServerCfg.dns_cache_filepath)
+    session: aiohttp.ClientSession = create_session()
+    ServerCfg.ip_db.session = session
+    uses_huawei = any(
+        provider["type"] == "huaweicloud" for provider in ServerCfg.providers
+    )
+    api = None
+    providers: list[DnsProvider] = []
+    try:
+        if daemon:
+            if uses_huawei:
+                with metrics.phase("credentials"):
+                    setup_credentials()
+                regions: list = await metrics.timed("region", select_region(session))
+                api = build_api(regions, log_level)
+                refresh_region_ranking(session)
+            providers = build_providers(api)
+            await run_daemon(session, api, providers, up_item_list)
         else:
-            zone_id, recordsets = recordset_list
-        if not recordsets:
-            if up_item.content:
-                info(f"正在添加 {up_item.name} 设置的 {up_item.record_type} 记录……")
-                add_recordset(hwdns_client, zone_id, up_item)
-                continue
-            else:
-                warning(f"{up_item.name} 没有 {up_item.record_type} 记录需要更新、禁用或添加")
-                continue
-        for recordset in recordsets:
-            debug(f"正在处理 {up_item.name} 的 {recordset.id} 记录集……")
-            query_recordset_result: ListRecordSets = hwdns_client.show_record_set(
-                ShowRecordSetRequest(zone_id, recordset.id)
-            )
-            if query_recordset_result.description is None:
-                query_recordset_result.description = ""
-            if query_recordset_result.description == up_item.description and set(
-                query_recordset_result.records
-            ) == set(up_item.content):
-                info(f"{up_item.name} 的 {query_recordset_result.id} 记录集没有变化，将跳过")
-                continue
-            if query_recordset_result.status != "ACTIVE":
-                info(
-                    f"{up_item.name} 的 {query_recordset_result.id} 记录集状态为 {query_recordset_result.status}，将跳过"
+            # 查询所有更新项目的源记录，同时选择 API 服务器
+            region_task = None
+            if uses_huawei:
+                region_task = asyncio.ensure_future(
+                    metrics.timed("region", select_region(session))
                 )
-                continue
-            if up_item.match_description and not re.search(
-                up_item.match_description, (query_recordset_result.description)
-            ):
-                info(f"{up_item.name} 的 {query_recordset_result.id} 记录集描述不匹配，将跳过")
-                continue
-            if up_item.content:
-                # 更新记录集
-                update_recordset(hwdns_client, zone_id, recordset, up_item)
+            await metrics.timed("lookup", resolve_up_items(session, up_item_list))
+            # 只向各服务商同步要设置的记录有变化的更新项目，输出变更计划时包含所有项目
+            if plan:
+                changed_items = {
+                    provider_name(provider): up_item_list
+                    for provider in ServerCfg.providers
+                }
             else:
-                info(f"{up_item.name} 要设置的 {up_item.record_type} 记录集为空，将禁用现有记录集……")
-                set_recordset_status(hwdns_client, recordset.id, "DISABLE")
-    if session:
+                changed_items = ServerCfg.run_state.changed(up_item_list)
+            if not changed_items:
+                # 不创建客户端，也不导入华为云 SDK
+                info("所有更新项目要设置的记录自上次成功应用以来都没有变化，将跳过")
+                metrics.counters["noop_runs"] += 1
+                if region_task:
+                    region_task.cancel()
+                    await asyncio.gather(region_task, return_exceptions=True)
+            else:
+                if region_task and any(
+                    provider["type"] == "huaweicloud"
+                    and provider_name(provider) in changed_items
+                    for provider in ServerCfg.providers
+                ):
+                    with metrics.phase("credentials"):
+                        setup_credentials()
+                    regions = await region_task
+                    api = build_api(regions, log_level)
+                    refresh_region_ranking(session)
+                elif region_task:
+                    region_task.cancel()
+                    await asyncio.gather(region_task, return_exceptions=True)
+                providers = [
+                    provider
+                    for provider in build_providers(api)
+                    if provider.name in changed_items
+                ]
+                await sync_up_items(providers, changed_items, plan)
+                if not plan and not ServerCfg.error_occurred:
+                    ServerCfg.run_state.record(changed_items)
+    finally:
+        for provider in providers:
+            provider.close()
+        if api:
+            api.close()
+        if ServerCfg.region_refresh_task:
+            await ServerCfg.region_refresh_task
         await session.close()
         info("已关闭会话")
+        if not daemon:
+            metrics.finish_run()
+            metrics.export(api)
     if ServerCfg.error_occurred:
         sys.exit(2)
 
 
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="合并多个 DNS 的记录值并更新到华为云 DNS")
+    parser.add_argument(
+        "--plan",
+        nargs="?",
+        const="-",
+        metavar="FILE",
+        help="只计算变更计划并以 JSON 格式输出到 FILE（默认为标准输出），不进行写入",
+    )
+    parser.add_argument(
+        "--daemon",
+        action="store_true",
+        help="守护模式：常驻运行，按更新项目的 TTL（或 daemon_interval）定时同步",
+    )
+    return parser.parse_args()
+
+
 if __name__ == "__main__":
-    asyncio.run(run())
+    args = parse_args()
+    asyncio.run(run(plan=args.plan, daemon=args.daemon))
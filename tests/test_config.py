@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""
+配置文件：服务器设置的校验和默认值
+"""
+
+
+import json
+import asyncio
+import logging
+
+import pytest
+
+import dns_record_updater as updater
+
+
+SERVER_CONFIG = {
+    "dns_query_server": "https://doh.example.test/dns-query",
+    "max_content_num": 50,
+}
+
+
+def test_defaults():
+    settings = updater.parse_server_config(dict(SERVER_CONFIG))
+    assert settings["dns_query_limit"] == updater.ServerCfg.dns_query_limit
+    assert settings["providers"] == [{"type": "huaweicloud"}]
+    # 默认值是副本，修改不影响下次读取
+    settings["ip_lists_urls"].append("https://mirror.example.test/ip-lists.zip")
+    assert updater.parse_server_config(dict(SERVER_CONFIG))["ip_lists_urls"] == (
+        updater.server_defaults["ip_lists_urls"]
+    )
+
+
+@pytest.mark.parametrize(
+    "key, value",
+    [
+        ("dns_query_limit", "16"),
+        ("probe_limit", 0),
+        ("api_concurrency", 2.5),
+        ("max_content_num", True),
+        ("daemon_interval", -1),
+        ("dns_query_format", "xml"),
+        ("truncate_strategy", "random"),
+        ("api_rate_limits", {"create_record_set_with_line": -1}),
+        ("ip_lists_urls", []),
+    ],
+)
+def test_invalid_setting(caplog, key, value):
+    with caplog.at_level(logging.ERROR):
+        assert updater.parse_server_config({**SERVER_CONFIG, key: value}) is None
+    assert f"server_config.{key}" in caplog.text
+
+
+def test_missing_required(caplog):
+    with caplog.at_level(logging.ERROR):
+        assert updater.parse_server_config({"max_content_num": 50}) is None
+    assert "server_config.dns_query_server" in caplog.text
+
+
+def test_invalid_provider(caplog):
+    config = {**SERVER_CONFIG, "providers": [{"type": "zone_file"}]}
+    with caplog.at_level(logging.ERROR):
+        assert updater.parse_server_config(config) is None
+    assert "server_config.providers[0]" in caplog.text
+
+
+def test_read_config_rejects_bad_type(tmp_path, monkeypatch):
+    path = tmp_path / "dns_record_updater.yaml"
+    path.write_text(
+        json.dumps(
+            {
+                "server_config": {**SERVER_CONFIG, "dns_query_limit": "16"},
+                "update_items": [{"domain": "a.example.test", "type": "A"}],
+            }
+        )
+    )
+    monkeypatch.setattr(updater.ServerCfg, "config_filepath", str(path))
+    monkeypatch.setattr(updater.ServerCfg, "config_cache", updater.ConfigCache())
+    with pytest.raises(SystemExit):
+        asyncio.run(updater.read_config())
+
+
+def test_failed_reload_keeps_settings(tmp_path, monkeypatch):
+    for key in [*updater.server_settings, "providers", "resolvers"]:
+        monkeypatch.setattr(updater.ServerCfg, key, getattr(updater.ServerCfg, key))
+    path = tmp_path / "dns_record_updater.yaml"
+    monkeypatch.setattr(updater.ServerCfg, "config_filepath", str(path))
+    monkeypatch.setattr(updater.ServerCfg, "config_cache", updater.ConfigCache())
+    path.write_text(
+        json.dumps(
+            {
+                "server_config": {
+                    **SERVER_CONFIG,
+                    "providers": [{"type": "zone_file", "path": "./one.zone"}],
+                },
+                "update_items": [{"domain": "a.example.test", "type": "A"}],
+            }
+        )
+    )
+    up_items = asyncio.run(updater.read_config())
+    before = {key: getattr(updater.ServerCfg, key) for key in updater.server_settings}
+    resolvers = updater.ServerCfg.resolvers
+    # 服务器设置有效，但没有可用的更新项目
+    path.write_text(
+        json.dumps(
+            {
+                "server_config": {
+                    "dns_query_server": "https://other.example.test/dns-query",
+                    "max_content_num": 5,
+                    "providers": [{"type": "zone_file", "path": "./two.zone"}],
+                },
+                "update_items": [{"domain": "a.example.test", "type": "BAD"}],
+            }
+        )
+    )
+    with pytest.raises(SystemExit):
+        asyncio.run(updater.read_config())
+    assert updater.ServerCfg.providers == [{"type": "zone_file", "path": "./one.zone"}]
+    assert {
+        key: getattr(updater.ServerCfg, key) for key in updater.server_settings
+    } == before
+    assert updater.ServerCfg.resolvers is resolvers
+    assert updater.ServerCfg.config_cache.up_items is up_items
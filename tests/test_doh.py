@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+"""
+DoH 查询：JSON 与 RFC 8484 格式的结果一致、慢服务器的对冲查询、出错服务器的故障转移
+"""
+
+
+import time
+import asyncio
+
+import pytest
+
+import dns_record_updater as updater
+from fake_servers import FakeDoh, FakeHwDns, FakeServers, synthetic_records
+
+
+@pytest.fixture
+def doh_servers(monkeypatch):
+    """
+    按给定的 (FakeDoh, 格式) 启动 DoH 服务器，并设为 ServerCfg.resolvers
+    """
+    started = []
+
+    def start(*servers: tuple[FakeDoh, str]) -> list[updater.DohResolver]:
+        resolvers = []
+        for doh, fmt in servers:
+            fake = FakeServers(doh, FakeHwDns({}, []))
+            url, _ = fake.start()
+            started.append(fake)
+            resolvers.append(updater.DohResolver(url, wire=fmt == "wire"))
+        monkeypatch.setattr(updater.ServerCfg, "resolvers", resolvers)
+        return resolvers
+
+    monkeypatch.setattr(updater.ServerCfg, "dns_query_timeout", 5)
+    yield start
+    for fake in started:
+        fake.stop()
+
+
+def query(name: str, record_type: str) -> updater.DnsAnswer | None:
+    async def main():
+        updater.ServerCfg.dns_query_semaphore = asyncio.Semaphore(4)
+        session = updater.create_session()
+        try:
+            return await updater.query_record(session, name, record_type)
+        finally:
+            await session.close()
+
+    return asyncio.run(main())
+
+
+@pytest.mark.parametrize("fmt", ["json", "wire"])
+@pytest.mark.parametrize("record_type", ["A", "AAAA"])
+def test_query_formats(doh_servers, fmt, record_type):
+    doh_servers((FakeDoh(records_per_name=3), fmt))
+    answer = query("www.example.test", record_type)
+    assert answer is not None
+    assert answer.follow("www.example.test", record_type)[1] == synthetic_records(
+        "www.example.test", record_type, 3
+    )
+    ((_, ttl),) = answer.rrsets.values()
+    assert ttl == 300
+
+
+@pytest.mark.parametrize("fmt", ["json", "wire"])
+def test_query_no_records(doh_servers, fmt):
+    doh_servers((FakeDoh(), fmt))
+    answer = query("www.example.test", "TXT")
+    assert answer is not None
+    assert answer.follow("www.example.test", "TXT")[1] is None
+    assert answer.negative_ttl == 300
+
+
+def test_wire_matches_json(doh_servers):
+    doh_servers((FakeDoh(), "json"))
+    json_answer = query("cdn.example.test", "A")
+    doh_servers((FakeDoh(), "wire"))
+    wire_answer = query("cdn.example.test", "A")
+    assert wire_answer.rrsets == json_answer.rrsets
+
+
+def test_hedge_after_delay(doh_servers, monkeypatch):
+    monkeypatch.setattr(updater.ServerCfg, "dns_hedge_delay", 0.05)
+    slow, fast = FakeDoh(latency=2), FakeDoh()
+    resolvers = doh_servers((slow, "json"), (fast, "wire"))
+    start = time.monotonic()
+    answer = query("www.example.test", "A")
+    assert answer is not None
+    assert time.monotonic() - start < 1
+    assert (slow.queries, fast.queries) == (1, 1)
+    # 慢服务器的查询被取消，已等待的时间计入其延迟，下次优先使用快的服务器
+    assert resolvers[0].latency >= 0.05
+    assert sorted(resolvers, key=updater.DohResolver.score)[0] is resolvers[1]
+
+
+def test_no_hedge_when_first_answers(doh_servers, monkeypatch):
+    monkeypatch.setattr(updater.ServerCfg, "dns_hedge_delay", 1)
+    first, second = FakeDoh(), FakeDoh()
+    doh_servers((first, "wire"), (second, "json"))
+    assert query("www.example.test", "A") is not None
+    assert (first.queries, second.queries) == (1, 0)
+
+
+def test_failover_on_error(doh_servers, monkeypatch):
+    # 对冲延迟很长，只有第一个服务器出错时才会立即改用下一个
+    monkeypatch.setattr(updater.ServerCfg, "dns_hedge_delay", 10)
+    broken, healthy = FakeDoh(fail=True), FakeDoh()
+    resolvers = doh_servers((broken, "wire"), (healthy, "json"))
+    start = time.monotonic()
+    answer = query("www.example.test", "AAAA")
+    assert answer is not None
+    assert time.monotonic() - start < 5
+    assert (broken.queries, healthy.queries) == (1, 1)
+    assert (resolvers[0].errors, resolvers[1].errors) == (1, 0)
+    # 失败的服务器排到后面，之后的查询不再先等待它
+    assert resolvers[0].score() > resolvers[1].score()
+    assert query("www.example.test", "A") is not None
+    assert (broken.queries, healthy.queries) == (1, 2)
+
+
+def test_never_successful_resolver_ranks_last(monkeypatch):
+    monkeypatch.setattr(updater.ServerCfg, "dns_hedge_delay", 0.2)
+    bad, good, new = (updater.DohResolver(f"https://{n}.test/dns-query") for n in "bgn")
+    for _ in range(50):
+        bad.record(None)
+    good.record(0.05)
+    assert new.score() == 0
+    assert sorted([bad, good, new], key=updater.DohResolver.score) == [new, good, bad]
+
+
+def test_all_resolvers_fail(doh_servers, monkeypatch):
+    monkeypatch.setattr(updater.ServerCfg, "dns_hedge_delay", 0.01)
+    doh_servers((FakeDoh(fail=True), "wire"), (FakeDoh(fail=True), "json"))
+    assert query("www.example.test", "A") is None
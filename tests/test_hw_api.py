@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""
+华为云 DNS API 封装：限流重试、切换区域，以及不重复发送新增请求
+"""
+
+
+import asyncio
+import types
+
+import pytest
+from huaweicloudsdkcore.exceptions.exceptions import (
+    ClientRequestException,
+    RequestTimeoutException,
+    SdkError,
+    ServerResponseException,
+)
+
+import dns_record_updater as updater
+
+
+class StubClient:
+    """
+    按顺序返回 results 中的结果，异常实例会被抛出；calls 记录调用的方法名
+    """
+
+    def __init__(self, results: list, recordsets: list | None = None):
+        self.results = list(results)
+        self.recordsets = recordsets or []
+        self.calls: list[str] = []
+
+    def respond(self, method: str):
+        self.calls.append(method)
+        result = self.results.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def create_record_set_with_line(self, request):
+        return self.respond("create_record_set_with_line")
+
+    def show_record_set(self, request):
+        return self.respond("show_record_set")
+
+    def list_record_sets_by_zone(self, request):
+        self.calls.append("list_record_sets_by_zone")
+        return types.SimpleNamespace(recordsets=self.recordsets, links=None)
+
+
+def throttled() -> ClientRequestException:
+    return ClientRequestException(429, SdkError("req", "APIGW.0308", "throttled"))
+
+
+def server_error() -> ServerResponseException:
+    return ServerResponseException(503, SdkError("req", "DNS.0500", "unavailable"))
+
+
+@pytest.fixture(autouse=True)
+def fast_retries(monkeypatch):
+    monkeypatch.setattr(updater.ServerCfg, "api_retries", 2)
+    monkeypatch.setattr(updater.ServerCfg, "api_retry_base_delay", 0.001)
+    monkeypatch.setattr(updater.ServerCfg, "api_retry_max_delay", 0.001)
+    monkeypatch.setattr(updater.ServerCfg, "api_rate_limit", 0)
+    monkeypatch.setattr(updater.ServerCfg, "api_rate_limits", {})
+    monkeypatch.setattr(updater.ServerCfg, "error_occurred", False)
+
+
+def make_api(*clients: StubClient) -> updater.HwDnsApi:
+    others = iter(clients[1:])
+    return updater.HwDnsApi(clients[0], lambda: next(others, None))
+
+
+UP_ITEM = updater.UpItem("a.example.test.", "A", [], ["192.0.2.1"], "", "", 300)
+
+
+def test_throttled_create_is_retried():
+    client = StubClient([throttled(), throttled(), "created"])
+    api = make_api(client)
+    assert asyncio.run(api.call("create_record_set_with_line", None)) == "created"
+    assert client.calls == ["create_record_set_with_line"] * 3
+    assert (api.calls, api.retries, api.throttled) == (3, 2, 2)
+
+
+def test_throttled_gives_up_after_retries():
+    api = make_api(StubClient([throttled()] * 3))
+    with pytest.raises(ClientRequestException):
+        asyncio.run(api.call("show_record_set", None))
+    assert api.retries == 2
+
+
+def test_timed_out_create_is_confirmed_not_resent():
+    first = StubClient([RequestTimeoutException("timeout")])
+    recordset = types.SimpleNamespace(
+        name="a.example.test.", type="A", records=["192.0.2.1"]
+    )
+    second = StubClient([], recordsets=[recordset])
+    api = make_api(first, second)
+    assert asyncio.run(updater.add_recordset(api, "zone", UP_ITEM))
+    assert first.calls == ["create_record_set_with_line"]
+    # 新增请求只发送一次，切换区域后用查询确认
+    assert second.calls == ["list_record_sets_by_zone"]
+    assert not updater.ServerCfg.error_occurred
+
+
+def test_timed_out_create_not_found_is_an_error():
+    api = make_api(StubClient([RequestTimeoutException("timeout")]))
+    assert not asyncio.run(updater.add_recordset(api, "zone", UP_ITEM))
+    assert updater.ServerCfg.error_occurred
+
+
+def test_idempotent_call_switches_region():
+    first = StubClient([server_error()])
+    second = StubClient(["shown"])
+    api = make_api(first, second)
+    assert asyncio.run(api.call("show_record_set", None)) == "shown"
+    assert api.client is second
+    assert (first.calls, second.calls) == (["show_record_set"], ["show_record_set"])
+    assert api.retries == 1 and api.retries_by_method["show_record_set"] == 1
+
+
+def test_idempotent_call_gives_up_after_retries():
+    first = StubClient([server_error()])
+    second = StubClient([server_error()] * 3)
+    api = make_api(first, second)
+    with pytest.raises(ServerResponseException):
+        asyncio.run(api.call("show_record_set", None))
+    # 切换一次区域，之后在最后一个区域重试 api_retries 次
+    assert len(second.calls) == 3
+    assert api.retries == 3
@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+"""
+运营商 IP 地址索引：最长前缀匹配、编译文件的保存和加载，以及按运营商随机选取 IP
+"""
+
+
+import time
+import random
+import asyncio
+import zipfile
+import ipaddress
+
+import pytest
+
+import dns_record_updater as updater
+from dns_record_updater import IpIndex
+
+
+IP_LISTS = {
+    "chinanet": ["10.0.0.0/8", "10.1.2.0/24", "240e::/20", ""],
+    "cmcc": ["10.1.0.0/16", "2409:8000::/20", "not-a-cidr"],
+    "unicom": ["10.1.0.0/16", "255.255.255.0/24"],
+}
+
+
+def brute_force(ip_lists: dict[str, list[str]], ip: str) -> str:
+    """
+    逐个比较所有前缀的最长前缀匹配，同一前缀以先出现的运营商为准
+    """
+    address = ipaddress.ip_address(ip)
+    best, best_len = "other", -1
+    for org, cidrs in ip_lists.items():
+        for cidr in cidrs:
+            try:
+                network = ipaddress.ip_network(cidr, strict=False)
+            except ValueError:
+                continue
+            if address in network and network.prefixlen > best_len:
+                best, best_len = org, network.prefixlen
+    return best
+
+
+@pytest.mark.parametrize(
+    "ip, org",
+    [
+        ("9.255.255.255", "other"),
+        ("10.0.0.1", "chinanet"),
+        ("10.1.0.1", "cmcc"),
+        ("10.1.2.3", "chinanet"),
+        ("10.1.3.0", "cmcc"),
+        ("10.255.255.255", "chinanet"),
+        ("11.0.0.0", "other"),
+        ("255.255.255.255", "unicom"),
+        ("240e::1", "chinanet"),
+        ("2409:8000::1", "cmcc"),
+        ("::1", "other"),
+    ],
+)
+def test_lookup(ip, org):
+    assert IpIndex.build(IP_LISTS).lookup(ip) == org
+
+
+def test_lookup_invalid_ip():
+    with pytest.raises(ValueError):
+        IpIndex.build(IP_LISTS).lookup("10.0.0")
+
+
+def test_flatten():
+    # 内层前缀覆盖外层的前半部分，外层结束后没有运营商
+    assert IpIndex._flatten([(0, 255, 0), (0, 127, 1)], 2**32) == (
+        [0, 128, 256],
+        [1, 0, IpIndex.NO_ORG],
+    )
+    # 相邻的同一运营商区间合并，到达地址空间末尾时不再输出区间
+    assert IpIndex._flatten([(0, 127, 0), (128, 255, 0)], 256) == ([0], [0])
+
+
+def test_matches_brute_force():
+    rng = random.Random(1)
+    ip_lists: dict[str, list[str]] = {org: [] for org in ("a", "b", "c")}
+    for _ in range(300):
+        prefixlen = rng.randint(8, 28)
+        network = ipaddress.ip_network(
+            (rng.randrange(2**32) & (2**32 - 2 ** (32 - prefixlen)), prefixlen)
+        )
+        # 集中在少数 /8 中，使前缀大量嵌套
+        network = ipaddress.ip_network(
+            (int(network.network_address) & 0x03FFFFFF | 0x0A000000, prefixlen)
+        )
+        ip_lists[rng.choice("abc")].append(str(network))
+    index = IpIndex.build(ip_lists)
+    for _ in range(500):
+        ip = str(ipaddress.IPv4Address(0x0A000000 | rng.randrange(2**26)))
+        assert index.lookup(ip) == brute_force(ip_lists, ip), ip
+    assert index.lookup_many(["9.0.0.0", "10.0.0.0"]) == [
+        "other",
+        brute_force(ip_lists, "10.0.0.0"),
+    ]
+
+
+def test_org_ranges_merged():
+    index = IpIndex.build({"a": ["10.0.0.0/25", "10.0.0.128/25", "10.0.0.64/26"]})
+    starts, ends = index.org_ranges["a"][4]
+    assert (list(starts), list(ends)) == (
+        [int(ipaddress.IPv4Address("10.0.0.0"))],
+        [int(ipaddress.IPv4Address("10.0.0.255"))],
+    )
+
+
+DIGEST = bytes(range(32))
+
+
+def test_save_load_round_trip(tmp_path):
+    built = IpIndex.build(IP_LISTS)
+    path = str(tmp_path / "ip-lists.idx")
+    built.save(path, DIGEST)
+    loaded = IpIndex.load(path, DIGEST)
+    assert loaded is not None and loaded.buffer is not None
+    assert loaded.orgs == built.orgs
+    for ip in ("10.0.0.1", "10.1.0.1", "10.1.2.3", "11.0.0.0", "255.255.255.1"):
+        assert loaded.lookup(ip) == built.lookup(ip)
+    for ip in ("240e::1", "2409:8000::1", "::1"):
+        assert loaded.lookup(ip) == built.lookup(ip)
+    for org in built.orgs:
+        for version in (4, 6):
+            assert [list(part) for part in loaded.org_ranges[org][version]] == [
+                list(part) for part in built.org_ranges[org][version]
+            ]
+
+
+def test_load_rejects_stale_or_corrupt(tmp_path):
+    path = tmp_path / "ip-lists.idx"
+    assert IpIndex.load(str(path), DIGEST) is None
+    IpIndex.build(IP_LISTS).save(str(path), DIGEST)
+    # 数据包已变化
+    assert IpIndex.load(str(path), bytes(32)) is None
+    data = path.read_bytes()
+    # 文件不完整
+    path.write_bytes(data[:-16])
+    assert IpIndex.load(str(path), DIGEST) is None
+    # 不是索引文件
+    path.write_bytes(b"X" + data[1:])
+    assert IpIndex.load(str(path), DIGEST) is None
+    path.write_bytes(b"")
+    assert IpIndex.load(str(path), DIGEST) is None
+
+
+def write_ip_lists(path, ip_lists: dict[str, list[str]]):
+    with zipfile.ZipFile(path, "w") as f:
+        for org, cidrs in ip_lists.items():
+            f.writestr(f"china-operator-ip-ip-lists/{org}.txt", "\n".join(cidrs))
+
+
+def test_load_ip_org_compiles_once(tmp_path, monkeypatch):
+    zip_path = tmp_path / "ip-lists.zip"
+    idx_path = tmp_path / "ip-lists.idx"
+    monkeypatch.setattr(updater.ServerCfg, "ip_lists_filepath", str(zip_path))
+    monkeypatch.setattr(updater.ServerCfg, "ip_index_filepath", str(idx_path))
+    write_ip_lists(zip_path, IP_LISTS)
+    # 数据包是刚写入的，不会下载
+    index = asyncio.run(updater.load_ip_org(None))
+    assert index.buffer is None and idx_path.exists()
+    index = asyncio.run(updater.load_ip_org(None))
+    assert index.buffer is not None
+    assert index.lookup("10.1.2.3") == "chinanet"
+    # 数据包变化后重新编译
+    write_ip_lists(zip_path, {"cmcc": ["10.0.0.0/8"]})
+    index = asyncio.run(updater.load_ip_org(None))
+    assert index.buffer is None
+    assert index.lookup("10.1.2.3") == "cmcc"
+
+
+@pytest.fixture
+def ip_db(monkeypatch):
+    db = updater.IpDatabase()
+    db.index = IpIndex.build(
+        {
+            "chinanet": ["10.0.0.0/30", "10.0.1.0/24", "240e::/20"],
+            "cmcc": ["10.2.0.0/30"],
+        }
+    )
+    db.index_loaded_at = time.time()
+    monkeypatch.setattr(updater.ServerCfg, "ip_db", db)
+    return db
+
+
+def test_choose_ips_seeded(ip_db):
+    first = asyncio.run(updater.choose_ips(20, "chinanet", seed=7))
+    assert first == asyncio.run(updater.choose_ips(20, "chinanet", seed=7))
+    assert first != asyncio.run(updater.choose_ips(20, "chinanet", seed=8))
+    assert len(set(first)) == 20
+    networks = [
+        ipaddress.ip_network(cidr)
+        for cidr in ("10.0.0.0/30", "10.0.1.0/24", "240e::/20")
+    ]
+    for ip in first:
+        address = ipaddress.ip_address(ip)
+        assert any(
+            address in network
+            for network in networks
+            if network.version == address.version
+        )
+
+
+def test_choose_ips_small_org(ip_db):
+    # 请求数量超过地址总数时返回全部地址
+    ips = asyncio.run(updater.choose_ips(10, "cmcc", seed=1))
+    assert sorted(ips) == [f"10.2.0.{i}" for i in range(4)]
+    assert asyncio.run(updater.choose_ips(3, "unknown", seed=1)) == []
+
+
+def test_sample_offsets():
+    rng = random.Random(3)
+    offsets = updater.sample_offsets(2**128, 50, rng)
+    assert len(set(offsets)) == 50 and all(0 <= offset < 2**128 for offset in offsets)
+    assert sorted(updater.sample_offsets(5, 10, rng)) == [0, 1, 2, 3, 4]
+
+
+def test_failed_save_leaves_no_temp_file(tmp_path):
+    # 目标路径是目录，替换失败
+    path = tmp_path / "ip-lists.idx"
+    path.mkdir()
+    with pytest.raises(OSError):
+        IpIndex.build(IP_LISTS).save(str(path), DIGEST)
+    assert [p.name for p in tmp_path.iterdir()] == ["ip-lists.idx"]
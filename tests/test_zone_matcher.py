@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+"""
+按最长后缀匹配域名所属的 Zone
+"""
+
+
+import types
+
+import pytest
+
+import dns_record_updater as updater
+
+
+ZONES = [
+    types.SimpleNamespace(id="outer", name="skimit.net."),
+    types.SimpleNamespace(id="inner", name="play.skimit.net."),
+    types.SimpleNamespace(id="other", name="Example.Test"),
+]
+
+
+@pytest.mark.parametrize(
+    "name, zone_id",
+    [
+        ("skimit.net.", "outer"),
+        ("www.skimit.net.", "outer"),
+        # 嵌套的 Zone 取最长的后缀，与列表顺序无关
+        ("play.skimit.net.", "inner"),
+        ("no-srv.play.skimit.net.", "inner"),
+        ("_minecraft._tcp.play.skimit.net", "inner"),
+        # 按标签匹配，而不是字符串后缀
+        ("askimit.net.", None),
+        ("replay.skimit.net.", "outer"),
+        # 大小写和结尾的 . 不影响匹配
+        ("WWW.EXAMPLE.TEST", "other"),
+        ("net.", None),
+    ],
+)
+def test_match(name, zone_id):
+    for zones in (ZONES, ZONES[::-1]):
+        zone = updater.ZoneMatcher(zones).match(name)
+        assert (zone.id if zone else None) == zone_id